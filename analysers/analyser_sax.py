@@ -24,14 +24,123 @@ from Analyser import Analyser
 
 import sys, os
 import importlib
+import multiprocessing, collections
+import time, json, heapq
 from modules import OsmoseLog
 
 ###########################################################################
 
+# Analyser in worker processes, set while forking them
+_worker = None
+
+def _WorkerInit():
+    # reader connections of the main process are not shared, they are kept
+    # referenced so that they are not closed from here
+    _worker._parent_reader = _worker._reader
+    _worker._load_reader()
+
+def _WorkerRun(args):
+    (kind, datas) = args
+    calls = _worker.pluginsCalls[kind]
+    res = _worker._RunPlugins(kind, datas, _worker.pluginsParallelDispatch[kind])
+    return (res, _worker.pluginsCalls[kind] - calls)
+
+###########################################################################
+
+class _MethodProfile(object):
+    """
+    Plugin method counting its calls, their time and the errors returned,
+    and keeping the ids of its slowest objects, up to slow of them. With a
+    time budget in seconds, longer calls are logged once they return: they
+    are not interrupted, plugins are not left half way on an object.
+    """
+
+    def __init__(self, meth, kind, log, budget = None, slow = 10):
+        self.meth = meth
+        self.im_self = meth.im_self
+        self.kind = kind
+        self.log = log
+        self.budget = budget
+        self.slow = slow
+        self.calls = 0
+        self.time = 0.0
+        self.max_time = 0.0
+        self.errors = 0
+        self.over_budget = 0
+        # heap of (time, id, tag keys)
+        self.slowest = []
+
+    def __call__(self, data, tags, *args):
+        t0 = time.time()
+        res = self.meth(data, tags, *args)
+        t = time.time() - t0
+
+        self.calls += 1
+        self.time += t
+        if t > self.max_time:
+            self.max_time = t
+        if res:
+            self.errors += len(res)
+        if len(self.slowest) < self.slow:
+            heapq.heappush(self.slowest, (t, data["id"], self._Keys(tags)))
+        elif self.slowest and t > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (t, data["id"], self._Keys(tags)))
+        if self.budget and t > self.budget:
+            self.over_budget += 1
+            self.log(u"%s on %s %d: %.3fs over time budget" % (self.im_self.__class__.__name__, self.kind, data["id"], t))
+        return res
+
+    def _Keys(self, tags):
+        # tag keys triggering the plugin
+        keys = self.im_self.trigger_keys
+        if keys is None:
+            return sorted(tags)
+        return sorted(k for k in tags if k in keys)
+
+    def report(self):
+        return {"calls": self.calls, "time": self.time, "max_time": self.max_time, "errors": self.errors,
+                "over_budget": self.over_budget}
+
+###########################################################################
+
+class _TagsMemo(object):
+    """
+    Plugin method whose result depends only on tags, keeping results of
+    the size tag sets used last.
+    """
+
+    def __init__(self, meth, size):
+        self.meth = meth
+        self.im_self = meth.im_self
+        self.size = size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, data, tags, *args):
+        key = frozenset(tags.iteritems())
+        cache = self.cache
+        try:
+            res = cache.pop(key)
+            self.hits += 1
+        except KeyError:
+            res = self.meth(data, tags, *args)
+            self.misses += 1
+            if len(cache) >= self.size:
+                cache.popitem(False)
+        cache[key] = res
+        return res
+
+###########################################################################
+
 class Analyser_Sax(Analyser):
 
     def __init__(self, config, logger = OsmoseLog.logger()):
         Analyser.__init__(self, config, logger)
+        self._pool = None
+        self._coords = None
+        # coordinates of nodes are given apart by the parser
+        self._coords_apart = False
 
     def __enter__(self):
         Analyser.__enter__(self)
@@ -91,17 +200,33 @@ class Analyser_Sax(Analyser):
     ################################################################################
     #### Reader
 
+    # without reader, when node_coordinates replaces it, objects are not
+    # found
+
     def NodeGet(self, NodeId):
-        return self._reader.NodeGet(NodeId)
+        return self._reader and self._reader.NodeGet(NodeId)
 
     def WayGet(self, WayId):
-        return self._reader.WayGet(WayId)
+        return self._reader and self._reader.WayGet(WayId)
 
     def RelationGet(self, RelationId):
-        return self._reader.RelationGet(RelationId)
+        return self._reader and self._reader.RelationGet(RelationId)
 
     def UserGet(self, UserId):
-        return self._reader.UserGet(UserId)
+        return self._reader and self._reader.UserGet(UserId)
+
+    def NodePosition(self, NodeId):
+        """
+        (lat, lon) of a node, from coordinates kept while reading with
+        node_coordinates, or from the reader. None if not found. Plugins
+        in worker processes only get positions from the reader.
+        """
+        c = self._coords and self._coords.NodeGet(NodeId)
+        if c:
+            return c
+        node = self.NodeGet(NodeId)
+        if node:
+            return (node[u"lat"], node[u"lon"])
 
     def ExtendData(self, data):
         if "uid" in data and not "user" in data:
@@ -110,6 +235,19 @@ class Analyser_Sax(Analyser):
                 data["user"] = user
         return data
 
+    def CreateKeys(self, kind):
+        """
+        Tag keys of interest for created objects of kind "Node", "Way" or
+        "Relation", None for all objects. Readers skip other objects.
+        On change files, all objects are needed to remove previous errors.
+        """
+        if self.parsing_change_file:
+            return None
+        if self._coords and (kind == "Way" or kind == "Node" and not self._coords_apart):
+            # filtered here, after keeping coordinates
+            return None
+        return self.pluginsKeys[kind.lower()]
+
     ################################################################################
     #### Logs
 
@@ -125,122 +263,341 @@ class Analyser_Sax(Analyser):
     def _subcpt(self, txt):
         self.logger.sub().cpt(txt)
 
+    ################################################################################
+    #### Errors
+
+    def _GetMany(self, kind, ids):
+        # objects from the reader, in one call when the reader supports it
+        if not self._reader or not ids:
+            return [None] * len(ids)
+        many = getattr(self._reader, kind + "GetMany", None)
+        if many:
+            return many(ids)
+        get = getattr(self._reader, kind + "Get")
+        return [get(i) for i in ids]
+
+    def _NodePositions(self, ids):
+        # nodes, or only their position when found in kept coordinates
+        if not self._coords:
+            return self._GetMany("Node", ids)
+        res = []
+        missing = []
+        for NodeId in ids:
+            c = self._coords.NodeGet(NodeId)
+            if c:
+                res.append({u"id": NodeId, u"lat": c[0], u"lon": c[1]})
+            else:
+                res.append(None)
+                missing.append(NodeId)
+        if missing:
+            found = dict(zip(missing, self._GetMany("Node", missing)))
+            res = [r or found[NodeId] for (NodeId, r) in zip(ids, res)]
+        return res
+
+    def _WayFirstNodes(self, ids):
+        # id of the first node of ways, None for ways not found
+        first = {}
+        missing = []
+        for WayId in ids:
+            n = self._coords and self._coords.WayFirstNode(WayId)
+            if n is None:
+                missing.append(WayId)
+            else:
+                first[WayId] = n
+        for (WayId, way) in zip(missing, self._GetMany("Way", missing)):
+            first[WayId] = way[u"nd"][0] if way and way[u"nd"] else None
+        return first
+
+    def _error(self, err, data, type, position):
+        for e in err:
+            try:
+                if isinstance(e, tuple):
+                    classs = e[0]
+                    subclass = e[1]
+                    text = e[2]
+                    fix = e[2].get("fix")
+                    if fix:
+                        # errors can be cached, they are not changed
+                        text = dict(text)
+                        del text["fix"]
+                else:
+                    classs = e["class"]
+                    subclass = e["subclass"]
+                    text = e.get("text", {})
+                    fix = e.get("fix")
+
+                self.error_file.error(
+                    classs,
+                    subclass,
+                    text,
+                    [data["id"]],
+                    [type],
+                    fix,
+                    {"position": [position], type: [data]})
+            except:
+                print("Error on error", e, "from", err)
+                raise
+
+    ################################################################################
+    #### Plugins
+
+    def _Dispatch(self, meths):
+        """
+        Index of plugin methods meths, a list of (method index, method), as
+        the methods always called and the methods called by tag key.
+        """
+        always = []
+        index = {}
+        for meth in meths:
+            keys = meth[1].im_self.trigger_keys
+            if keys is None:
+                always.append(meth)
+            else:
+                for k in keys:
+                    index.setdefault(k, []).append(meth)
+        return (always, index)
+
+    def _Select(self, dispatch, tags):
+        # methods to call for tags, in plugin order
+        (always, index) = dispatch
+        meths = [m for k in tags if k in index for m in index[k]]
+        if not meths:
+            return always
+        return sorted(set(always + meths))
+
+    def _RunPlugins(self, kind, datas, dispatch):
+        """
+        Run plugin methods from dispatch on datas, each object getting the
+        methods of the plugins triggered by its tags. Return a list of
+        (object index, [(method index, errors)]) for objects with errors.
+        """
+        res = []
+        calls = 0
+        if kind == "node":
+            for (i, data) in enumerate(datas):
+                tags = data[u"tag"]
+                if tags == {}:
+                    continue
+
+                # On execute les jobs
+                meths = self._Select(dispatch, tags)
+                calls += len(meths)
+                r = []
+                for (j, meth) in meths:
+                    e = meth(data, tags)
+                    if e:
+                        r.append((j, e))
+                if r:
+                    res.append((i, r))
+
+        elif kind == "way":
+            for (i, data) in enumerate(datas):
+                tags = data[u"tag"]
+                nds  = data[u"nd"]
+
+                meths = self._Select(dispatch, tags)
+                calls += len(meths)
+                r = []
+                for (j, meth) in meths:
+                    e = meth(data, tags, nds)
+                    if e:
+                        r.append((j, e))
+                if r:
+                    res.append((i, r))
+
+        else:
+            for (i, data) in enumerate(datas):
+                tags = data[u"tag"]
+                members = data[u"member"]
+
+                meths = self._Select(dispatch, tags)
+                calls += len(meths)
+                r = []
+                for (j, meth) in meths:
+                    e = meth(data, tags, members)
+                    if e:
+                        r.append((j, e))
+                if r:
+                    res.append((i, r))
+
+        self.pluginsCalls[kind] += calls
+        return res
+
+    def _Create(self, kind, datas):
+        # plugins are run on all objects, then errors are recorded, with
+        # missing data fetched from the reader at once
+        if self._coords:
+            datas = self._KeepCoordinates(kind, datas)
+            if not datas:
+                return
+        if self.parsing_change_file:
+            self._changed[kind].update([data["id"] for data in datas])
+        if kind == "node":
+            # nodes without tags are not given to plugins
+            self.pluginsObjects[kind] += len([data for data in datas if data[u"tag"]])
+        else:
+            self.pluginsObjects[kind] += len(datas)
+        if self._pool:
+            self._Submit(kind, datas)
+        else:
+            self._Record(kind, datas, self._RunPlugins(kind, datas, self.pluginsDispatch[kind]))
+
+    def _CallsAvoided(self, kind):
+        # calls of plugin methods skipped by tag keys, out of the calls of
+        # all methods on the objects given to plugins
+        return self.pluginsObjects[kind] * len(self.pluginsMethodes[kind]) - self.pluginsCalls[kind]
+
+    def _KeepCoordinates(self, kind, datas):
+        # all nodes, unless their coordinates are given apart, and ways are
+        # given by the reader for their coordinates, then filtered on tag
+        # keys as readers do
+        if kind == "node" and not self._coords_apart:
+            add = self._coords.NodeAdd
+            for data in datas:
+                add(data[u"id"], data[u"lat"], data[u"lon"])
+        elif kind == "way":
+            add = self._coords.WayAdd
+            for data in datas:
+                add(data[u"id"], data[u"nd"])
+        keys = self.pluginsKeys[kind]
+        if keys is not None:
+            datas = [data for data in datas if not keys.isdisjoint(data[u"tag"])]
+        return datas
+
+    def _Record(self, kind, datas, res):
+        errs = []
+        for (i, r) in res:
+            err = []
+            for (j, e) in r:
+                err += e
+            errs.append((datas[i], err))
+        if kind == "node":
+            self._NodeErrors(errs)
+        elif kind == "way":
+            self._WayErrors(errs)
+        else:
+            self._RelationErrors(errs)
+
+    ################################################################################
+    #### Worker processes
+
+    def _StartPool(self, processes):
+        """
+        Fork processes running plugins without state across objects, on
+        blocks of objects. Plugins are already initialised and shared with
+        the workers. Errors are recorded by this process, in input order.
+        """
+        global _worker
+        _worker = self
+        self._pool = multiprocessing.Pool(processes, _WorkerInit)
+        self._pending = collections.deque()
+        self._max_pending = 2 * processes
+        _worker = None
+        self._sublog(u"%d worker processes" % processes)
+
+    def _Submit(self, kind, datas):
+        self._pending.append((kind, datas, self._pool.apply_async(_WorkerRun, ((kind, datas),))))
+        while len(self._pending) > self._max_pending:
+            self._Merge()
+
+    def _Merge(self):
+        # errors of the oldest block, from the workers and from the plugins
+        # running here, in the order of plugins
+        (kind, datas, result) = self._pending.popleft()
+        (res, calls) = result.get()
+        res = dict(res)
+        self.pluginsCalls[kind] += calls
+        if self.pluginsLocalMethodes[kind]:
+            for (i, r) in self._RunPlugins(kind, datas, self.pluginsLocalDispatch[kind]):
+                res[i] = sorted(res.get(i, []) + r, key=lambda x: x[0])
+        self._Record(kind, datas, sorted(res.items()))
+
+    def _Drain(self):
+        if self._pool:
+            while self._pending:
+                self._Merge()
+
+    def _StopPool(self, ok):
+        if ok:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
     ################################################################################
     #### Node parsing
 
     def NodeCreate(self, data):
+        self._Create("node", [data])
 
-        # Initialisation
-        err  = []
-        tags = data[u"tag"]
+    def NodeCreateMany(self, datas):
+        self._Create("node", datas)
 
-        if tags == {}:
-            return
+    def NodeCoordinatesMany(self, coords):
+        # (id, lon, lat) of all nodes, from parsers giving them apart
+        add = self._coords.NodeAdd
+        for (NodeId, lon, lat) in coords:
+            add(NodeId, lat, lon)
 
-        # On execute les jobs
-        for meth in self.pluginsNodeMethodes:
-            res = meth(data, tags)
-            if res:
-                err += res
+    def _NodeErrors(self, errs):
+        if not errs:
+            return
 
         # Enregistrement des erreurs
-        if err:
-            if not "uid" in data and not "user" in data:
-                data = self.NodeGet(data["id"])
+        ids = [data["id"] for (data, err) in errs if not "uid" in data and not "user" in data]
+        full = dict(zip(ids, self._GetMany("Node", ids)))
+        for (data, err) in errs:
+            if full.get(data["id"]):
+                # no node without reader
+                data = full[data["id"]]
             data = self.ExtendData(data)
-            for e in err:
-                try:
-                    if isinstance(e, tuple):
-                        classs = e[0]
-                        subclass = e[1]
-                        text = e[2]
-                        fix = e[2].get("fix")
-                        if e[2].get("fix"):
-                            del e[2]["fix"]
-                    else:
-                        classs = e["class"]
-                        subclass = e["subclass"]
-                        text = e.get("text", {})
-                        fix = e.get("fix")
-
-                    self.error_file.error(
-                        classs,
-                        subclass,
-                        text,
-                        [data["id"]],
-                        ["node"],
-                        fix,
-                        {"position": [data], "node": [data]})
-                except:
-                    print("Error on error", e, "from", err)
-                    raise
+            self._error(err, data, "node", data)
 
     def NodeUpdate(self, data):
+        self._modified["node"].add(data["id"])
         self.NodeDelete(data)
         self.NodeCreate(data)
 
     def NodeDelete(self, data):
+        self._changed["node"].add(data["id"])
+        self._Drain()
         self.error_file.node_delete(data["id"])
 
     ################################################################################
     #### Way parsing
 
     def WayCreate(self, data):
+        self._Create("way", [data])
 
-        # Initialisation
-        err  = []
-        tags = data[u"tag"]
-        nds  = data[u"nd"]
+    def WayCreateMany(self, datas):
+        self._Create("way", datas)
 
-        # On execute les jobs
-        for meth in self.pluginsWayMethodes:
-            res = meth(data, tags, nds)
-            if res:
-                err += res
+    def _WayErrors(self, errs):
+        if not errs:
+            return
 
         # Enregistrement des erreurs
-        if err:
-            if not "uid" in data and not "user" in data:
-                tmp_data = self.WayGet(data["id"])
-                if tmp_data:
-                    # way from reader can be None if there is only one node on it
-                    data = tmp_data
-            node = self.NodeGet(nds[len(nds)/2])
+        ids = [data["id"] for (data, err) in errs if not "uid" in data and not "user" in data]
+        full = dict(zip(ids, self._GetMany("Way", ids)))
+        nodes = self._NodePositions([data[u"nd"][len(data[u"nd"])/2] for (data, err) in errs])
+        for ((data, err), node) in zip(errs, nodes):
+            if full.get(data["id"]):
+                # way from reader can be None if there is only one node on it
+                data = full[data["id"]]
             if not node:
                 node = {u"lat":0, u"lon":0}
             data = self.ExtendData(data)
-            for e in err:
-                try:
-                    if isinstance(e, tuple):
-                        classs = e[0]
-                        subclass = e[1]
-                        text = e[2]
-                        fix = e[2].get("fix")
-                        if e[2].get("fix"):
-                            del e[2]["fix"]
-                    else:
-                        classs = e["class"]
-                        subclass = e["subclass"]
-                        text = e.get("text", {})
-                        fix = e.get("fix")
-
-                    self.error_file.error(
-                        classs,
-                        subclass,
-                        text,
-                        [data["id"]],
-                        ["way"],
-                        fix,
-                        {"position": [node], "way": [data]})
-                except:
-                    print("Error on error", e, "from", err)
-                    raise
+            self._error(err, data, "way", node)
 
     def WayUpdate(self, data):
+        self._modified["way"].add(data["id"])
         self.WayDelete(data)
         self.WayCreate(data)
 
     def WayDelete(self, data):
+        self._changed["way"].add(data["id"])
+        self._Drain()
         self.error_file.way_delete(data["id"])
 
     ################################################################################
@@ -258,69 +615,82 @@ class Analyser_Sax(Analyser):
             if node:
                 break
         if not node:
-            for memb in data[u"member"]:
-                if memb[u"type"] == u"relation":
-                    rel = self.RelationGet(memb[u"ref"])
-                    if rel:
-                        node = self.locateRelation(rel)
-                if node:
-                    break
+            node = self._locateSubRelation(data)
         return node
 
-    def RelationCreate(self, data):
+    def _locateSubRelation(self, data):
+        node = None
+        for memb in data[u"member"]:
+            if memb[u"type"] == u"relation":
+                rel = self.RelationGet(memb[u"ref"])
+                if rel:
+                    node = self.locateRelation(rel)
+            if node:
+                break
+        return node
+
+    def _LocateRelations(self, datas):
+        """
+        Positions of relations, as locateRelation, with members fetched
+        from kept coordinates or from the reader in batches: each round
+        gets the next node or way member of all relations still without
+        position. Relations without any are located from their
+        sub-relations, one by one.
+        """
+        nodes = [None] * len(datas)
+        members = [[m for m in data[u"member"] if m[u"type"] in (u"node", u"way")] for data in datas]
+        todo = range(len(datas))
+        n = 0
+        while todo:
+            membs = [(i, members[i][n]) for i in todo if n < len(members[i])]
+            node_ids = [m[u"ref"] for (i, m) in membs if m[u"type"] == u"node"]
+            way_ids = [m[u"ref"] for (i, m) in membs if m[u"type"] == u"way"]
+            first = self._WayFirstNodes(way_ids)
+            node_ids += [f for f in first.values() if f is not None]
+            found = dict(zip(node_ids, self._NodePositions(node_ids)))
+            for (i, m) in membs:
+                if m[u"type"] == u"node":
+                    nodes[i] = found[m[u"ref"]]
+                elif first[m[u"ref"]] is not None:
+                    nodes[i] = found[first[m[u"ref"]]]
+            todo = [i for (i, m) in membs if not nodes[i]]
+            n += 1
+
+        for (i, data) in enumerate(datas):
+            if not nodes[i]:
+                nodes[i] = self._locateSubRelation(data)
+        return nodes
 
-        # Initialisation
+    def RelationCreate(self, data):
+        self._Create("relation", [data])
 
-        err  = []
-        tags = data[u"tag"]
-        members = data[u"member"]
+    def RelationCreateMany(self, datas):
+        self._Create("relation", datas)
 
-        # On execute les jobs
-        for meth in self.pluginsRelationMethodes:
-            res = meth(data, tags, members)
-            if res:
-                err += res
+    def _RelationErrors(self, errs):
+        errs = [(data, err) for (data, err) in errs if data[u"member"]]
+        if not errs:
+            return
 
         # Enregistrement des erreurs
-        if err and data[u"member"]:
-            if not "uid" in data and not "user" in data:
-                data = self.RelationGet(data["id"])
-            node = self.locateRelation(data)
+        ids = [data["id"] for (data, err) in errs if not "uid" in data and not "user" in data]
+        full = dict(zip(ids, self._GetMany("Relation", ids)))
+        datas = [full.get(data["id"]) or data for (data, err) in errs]
+        nodes = self._LocateRelations(datas)
+        for ((_, err), data, node) in zip(errs, datas, nodes):
             if not node:
                 node = {u"lat":0, u"lon":0}
             data = self.ExtendData(data)
-            for e in err:
-                try:
-                    if isinstance(e, tuple):
-                        classs = e[0]
-                        subclass = e[1]
-                        text = e[2]
-                        fix = e[2].get("fix")
-                        if e[2].get("fix"):
-                            del e[2]["fix"]
-                    else:
-                        classs = e["class"]
-                        subclass = e["subclass"]
-                        text = e.get("text", {})
-                        fix = e.get("fix")
-
-                    self.error_file.error(
-                        classs,
-                        subclass,
-                        text,
-                        [data["id"]],
-                        ["relation"],
-                        fix,
-                        {"position": [node], "relation": [data]})
-                except:
-                    print("Error on error", e, "from", err)
-                    raise
+            self._error(err, data, "relation", node)
 
     def RelationUpdate(self, data):
+        self._modified["relation"].add(data["id"])
         self.RelationDelete(data)
         self.RelationCreate(data)
 
     def RelationDelete(self, data):
+        self._changed["relation"].add(data["id"])
+        self._Drain()
         self.error_file.relation_delete(data["id"])
 
     ################################################################################
@@ -333,7 +703,13 @@ class Analyser_Sax(Analyser):
 
         try:
             from modules import OsmBin
-            self._reader = OsmBin.OsmBin("/data/work/osmbin/data")
+            if getattr(self.config, "osmbin_socket", None):
+                try:
+                    self._reader = OsmBin.OsmBinClient(self.config.osmbin_socket)
+                    return
+                except IOError:
+                    self._log(u"OsmBin server not available, opening store")
+            self._reader = OsmBin.OsmBin(getattr(self.config, "osmbin_path", "/data/work/osmbin/data"))
             return
         except IOError:
             pass
@@ -341,6 +717,11 @@ class Analyser_Sax(Analyser):
         if hasattr(self.config, "reader"):
             self._reader = self.config.reader
 
+        elif getattr(self.config, "node_coordinates", False):
+            # positions from coordinates kept while reading the file
+            self._log(u"No reader, using node coordinates only")
+            self._reader = None
+
         else:
             from modules import OsmSaxAlea
             self._reader = OsmSaxAlea.OsmSaxReader(self.config.src)
@@ -348,36 +729,46 @@ class Analyser_Sax(Analyser):
     ################################################################################
 
     def _load_parser(self):
+        # xml files are parsed with expat handlers unless config sets
+        # xml_engine to "sax"
+        engine = getattr(self.config, "xml_engine", "expat")
+        compact = getattr(self.config, "compact_entities", False)
+        coords = getattr(self.config, "node_coordinates", False)
         if self.config.src.endswith(".pbf"):
+            # nodes without tags are not given, their coordinates are
             from modules.OsmPbf import OsmPbfReader
-            self.parser = OsmPbfReader(self.config.src, self.logger.sub())
+            self.parser = OsmPbfReader(self.config.src, self.logger.sub(),
+                                       getattr(self.config, "pbf_concurrency", None), compact = compact, coords = coords)
             self.parsing_change_file = False
+            self._coords_apart = coords
         elif (self.config.src.endswith(".osc") or
               self.config.src.endswith(".osc.gz") or
               self.config.src.endswith(".osc.bz2")):
             from modules.OsmSax import OscSaxReader
-            self.parser = OscSaxReader(self.config.src, self.logger.sub())
+            self.parser = OscSaxReader(self.config.src, self.logger.sub(), engine, compact)
             self.parsing_change_file = True
         elif (self.config.src.endswith(".osm") or
               self.config.src.endswith(".osm.gz") or
               self.config.src.endswith(".osm.bz2")):
             from modules.OsmSax import OsmSaxReader
-            self.parser = OsmSaxReader(self.config.src, self.logger.sub())
+            self.parser = OsmSaxReader(self.config.src, self.logger.sub(), engine, compact)
             self.parsing_change_file = False
         else:
             raise Exception("File extension '%s' is not recognized" % self.config.src)
 
+        # with node_coordinates, nodes coming before ways in files give the
+        # positions of ways and relations
+        if coords and not self.parsing_change_file:
+            from modules.OsmCoordinates import OsmCoordinates
+            self._coords = OsmCoordinates()
+
     ################################################################################
 
     def _load_plugins(self):
 
         self._log(u"Loading plugins")
-        self._Err = {}
+        self._init_plugins()
         d = {}
-        self.plugins = {}
-        self.pluginsNodeMethodes = []
-        self.pluginsWayMethodes = []
-        self.pluginsRelationMethodes = []
         _order = ["pre_pre_","pre_", "", "post_", "post_post_"]
         _types = ["way", "node", "relation"]
 
@@ -411,27 +802,93 @@ class Analyser_Sax(Analyser):
                         self._sublog(u"skip "+plugin[:-3])
                         continue
 
-                # Initialisation du plugin
-                pluginInstance = pluginClazz(self)
-                self._sublog(u"init "+pluginName+" ("+", ".join(pluginInstance.availableMethodes())+")")
-                if pluginInstance.init(self.logger.sub().sub()) != False:
+                self._load_plugin(pluginName, pluginClazz)
+
+        self._index_plugins()
 
-                    pluginAvailableMethodes = pluginInstance.availableMethodes()
-                    self.plugins[pluginName] = pluginInstance
+    def _init_plugins(self):
+        # with profile_plugins or a plugin_time_budget, plugin methods are
+        # wrapped to be timed
+        profile = getattr(self.config, "profile_plugins", False) or getattr(self.config, "plugin_time_budget", None)
+        self.pluginsProfile = {} if profile else None
+        # results of plugins depending only on tags are cached
+        self.pluginsMemo = {}
+        self._Err = {}
+        self.plugins = {}
+        # (index, method) of plugins by object type, all of them, the ones
+        # that can run in worker processes and the other ones
+        self.pluginsMethodes = {"node": [], "way": [], "relation": []}
+        self.pluginsParallelMethodes = {"node": [], "way": [], "relation": []}
+        self.pluginsLocalMethodes = {"node": [], "way": [], "relation": []}
+        # tag keys of interest by object type, None when a plugin wants all
+        # objects of this type
+        self.pluginsKeys = {"node": set(), "way": set(), "relation": set()}
+
+    def _load_plugin(self, pluginName, pluginClazz):
+        budget = getattr(self.config, "plugin_time_budget", None)
+        slow = getattr(self.config, "plugin_slow_objects", 10)
+        cache_size = getattr(self.config, "plugin_cache_size", 10000)
+        _types = ["way", "node", "relation"]
 
-                    # Récupération des fonctions à appeler
-                    if "node" in pluginAvailableMethodes:
-                        self.pluginsNodeMethodes.append(pluginInstance.node)
-                    if "way" in pluginAvailableMethodes:
-                        self.pluginsWayMethodes.append(pluginInstance.way)
-                    if "relation" in pluginAvailableMethodes:
-                        self.pluginsRelationMethodes.append(pluginInstance.relation)
+        # Initialisation du plugin
+        pluginInstance = pluginClazz(self)
+        self._sublog(u"init "+pluginName+" ("+", ".join(pluginInstance.availableMethodes())+")")
+        t0 = time.time()
+        init = pluginInstance.init(self.logger.sub().sub())
+        if self.pluginsProfile is not None:
+            self.pluginsProfile[pluginName] = {"init": time.time() - t0}
+        if init == False:
+            return
 
-                    # Liste des erreurs générées
-                    for (cl, v) in self.plugins[pluginName].errors.items():
-                        if cl in self._Err:
-                            raise Exception("class %d already present as item %d" % (cl, self._Err[cl]['item']))
-                        self._Err[cl] = v
+        pluginAvailableMethodes = pluginInstance.availableMethodes()
+        self.plugins[pluginName] = pluginInstance
+
+        # Récupération des fonctions à appeler
+        parallel = pluginInstance.parallelSafe()
+        for t in _types:
+            if t in pluginAvailableMethodes:
+                meth = getattr(pluginInstance, t)
+                if self.pluginsProfile is not None:
+                    meth = self.pluginsProfile[pluginName][t] = _MethodProfile(meth, t, self._sublog, budget, slow)
+                if pluginInstance.tags_only and cache_size:
+                    meth = self.pluginsMemo.setdefault(pluginName, {})[t] = _TagsMemo(meth, cache_size)
+                meth = (len(self.pluginsMethodes[t]), meth)
+                self.pluginsMethodes[t].append(meth)
+                if parallel:
+                    self.pluginsParallelMethodes[t].append(meth)
+                else:
+                    self.pluginsLocalMethodes[t].append(meth)
+        for t in _types:
+            if t in pluginAvailableMethodes and self.pluginsKeys[t] is not None:
+                if pluginInstance.trigger_keys is None:
+                    self.pluginsKeys[t] = None
+                else:
+                    self.pluginsKeys[t].update(pluginInstance.trigger_keys)
+
+        # Liste des erreurs générées
+        for (cl, v) in self.plugins[pluginName].errors.items():
+            if cl in self._Err:
+                raise Exception("class %d already present as item %d" % (cl, self._Err[cl]['item']))
+            self._Err[cl] = v
+
+    def _index_plugins(self):
+        _types = ["way", "node", "relation"]
+        for t in _types:
+            if self.pluginsKeys[t] is not None:
+                self._sublog(u"%s filtered on %d tag keys" % (t, len(self.pluginsKeys[t])))
+
+        # plugins called by tag key, and counters of calls
+        self.pluginsDispatch = {}
+        self.pluginsParallelDispatch = {}
+        self.pluginsLocalDispatch = {}
+        self.pluginsObjects = {}
+        self.pluginsCalls = {}
+        for t in _types:
+            self.pluginsDispatch[t] = self._Dispatch(self.pluginsMethodes[t])
+            self.pluginsParallelDispatch[t] = self._Dispatch(self.pluginsParallelMethodes[t])
+            self.pluginsLocalDispatch[t] = self._Dispatch(self.pluginsLocalMethodes[t])
+            self.pluginsObjects[t] = 0
+            self.pluginsCalls[t] = 0
 
     ################################################################################
 
@@ -451,9 +908,105 @@ class Analyser_Sax(Analyser):
 
     def _run_analyse(self):
         self._log(u"Analysing file "+self.config.src)
-        self.parser.CopyTo(self)
+        if self.parsing_change_file and not (hasattr(self._reader, "WaysOfNodes") and hasattr(self._reader, "RelationsOfMembers")):
+            # parents of modified objects would keep errors and positions
+            # from their former members
+            raise Exception("Reader %s without parents of objects, change files need a reader with WaysOfNodes and RelationsOfMembers, as OsmOsis" % self._reader.__class__.__name__)
+        processes = getattr(self.config, "sax_processes", 1) or 1
+        if processes > 1 and self.pluginsProfile is not None:
+            self._sublog(u"plugins profiled in the main process only")
+        elif processes > 1 and any(self.pluginsParallelMethodes.values()):
+            self._StartPool(processes)
+        # objects of change files, and modified ones
+        self._changed = {"node": set(), "way": set(), "relation": set()}
+        self._modified = {"node": set(), "way": set(), "relation": set()}
+        ok = False
+        try:
+            self.parser.CopyTo(self)
+            if self.parsing_change_file:
+                self._CheckParents()
+            self._Drain()
+            ok = True
+        finally:
+            if self._pool:
+                self._StopPool(ok)
+        for t in ("node", "way", "relation"):
+            self._sublog(u"%s: %d plugin calls, %d avoided by tag keys" % (t, self.pluginsCalls[t], self._CallsAvoided(t)))
+        if self._coords:
+            self._sublog(u"%d node coordinates and %d ways kept" % (self._coords.NodeCount(), self._coords.WayCount()))
+        if self.pluginsProfile is not None:
+            self._profile_report()
         self._log(u"Analyse finished")
 
+    def _CheckParents(self):
+        """
+        Check again ways with modified nodes, and relations with modified
+        nodes or ways or with these ways, when they are not in the change
+        file: their position or their errors can depend on their members.
+        Their errors are replaced, as for modified objects.
+        """
+        if not sum([len(m) for m in self._modified.values()]):
+            return
+        ways_of = self._reader.WaysOfNodes
+        relations_of = self._reader.RelationsOfMembers
+
+        nodes = sorted(self._modified["node"])
+        ways = sorted(set(ways_of(nodes)) - self._changed["way"])
+        rels = set(relations_of("node", nodes))
+        rels.update(relations_of("way", sorted(self._modified["way"]) + ways))
+        rels = sorted(rels - self._changed["relation"])
+        self._sublog(u"Checking parents of modified objects: %d ways, %d relations" % (len(ways), len(rels)))
+
+        for (kind, ids) in (("Way", ways), ("Relation", rels)):
+            delete = getattr(self, kind + "Delete")
+            create = getattr(self, kind + "CreateMany")
+            for i in range(0, len(ids), 1000):
+                datas = [data for data in self._GetMany(kind, ids[i:i+1000]) if data]
+                for data in datas:
+                    delete(data)
+                create(datas)
+
+    def _profile_report(self):
+        # summary in the log, most expensive methods first, and json report
+        # next to the results file
+        report = {}
+        rows = []
+        for (name, profile) in self.pluginsProfile.items():
+            report[name] = {"init": profile["init"]}
+            slowest = []
+            for t in ("node", "way", "relation"):
+                if t in profile:
+                    report[name][t] = profile[t].report()
+                    rows.append((profile[t].time, name, t, profile[t]))
+                    memo = self.pluginsMemo.get(name, {}).get(t)
+                    if memo:
+                        report[name][t]["cache_hits"] = memo.hits
+                        report[name][t]["cache_misses"] = memo.misses
+                    slowest += [(e[0], t, e[1], e[2]) for e in profile[t].slowest]
+            slowest = sorted(slowest, reverse=True)[:getattr(self.config, "plugin_slow_objects", 10)]
+            report[name]["slowest"] = [{"time": e[0], "type": e[1], "id": e[2], "keys": e[3]} for e in slowest]
+
+        self._sublog(u"plugin profile")
+        for (_, name, t, p) in sorted(rows, reverse=True):
+            self._sublog(u"  %-40s %-8s %9d calls %9.3fs %9.3fms max %7d errors %5d over budget" % (name, t, p.calls, p.time, p.max_time * 1000, p.errors, p.over_budget))
+        for (name, memos) in sorted(self.pluginsMemo.items()):
+            for (t, memo) in sorted(memos.items()):
+                self._sublog(u"  %-40s %-8s %9d cache hits %5.1f%%" % (name, t, memo.hits, 100.0 * memo.hits / ((memo.hits + memo.misses) or 1)))
+        for (name, profile) in sorted(self.pluginsProfile.items(), key=lambda x: -x[1]["init"]):
+            if profile["init"] >= 0.1:
+                self._sublog(u"  %-40s %-8s %9.3fs" % (name, "init", profile["init"]))
+
+        dst = getattr(self.config, "dst", None)
+        if dst:
+            path = dst
+            for ext in (".bz2", ".gz", ".xml"):
+                if path.endswith(ext):
+                    path = path[:-len(ext)]
+            path += ".profile.json"
+            with open(path, "w") as f:
+                json.dump({"src": self.config.src, "plugins": report}, f, indent=1, sort_keys=True)
+            self._sublog(u"plugin profile written to " + path)
+
     ################################################################################
 
     def _close_plugins(self):
@@ -468,6 +1021,71 @@ class Analyser_Sax(Analyser):
 
 ################################################################################
 from Analyser import TestAnalyser
+from plugins.Plugin import Plugin
+
+class _TestPlugin(Plugin):
+    # error on objects with one of the trigger keys, or with fixme
+    classs = 1
+
+    def init(self, logger):
+        Plugin.init(self, logger)
+        self.errors[self.classs] = { "item": 9000, "level": 3, "tag": [], "desc": {"en": self.__class__.__name__} }
+        self.calls = []
+
+    def node(self, data, tags):
+        self.calls.append(data["id"])
+        if not set(self.trigger_keys or ["fixme"]).isdisjoint(tags):
+            return [{"class": self.classs, "subclass": 0}]
+
+    def way(self, data, tags, nds):
+        return self.node(data, tags)
+
+    def relation(self, data, tags, members):
+        return self.node(data, tags)
+
+class _TestPluginHighway(_TestPlugin):
+    classs = 2
+    trigger_keys = ("highway",)
+
+class _TestPluginName(_TestPlugin):
+    classs = 3
+    trigger_keys = ("name", "highway")
+
+class _TestPluginAmenity(_TestPlugin):
+    classs = 4
+    trigger_keys = ("amenity",)
+
+class _TestPluginType(_TestPlugin):
+    classs = 7
+    trigger_keys = ("type",)
+
+class _TestPluginTagsOnly(_TestPlugin):
+    classs = 8
+    trigger_keys = ("highway", "building")
+    tags_only = True
+
+class _TestPluginSlowInit(_TestPlugin):
+    classs = 5
+    trigger_keys = ("amenity",)
+
+    def init(self, logger):
+        _TestPlugin.init(self, logger)
+        time.sleep(0.05)
+
+class _TestPluginSlow(_TestPlugin):
+    # slow on objects with a name, then counts them
+    classs = 6
+    trigger_keys = ("name",)
+
+    def init(self, logger):
+        _TestPlugin.init(self, logger)
+        self.names = 0
+
+    def node(self, data, tags):
+        if "name" in tags:
+            time.sleep(0.2)
+            self.names += 1
+        return _TestPlugin.node(self, data, tags)
 
 class TestAnalyserOsmosis(TestAnalyser):
 
@@ -485,6 +1103,62 @@ class TestAnalyserOsmosis(TestAnalyser):
             return None
 
 
+    class ErrorFile(object):
+        # errors and deletions given to the error file
+        def __init__(self):
+            self.out = []
+
+        def error(self, classs, subclass, text, ids, types, fix, geom):
+            self.out.append((types[0], ids[0], classs, geom["position"][0]["lat"], geom["position"][0]["lon"]))
+
+        def node_delete(self, id):
+            self.out.append(("node_delete", id))
+
+        def way_delete(self, id):
+            self.out.append(("way_delete", id))
+
+        def relation_delete(self, id):
+            self.out.append(("relation_delete", id))
+
+    class DictReader(object):
+        # objects of dicts, with or without GetMany lookups, counting the
+        # lookups
+        def __init__(self, nodes, ways, relations, many):
+            self.objects = {"Node": nodes, "Way": ways, "Relation": relations}
+            self.lookups = 0
+            if many:
+                self.NodeGetMany = lambda ids: self._GetMany("Node", ids)
+                self.WayGetMany = lambda ids: self._GetMany("Way", ids)
+                self.RelationGetMany = lambda ids: self._GetMany("Relation", ids)
+
+        def _GetMany(self, kind, ids):
+            self.lookups += 1
+            return [self.objects[kind].get(i) for i in ids]
+
+        def NodeGet(self, id):
+            self.lookups += 1
+            return self.objects["Node"].get(id)
+
+        def WayGet(self, id):
+            self.lookups += 1
+            return self.objects["Way"].get(id)
+
+        def RelationGet(self, id):
+            self.lookups += 1
+            return self.objects["Relation"].get(id)
+
+        def UserGet(self, id):
+            return None
+
+    class ParentsReader(DictReader):
+        # objects of dicts, with ways and relations of their members
+        def WaysOfNodes(self, NodeIds):
+            return [w["id"] for w in self.objects["Way"].values() if not set(NodeIds).isdisjoint(w["nd"])]
+
+        def RelationsOfMembers(self, MemberType, MemberIds):
+            return [r["id"] for r in self.objects["Relation"].values()
+                    if any(m["type"] == MemberType and m["ref"] in MemberIds for m in r["member"])]
+
     def setUp(self):
 
         class config:
@@ -507,6 +1181,305 @@ class TestAnalyserOsmosis(TestAnalyser):
           else:
             raise
 
+    def plugins_analyser(self, *plugins):
+        # analyser with the given plugin classes only, writing to an
+        # ErrorFile
+        a = Analyser_Sax(self.config)
+        a._reader = self.config.reader
+        a.parsing_change_file = False
+        a.error_file = TestAnalyserOsmosis.ErrorFile()
+        a._init_plugins()
+        for plugin in plugins:
+            a._load_plugin(plugin.__name__, plugin)
+        a._index_plugins()
+        return a
+
+    test_datas = [
+        {"id": 1, "lat": 1, "lon": 1, "nd": [1, 2], "tag": {}},
+        {"id": 2, "lat": 1, "lon": 1, "nd": [1, 2], "tag": {"highway": "primary"}},
+        {"id": 3, "lat": 1, "lon": 1, "nd": [1, 2], "tag": {"highway": "primary", "name": "a"}},
+        {"id": 4, "lat": 1, "lon": 1, "nd": [1, 2], "tag": {"amenity": "bar", "fixme": "yes"}},
+        {"id": 5, "lat": 1, "lon": 1, "nd": [1, 2], "tag": {"source": "survey"}},
+    ]
+
+    def test_dispatch(self):
+        # plugins called by tag keys give the errors of all plugins called
+        a = self.plugins_analyser(_TestPlugin, _TestPluginHighway, _TestPluginName, _TestPluginAmenity)
+        datas = self.test_datas
+        baseline = []
+        for (i, data) in enumerate(datas):
+            if data["tag"]:
+                r = [(j, meth(data, data["tag"])) for (j, meth) in a.pluginsMethodes["node"]]
+                r = [(j, e) for (j, e) in r if e]
+                if r:
+                    baseline.append((i, r))
+        self.assertEqual(len(baseline), 3)
+        for plugin in a.plugins.values():
+            plugin.calls = []
+
+        self.assertEqual(a._RunPlugins("node", datas, a.pluginsDispatch["node"]), baseline)
+        self.assertEqual(a.plugins["_TestPlugin"].calls, [2, 3, 4, 5])
+        self.assertEqual(a.plugins["_TestPluginHighway"].calls, [2, 3])
+        self.assertEqual(a.plugins["_TestPluginName"].calls, [2, 3])
+        self.assertEqual(a.plugins["_TestPluginAmenity"].calls, [4])
+        self.assertEqual(a.pluginsCalls["node"], 9)
+
+    def test_dispatch_counters(self):
+        a = self.plugins_analyser(_TestPlugin, _TestPluginHighway, _TestPluginName, _TestPluginAmenity)
+        a.NodeCreateMany(self.test_datas)
+        a.WayCreateMany(self.test_datas)
+        # nodes without tags are not counted
+        self.assertEqual(a.pluginsObjects, {"node": 4, "way": 5, "relation": 0})
+        self.assertEqual(a.pluginsCalls, {"node": 9, "way": 10, "relation": 0})
+        self.assertEqual(a._CallsAvoided("node"), 4 * 4 - 9)
+        self.assertEqual(a._CallsAvoided("way"), 5 * 4 - 10)
+        self.assertEqual(a._CallsAvoided("relation"), 0)
+        self.assertEqual([e[:3] for e in a.error_file.out], [
+            ("node", 2, 2), ("node", 2, 3), ("node", 3, 2), ("node", 3, 3), ("node", 4, 1), ("node", 4, 4),
+            ("way", 2, 2), ("way", 2, 3), ("way", 3, 2), ("way", 3, 3), ("way", 4, 1), ("way", 4, 4)])
+
+    def test_profile(self):
+        self.config.dst = os.path.join(self.dirname, "sax.test.profile.xml.bz2")
+        self.config.profile_plugins = True
+        a = self.plugins_analyser(_TestPlugin, _TestPluginHighway, _TestPluginSlowInit)
+        a.NodeCreateMany(self.test_datas)
+        a.WayCreateMany(self.test_datas)
+        a._profile_report()
+
+        with open(os.path.join(self.dirname, "sax.test.profile.profile.json")) as f:
+            report = json.load(f)
+        self.assertEqual(report["src"], self.config.src)
+        plugins = report["plugins"]
+        self.assertEqual(sorted(plugins), ["_TestPlugin", "_TestPluginHighway", "_TestPluginSlowInit"])
+        for (name, counts) in (("_TestPlugin", {"node": (4, 1), "way": (5, 1)}),
+                               ("_TestPluginHighway", {"node": (2, 2), "way": (2, 2)}),
+                               ("_TestPluginSlowInit", {"node": (1, 1), "way": (1, 1)})):
+            self.assertEqual(sorted(plugins[name]), ["init", "node", "relation", "slowest", "way"])
+            for (t, (calls, errors)) in counts.items():
+                p = plugins[name][t]
+                self.assertEqual(p["calls"], calls)
+                self.assertEqual(p["errors"], errors)
+                self.assertTrue(0 <= p["max_time"] <= p["time"])
+            self.assertEqual(len(plugins[name]["slowest"]), counts["node"][0] + counts["way"][0])
+        self.assertTrue(plugins["_TestPluginSlowInit"]["init"] >= 0.05)
+        self.assertTrue(plugins["_TestPlugin"]["init"] < 0.05)
+        self.assertEqual(sorted((e["type"], e["id"], e["keys"]) for e in plugins["_TestPluginHighway"]["slowest"]),
+                         [("node", 2, ["highway"]), ("node", 3, ["highway"]), ("way", 2, ["highway"]), ("way", 3, ["highway"])])
+
+    def test_time_budget(self):
+        # slow calls are logged, not interrupted
+        self.config.plugin_time_budget = 0.1
+        a = self.plugins_analyser(_TestPluginSlow, _TestPluginHighway)
+        log = []
+        a.pluginsProfile["_TestPluginSlow"]["node"].log = log.append
+        a.NodeCreateMany(self.test_datas)
+
+        self.assertEqual(a.plugins["_TestPluginSlow"].names, 1)
+        self.assertEqual([e[:3] for e in a.error_file.out], [("node", 2, 2), ("node", 3, 6), ("node", 3, 2)])
+        self.assertEqual(len(log), 1)
+        self.assertTrue(log[0].startswith(u"_TestPluginSlow on node 3: "))
+        self.assertTrue(log[0].endswith(u"s over time budget"))
+        report = a.pluginsProfile["_TestPluginSlow"]["node"].report()
+        self.assertEqual((report["calls"], report["errors"], report["over_budget"]), (1, 1, 1))
+        self.assertTrue(report["max_time"] >= 0.2)
+        self.assertEqual(a.pluginsProfile["_TestPluginHighway"]["node"].report()["over_budget"], 0)
+
+    def dict_reader(self, many):
+        nodes = dict((i, {"id": i, "lat": i, "lon": -i, "tag": {}}) for i in range(1, 6))
+        ways = {
+            10: {"id": 10, "nd": [2, 1], "tag": {}},
+            11: {"id": 11, "nd": [3], "tag": {}},
+            12: {"id": 12, "nd": [99, 4], "tag": {}},
+        }
+        relations = [
+            [("node", 1)],
+            [("way", 10)],
+            [("node", 99), ("way", 11)],
+            [("way", 98), ("node", 4), ("node", 5)],
+            [("way", 12), ("way", 11)],
+            [("relation", 1), ("node", 99)],
+            [("relation", 97)],
+            [("node", 99), ("relation", 2)],
+            [("relation", 8), ("node", 5)],
+            [],
+        ]
+        relations = dict((i + 1, {"id": i + 1, "tag": {}, "member": [{"type": t, "ref": r, "role": ""} for (t, r) in m]})
+                         for (i, m) in enumerate(relations))
+        return TestAnalyserOsmosis.DictReader(nodes, ways, relations, many)
+
+    def test_locate_relations(self):
+        # batched positions are the positions found object by object
+        for many in (False, True):
+            a = Analyser_Sax(self.config)
+            a._reader = self.dict_reader(many)
+            datas = [a._reader.objects["Relation"][i] for i in range(1, 11)]
+            nodes = [a.locateRelation(data) for data in datas]
+            self.assertEqual([n and n["id"] for n in nodes], [1, 2, 3, 4, 3, 1, None, 2, 5, None])
+            self.assertEqual(a._LocateRelations(datas), nodes)
+            if many:
+                # relations with node or way members found in 2 rounds of
+                # members, each one with one lookup of ways and of nodes
+                a._reader.lookups = 0
+                a._LocateRelations(datas[:5])
+                self.assertEqual(a._reader.lookups, 4)
+
+    def test_get_many(self):
+        for many in (False, True):
+            a = Analyser_Sax(self.config)
+            a._reader = self.dict_reader(many)
+            self.assertEqual([n and n["id"] for n in a._GetMany("Node", [4, 99, 1, 4])], [4, None, 1, 4])
+            self.assertEqual([w and w["id"] for w in a._GetMany("Way", [12, 10, 98])], [12, 10, None])
+            self.assertEqual([r and r["id"] for r in a._GetMany("Relation", [97, 3])], [None, 3])
+            self.assertEqual(a._GetMany("Node", []), [])
+        a._reader = None
+        self.assertEqual(a._GetMany("Node", [4, 99]), [None, None])
+
+    def coordinates_errors(self, src):
+        # errors without reader, ways and relations located from node
+        # coordinates
+        self.config.src = src
+        self.config.node_coordinates = True
+        a = self.plugins_analyser(_TestPluginHighway, _TestPluginType)
+        a._reader = None
+        a._load_parser()
+        a._run_analyse()
+        return a.error_file.out
+
+    def test_node_coordinates(self):
+        # positions are the ones from a reader
+        errors = self.coordinates_errors("tests/saint_barthelemy.osm.gz")
+        errors = [e for e in errors if e[0] != "node"]
+        self.assertEqual(len([e for e in errors if e[0] == "way"]), 515)
+        self.assertEqual(len([e for e in errors if e[0] == "relation"]), 16)
+
+        from modules.OsmSax import OsmSaxReader
+        class Objects(object):
+            def __init__(self):
+                self.objects = {"node": {}, "way": {}, "relation": {}}
+            def NodeCreate(self, data):
+                self.objects["node"][data["id"]] = data
+            def WayCreate(self, data):
+                self.objects["way"][data["id"]] = data
+            def RelationCreate(self, data):
+                self.objects["relation"][data["id"]] = data
+        o = Objects()
+        OsmSaxReader("tests/saint_barthelemy.osm.gz").CopyTo(o)
+        a = Analyser_Sax(self.config)
+        a._reader = TestAnalyserOsmosis.DictReader(o.objects["node"], o.objects["way"], o.objects["relation"], False)
+        for (t, id, classs, lat, lon) in errors:
+            if t == "way":
+                nds = o.objects["way"][id]["nd"]
+                node = a.NodeGet(nds[len(nds)/2])
+            else:
+                node = a.locateRelation(o.objects["relation"][id]) or {"lat": 0, "lon": 0}
+            self.assertEqual((lat, lon), (node["lat"], node["lon"]), (t, id))
+
+    def test_node_coordinates_without_metadata(self):
+        src = os.path.join(self.dirname, "sax.test.nometa.osm")
+        with open(src, "w") as f:
+            f.write("""<?xml version='1.0' encoding='UTF-8'?>
+<osm version="0.6">
+<node id="1" lat="1" lon="2"><tag k="highway" v="stop"/></node>
+<node id="2" lat="3" lon="4"/>
+<way id="10"><nd ref="1"/><nd ref="2"/><tag k="highway" v="primary"/></way>
+</osm>
+""")
+        self.assertEqual(self.coordinates_errors(src), [("node", 1, 2, 1, 2), ("way", 10, 2, 3, 4)])
+
+    def test_node_coordinates_pbf(self):
+        # nodes of .pbf files without tags are given apart
+        errors = self.coordinates_errors("tests/saint_barthelemy.osm.pbf")
+        self.assertEqual(sorted(errors), sorted(self.coordinates_errors("tests/saint_barthelemy.osm.gz")))
+
+    def test_tags_memo(self):
+        plugin = _TestPluginTagsOnly(None)
+        plugin.init(None)
+        memo = _TagsMemo(plugin.node, 2)
+        a = {"highway": "primary"}
+        b = {"highway": "primary", "name": "a"}
+        c = {"building": "yes"}
+        res = [memo({"id": i}, tags) for (i, tags) in enumerate([a, b, dict(a), c, b, a])]
+        self.assertEqual(res, [plugin.node({"id": 0}, tags) for tags in [a, b, a, c, b, a]])
+        # a is reused, b is dropped by c, then a by b
+        self.assertEqual(plugin.calls[:5], [0, 1, 3, 4, 5])
+        self.assertEqual((memo.hits, memo.misses), (1, 5))
+        self.assertEqual(len(memo.cache), 2)
+
+    def test_tags_memo_analyse(self):
+        # same errors with and without cache, hit rate in the report
+        self.config.src = "tests/saint_barthelemy.osm.gz"
+        self.config.dst = os.path.join(self.dirname, "sax.test.memo.xml")
+        self.config.profile_plugins = True
+        out = {}
+        for cache_size in (0, 100):
+            self.config.plugin_cache_size = cache_size
+            a = self.plugins_analyser(_TestPluginTagsOnly, _TestPluginHighway)
+            a._load_parser()
+            a._run_analyse()
+            out[cache_size] = a.error_file.out
+        self.assertTrue(len(out[0]) > 500)
+        self.assertEqual(out[100], out[0])
+
+        memo = a.pluginsMemo["_TestPluginTagsOnly"]["way"]
+        self.assertTrue(memo.hits > memo.misses > 0)
+        self.assertEqual(a.pluginsMemo.keys(), ["_TestPluginTagsOnly"])
+        with open(os.path.join(self.dirname, "sax.test.memo.profile.json")) as f:
+            report = json.load(f)["plugins"]["_TestPluginTagsOnly"]["way"]
+        self.assertEqual((report["cache_hits"], report["cache_misses"]), (memo.hits, memo.misses))
+        self.assertEqual(report["calls"], memo.misses)
+
+        import StringIO
+        log = StringIO.StringIO()
+        a.logger = OsmoseLog.logger(log)
+        a._profile_report()
+        rate = u"%5.1f%%" % (100.0 * memo.hits / (memo.hits + memo.misses))
+        self.assertTrue(any("_TestPluginTagsOnly" in l and " way " in l and rate in l for l in log.getvalue().splitlines()))
+
+    def parents_errors(self, reader):
+        # errors of a change file moving node 1 of way 10, member of
+        # relation 20
+        self.config.src = os.path.join(self.dirname, "sax.test.parents.osc")
+        with open(self.config.src, "w") as f:
+            f.write("""<osmChange version="0.6">
+<modify>
+<node id="1" version="2" lat="1.5" lon="-1.5"/>
+</modify>
+</osmChange>
+""")
+        nodes = dict((i, {"id": i, "lat": i, "lon": -i, "tag": {}}) for i in range(1, 6))
+        ways = {
+            10: {"id": 10, "nd": [1, 2], "tag": {"highway": "primary"}},
+            11: {"id": 11, "nd": [3, 4], "tag": {"highway": "primary"}},
+        }
+        relations = {
+            20: {"id": 20, "member": [{"type": "way", "ref": 10, "role": "outer"}], "tag": {"type": "multipolygon"}},
+            21: {"id": 21, "member": [{"type": "node", "ref": 5, "role": ""}], "tag": {"type": "site"}},
+        }
+        a = self.plugins_analyser(_TestPluginHighway, _TestPluginType)
+        a._reader = reader(nodes, ways, relations, True)
+        import StringIO
+        log = StringIO.StringIO()
+        a.logger = OsmoseLog.logger(log)
+        a._load_parser()
+        a._run_analyse()
+        return (a.error_file.out, log.getvalue())
+
+    def test_parents(self):
+        # errors of the way of the modified node and of its relation are
+        # replaced
+        (out, log) = self.parents_errors(TestAnalyserOsmosis.ParentsReader)
+        self.assertEqual(out, [
+            ("node_delete", 1),
+            ("way_delete", 10), ("way", 10, 2, 2, -2),
+            ("relation_delete", 20), ("relation", 20, 7, 1, -1)])
+        self.assertTrue("Checking parents of modified objects: 1 ways, 1 relations" in log)
+
+    def test_parents_without_reader_support(self):
+        # change files are not analysed without parents of objects
+        with self.assertRaises(Exception) as cm:
+            self.parents_errors(TestAnalyserOsmosis.DictReader)
+        self.assertTrue(str(cm.exception).startswith("Reader DictReader without parents of objects"))
+
     def test(self):
         self.xml_res_file = os.path.join(self.dirname, "sax.test.xml")
         self.config.dst = self.xml_res_file
@@ -519,6 +1492,17 @@ class TestAnalyserOsmosis(TestAnalyser):
         self.root_err = self.load_errors()
         self.check_num_err(min=37)
 
+    def test_processes(self):
+        # same errors as the sequential run
+        self.xml_res_file = os.path.join(self.dirname, "sax.test.processes.xml")
+        self.config.dst = self.xml_res_file
+        self.config.options = {"project": "openstreetmap"}
+        self.config.sax_processes = 2
+        with Analyser_Sax(self.config) as analyser_obj:
+            analyser_obj.analyser()
+
+        self.compare_results("tests/results/sax.test.xml")
+
     def test_FR(self):
         self.xml_res_file = os.path.join(self.dirname, "sax.test.FR.xml")
         self.xml_res_file = "tests/out/sax.test.FR.xml"
@@ -25,9 +25,16 @@
 ###########################################################################
 # 1. mkdir /data/osmbin
 # 2. ./OsmBin.py --init /data/osmbin
+#    or, for a regional extract, with node coordinates only allocated by
+#    pages containing nodes
+#    ./OsmBin.py --init /data/osmbin --paged
+#    add --tiles to index nodes and ways by tile, for bounding box queries
+#    ./OsmBin.py --init /data/osmbin --paged --tiles
 # 3. wget -O - -o /dev/null http://planet.openstreetmap.org/planet-latest.osm.bz2 \
 #    | bunzip2
 #    | ./OsmBin.py --import /data/osmbin -
+# or, faster, from a .pbf file using all cores
+# 3. ./OsmBin.py --import-parallel /data/osmbin planet-latest.osm.pbf [nb_process]
 
 ###########################################################################
 ## OSC UPDATE                                                            ##
@@ -36,6 +43,23 @@
 # do
 #   bzcat /data/updates/$i | ./OsmBin.py --update /data/osmbin -
 # done
+# each change file is journaled in update.journal before being written, an
+# interrupted update is finished on next opening in "w" mode
+
+###########################################################################
+## STORE FROM PREVIOUS VERSIONS                                          ##
+###########################################################################
+# relations used to be stored in one relation/XXX/YYY/ZZZ file each
+# ./OsmBin.py --convert-relations /data/osmbin
+# way node lists used to be stored as 5 bytes integers, converted by
+# ./OsmBin.py --compact /data/osmbin
+
+###########################################################################
+## COMPACTION                                                            ##
+###########################################################################
+# rewrite way.data without space left by deleted or updated ways, while no
+# update is running
+# ./OsmBin.py --compact /data/osmbin
 
 ###########################################################################
 ## PYTHON                                                                ##
@@ -46,8 +70,21 @@
 # print bin.WayGet(12)
 # print bin.RelationGet(12)
 # print bin.RelationFullRecur(12)
+# with a tile index, ids of objects in (minlat, minlon, maxlat, maxlon)
+# print bin.NodesInBBox(17.89, -62.85, 17.91, -62.82)
+# print bin.WaysInBBox(17.89, -62.85, 17.91, -62.82)
+
+###########################################################################
+## LOCAL SERVER                                                          ##
+###########################################################################
+# share one store between processes of the same host
+# ./OsmBin.py --serve /data/osmbin /tmp/osmbin.sock
+# import OsmBin
+# bin = OsmBinClient("/tmp/osmbin.sock")
+# print bin.NodeGet(12)
+# print bin.Batch([("NodeGetMany", [[12, 13]]), ("WayGet", [12])])
 
-import sys, os, lockfile
+import sys, os, time, math, copy, lockfile, mmap, struct, marshal, socket, SocketServer
 
 class MissingDataError(Exception):
     def __init__(self, value):
@@ -130,10 +167,869 @@ def _Str4ToCoord(num):
 def _CoordToStr4(coord):
     return _IntToStr4(int((coord*10000000)+1800000000))
 
+def _IntToCoord(num):
+    return float(num-1800000000)/10000000
+
+_StructCoord = struct.Struct(">II")
+_StructNbn   = struct.Struct(">H")
+_StructIdx   = struct.Struct(">BI")
+
+_StructCache = {}
+
+def _Str5ListToInt(buf, offset, nb):
+    # decode nb consecutive 5 bytes integers in one unpack call
+    fmt = _StructCache.get(nb)
+    if not fmt:
+        fmt = _StructCache[nb] = struct.Struct(">" + "BI"*nb)
+    v = fmt.unpack_from(buf, offset)
+    return [4294967296*h+l for (h, l) in zip(v[0::2], v[1::2])]
+
+def _IntListToStr5(nums):
+    # encode a list of integers on 5 bytes each in one pack call
+    fmt = _StructCache.get(len(nums))
+    if not fmt:
+        fmt = _StructCache[len(nums)] = struct.Struct(">" + "BI"*len(nums))
+    v = []
+    for num in nums:
+        v.append(num >> 32)
+        v.append(num & 0xffffffff)
+    return fmt.pack(*v)
+
+def _Runs(ids):
+    # split a sorted list of ids in runs of consecutive ids
+    runs = []
+    start = 0
+    for i in xrange(1, len(ids) + 1):
+        if i == len(ids) or ids[i] != ids[i-1] + 1:
+            runs.append((start, i))
+            start = i
+    return runs
+
+class _WritableMap:
+    """
+    Writable memory map of a store file, the file is grown as needed.
+    """
+
+    def __init__(self, f):
+        self._f    = f
+        self._size = os.fstat(f.fileno()).st_size
+        self._used = self._size
+        self._map  = None
+        if self._size:
+            self._map = mmap.mmap(f.fileno(), self._size)
+
+    def write(self, offset, txt):
+        end = offset + len(txt)
+        if end > self._size:
+            self._grow(end)
+        self._map[offset:end] = txt
+        if end > self._used:
+            self._used = end
+
+    def _grow(self, size):
+        # double size to limit the number of remaps
+        size = max(size, 2*self._size)
+        if self._map:
+            self._map.close()
+        self._f.truncate(size)
+        self._map  = mmap.mmap(self._f.fileno(), size)
+        self._size = size
+
+    def close(self, size = None):
+        if self._map:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        # remove space allocated after last written data
+        self._f.truncate(max(self._used, size or 0))
+
+class _Progress:
+    """
+    Count imported objects, and print throughput regularly.
+    """
+
+    def __init__(self, delay = 10):
+        self._delay = delay
+        self._t0    = time.time()
+        self._last  = self._t0
+        self._count = {"nodes": 0, "ways": 0, "relations": 0}
+
+    def add(self, kind, nb):
+        self._count[kind] += nb
+        if time.time() - self._last > self._delay:
+            self.report()
+
+    def report(self):
+        self._last = time.time()
+        elapsed = max(self._last - self._t0, 0.001)
+        print("%ds: %s" % (elapsed, ", ".join(map(lambda k: "%d %s (%d/s)" % (self._count[k], k, self._count[k] / elapsed), ["nodes", "ways", "relations"]))))
+        sys.stdout.flush()
+
+class _MappedFile:
+    """
+    Read-only memory map of a store file, remapped when file has grown.
+    """
+
+    def __init__(self, f):
+        self._f    = f
+        self._map  = None
+        self._size = 0
+        self.remap()
+
+    def remap(self):
+        size = os.fstat(self._f.fileno()).st_size
+        if size == self._size:
+            return False
+        if self._map:
+            self._map.close()
+        if size:
+            self._map = mmap.mmap(self._f.fileno(), size, access=mmap.ACCESS_READ)
+        self._size = size
+        return True
+
+    def check(self, offset, size):
+        # return the map if offset+size can be read from it
+        if offset + size > self._size and not self.remap():
+            return None
+        if offset + size > self._size:
+            return None
+        return self._map
+
+    def unpack(self, fmt, offset):
+        # fmt.unpack_from at offset, None beyond end of file. The bounds are
+        # only checked when the unpack fails, to keep lookups cheap.
+        try:
+            return fmt.unpack_from(self._map, offset)
+        except (struct.error, TypeError):
+            m = self.check(offset, fmt.size)
+            if m is None:
+                return None
+            return fmt.unpack_from(m, offset)
+
+    def read(self, offset, size):
+        # bytes at offset, truncated at end of file
+        if offset + size > self._size:
+            self.remap()
+            if offset >= self._size:
+                return ""
+        return self._map[offset:offset+size]
+
+    def close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+
+class _BufferedFile:
+    """
+    Store file with writes kept in memory by blocks until Commit, so that
+    they can be sorted and coalesced. Reads see pending writes.
+    """
+
+    def __init__(self, f, block = 512):
+        # size of file with writes done before buffering
+        f.flush()
+        self._f      = f
+        self._block  = block
+        self._blocks = {}
+        self._pos    = 0
+        self._size   = os.fstat(f.fileno()).st_size
+
+    def seek(self, offset, whence = 0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = offset
+
+    def tell(self):
+        return self._pos
+
+    def _Load(self, b):
+        # content of block b, from pending writes or from file
+        data = self._blocks.get(b)
+        if data is None:
+            self._f.seek(b*self._block)
+            data = self._f.read(self._block)
+            data = bytearray(data + "\0"*(self._block - len(data)))
+        return data
+
+    def read(self, size = -1):
+        end = self._size if size < 0 else min(self._pos + size, self._size)
+        txt = []
+        pos = self._pos
+        while pos < end:
+            b = pos / self._block
+            start = b*self._block
+            if b in self._blocks:
+                stop = min(start + self._block, end)
+                txt.append(str(self._blocks[b][pos-start:stop-start]))
+            else:
+                # read up to next pending block in one call
+                stop = start + self._block
+                while stop < end and stop / self._block not in self._blocks:
+                    stop += self._block
+                stop = min(stop, end)
+                self._f.seek(pos)
+                txt.append(self._f.read(stop - pos))
+            pos = stop
+        self._pos = max(self._pos, end)
+        return "".join(txt)
+
+    def write(self, txt):
+        pos = self._pos
+        end = pos + len(txt)
+        while pos < end:
+            b = pos / self._block
+            start = b*self._block
+            stop = min(start + self._block, end)
+            data = self._blocks[b] = self._Load(b)
+            data[pos-start:stop-start] = txt[pos-self._pos:stop-self._pos]
+            pos = stop
+        self._pos = end
+        self._size = max(self._size, end)
+
+    def flush(self):
+        pass
+
+    def Pending(self):
+        # list of (offset, data) with consecutive blocks merged, sorted by
+        # offset
+        writes = []
+        for b in sorted(self._blocks):
+            offset = b*self._block
+            data = str(self._blocks[b][:max(0, self._size - offset)])
+            if writes and writes[-1][0] + len(writes[-1][1]) == offset:
+                writes[-1] = (writes[-1][0], writes[-1][1] + data)
+            else:
+                writes.append((offset, data))
+        return writes
+
+def _IntToVarint(num):
+    # 7 bits per byte, high bit set when more bytes follow
+    txt = []
+    while num > 127:
+        txt.append(chr(128 | (num & 127)))
+        num >>= 7
+    txt.append(chr(num))
+    return "".join(txt)
+
+def _VarintToInt(txt, pos):
+    # return (value, position after value)
+    num   = 0
+    shift = 0
+    while True:
+        i = ord(txt[pos])
+        pos += 1
+        num |= (i & 127) << shift
+        if i < 128:
+            return (num, pos)
+        shift += 7
+
+def _ZigZag(num):
+    # signed to unsigned, small absolute values give small numbers
+    if num >= 0:
+        return num << 1
+    return ((-num) << 1) - 1
+
+def _UnZigZag(num):
+    if num & 1:
+        return -((num + 1) >> 1)
+    return num >> 1
+
+def _IntListToDelta(nums):
+    # number of values, then zig-zag varint delta of each value from the
+    # previous one
+    txt = [_IntToVarint(len(nums))]
+    prev = 0
+    for num in nums:
+        txt.append(_IntToVarint(_ZigZag(num - prev)))
+        prev = num
+    return "".join(txt)
+
+def _DeltaToIntList(txt, pos = 0):
+    (nb, pos) = _VarintToInt(txt, pos)
+    nums = []
+    prev = 0
+    for i in xrange(nb):
+        # inlined _VarintToInt, called for every node of every way
+        num   = 0
+        shift = 0
+        while True:
+            c = ord(txt[pos])
+            pos += 1
+            num |= (c & 127) << shift
+            if c < 128:
+                break
+            shift += 7
+        if num & 1:
+            prev -= (num + 1) >> 1
+        else:
+            prev += num >> 1
+        nums.append(prev)
+    return nums
+
+###########################################################################
+## Record store
+
+class _RecordStore:
+    """
+    Variable length records addressed by id. <name>.idx contains a 5 bytes
+    offset for each id, like way.idx, and <name>.data contains slots made of
+    a header (capacity, id, length) followed by the record. Freed slots are
+    flagged with id 0 and listed in <name>.free to be reused.
+    """
+
+    _Header     = struct.Struct(">IBII")
+    _HeaderSize = 13
+
+    # space allocation kept in memory, restored when an update fails
+    _alloc = ("_free", "_data_size")
+
+    def __init__(self, folder, name, mode = "r"):
+        self._mode       = mode
+        self._free_file  = os.path.join(folder, name + ".free")
+        self._data_file  = os.path.join(folder, name + ".data")
+        self._fIdx       = open(os.path.join(folder, name + ".idx"), {"w":"rb+", "r":"rb"}[mode])
+        self._fData      = open(self._data_file, {"w":"rb+", "r":"rb"}[mode])
+        self._data_size  = os.stat(self._data_file).st_size
+        if mode == "w":
+            self._mIdx  = None
+            self._mData = None
+            self._ReadFree()
+        else:
+            self._mIdx  = _MappedFile(self._fIdx)
+            self._mData = _MappedFile(self._fData)
+
+    def Close(self):
+        if self._mIdx is not None:
+            self._mIdx.close()
+            self._mData.close()
+        if self._mode == "w":
+            self._WriteFree()
+        self._fIdx.close()
+        self._fData.close()
+
+    def _ReadFree(self):
+        self._free = {}
+        f = open(self._free_file)
+        for line in f:
+            line = line.strip().split(';')
+            self._free.setdefault(int(line[1]), []).append(int(line[0]))
+        f.close()
+
+    def _FreeToStr(self):
+        txt = []
+        for cap in self._free:
+            for ptr in self._free[cap]:
+                txt.append("%d;%d\n"%(ptr, cap))
+        return "".join(txt)
+
+    def _WriteFree(self):
+        open(self._free_file, 'w').write(self._FreeToStr())
+
+    def _Read(self, f, m, offset, size):
+        if m is not None:
+            m = m.check(offset, size)
+            if m is None:
+                return ""
+            return m[offset:offset+size]
+        f.seek(offset)
+        return f.read(size)
+
+    def _Address(self, Id):
+        return _Str5ToInt(self._Read(self._fIdx, self._mIdx, 5*Id, 5))
+
+    def _SlotHeader(self, Adr):
+        # return (capacity, id, length)
+        (cap, h, l, length) = self._Header.unpack(self._Read(self._fData, self._mData, Adr, self._HeaderSize))
+        return (cap, 4294967296*h+l, length)
+
+    def _WriteSlot(self, Adr, cap, Id, txt):
+        self._fData.seek(Adr)
+        self._fData.write(self._Header.pack(cap, Id >> 32, Id & 0xffffffff, len(txt)) + txt)
+
+    def Get(self, Id):
+        Adr = self._Address(Id)
+        if not Adr:
+            return None
+        (cap, Id, length) = self._SlotHeader(Adr)
+        return self._Read(self._fData, self._mData, Adr + self._HeaderSize, length)
+
+    def Put(self, Id, txt):
+        Adr = self._Address(Id)
+        if Adr:
+            cap = self._SlotHeader(Adr)[0]
+            if cap >= len(txt):
+                # update in place
+                self._WriteSlot(Adr, cap, Id, txt)
+                return
+            self._FreeSlot(Adr, cap)
+        # capacity is rounded to increase chances of reusing free slots
+        cap = (len(txt) + 15) & ~15
+        if self._free.get(cap):
+            Adr = self._free[cap].pop()
+            self._WriteSlot(Adr, cap, Id, txt)
+        else:
+            Adr = self._data_size
+            self._data_size += self._HeaderSize + cap
+            self._WriteSlot(Adr, cap, Id, txt + "\0"*(cap - len(txt)))
+        self._fIdx.seek(5*Id)
+        self._fIdx.write(_IntToStr5(Adr))
+
+    def _FreeSlot(self, Adr, cap):
+        self._WriteSlot(Adr, cap, 0, "")
+        self._free.setdefault(cap, []).append(Adr)
+
+    def Delete(self, Id):
+        Adr = self._Address(Id)
+        if not Adr:
+            return
+        self._FreeSlot(Adr, self._SlotHeader(Adr)[0])
+        self._fIdx.seek(5*Id)
+        self._fIdx.write(_IntToStr5(0))
+
+    def Scan(self):
+        """
+        Sequential read of all records, as (id, record).
+        """
+        if self._mode == "w":
+            self._fData.flush()
+        f = open(self._data_file, "rb", 2**20)
+        f.read(2)
+        while True:
+            header = f.read(self._HeaderSize)
+            if len(header) < self._HeaderSize:
+                break
+            (cap, h, l, length) = self._Header.unpack(header)
+            txt = f.read(cap)
+            Id = 4294967296*h+l
+            if Id:
+                yield (Id, txt[:length])
+        f.close()
+
+def _InitRecordStore(folder, name):
+    open(os.path.join(folder, name + ".idx"), "wb")
+    open(os.path.join(folder, name + ".data"), "wb").write("--") # for no data at location 0
+    open(os.path.join(folder, name + ".free"), "wb")
+
+class _StringTable:
+    """
+    Strings shared between records (keys, roles), stored once in <name>.str
+    and referred by their index.
+    """
+
+    def __init__(self, folder, name, mode = "r"):
+        self._mode  = mode
+        self._file  = os.path.join(folder, name + ".str")
+        self._list  = []
+        self._index = {}
+        self._pos   = 0
+        self._Load()
+        if mode == "w":
+            self._f = open(self._file, "ab")
+
+    def Close(self):
+        if self._mode == "w":
+            self._f.close()
+
+    def _Load(self):
+        # read strings added since last load
+        f = open(self._file, "rb")
+        f.seek(self._pos)
+        txt = f.read()
+        f.close()
+        pos = 0
+        while pos < len(txt):
+            (length, pos) = _VarintToInt(txt, pos)
+            string = txt[pos:pos+length].decode("utf-8")
+            pos += length
+            self._index[string] = len(self._list)
+            self._list.append(string)
+        self._pos += pos
+
+    def Id(self, string):
+        if isinstance(string, str):
+            string = string.decode("utf-8")
+        i = self._index.get(string)
+        if i is None:
+            i = self._index[string] = len(self._list)
+            self._list.append(string)
+            txt = string.encode("utf-8")
+            self._f.write(_IntToVarint(len(txt)) + txt)
+            self._f.flush()
+        return i
+
+    def Get(self, i):
+        if i >= len(self._list):
+            # written by another process since opening
+            self._Load()
+        return self._list[i]
+
+###########################################################################
+## Node stores
+
+class _NodeStoreFlat:
+    """
+    Coordinates of node id at offset 8*id of node.crd.
+    """
+
+    _files = (("_f", "node.crd"),)
+    _alloc = ()
+
+    def __init__(self, folder, mode = "r"):
+        self._f = open(os.path.join(folder, "node.crd"), {"w":"rb+", "r":"rb"}[mode])
+        if mode == "w":
+            self._m = None
+        else:
+            # read only mode: lookups are served from page cache through mmap
+            self._m = _MappedFile(self._f)
+
+    def Close(self):
+        if self._m is not None:
+            self._m.close()
+        self._f.close()
+
+    def Get(self, NodeId):
+        # return (lat, lon) as stored integers
+        if self._m is not None:
+            return self._m.unpack(_StructCoord, 8*NodeId)
+        self._f.seek(8*NodeId)
+        read = self._f.read(8)
+        if len(read) != 8:
+            return None
+        return _StructCoord.unpack(read)
+
+    def GetMany(self, ids):
+        # return a dict id -> (lat, lon) for a sorted list of ids, ids close
+        # to each other are decoded with a single unpack call
+        res = {}
+        if self._m is None:
+            for NodeId in ids:
+                c = self.Get(NodeId)
+                if c:
+                    res[NodeId] = c
+            return res
+        i = 0
+        while i < len(ids):
+            # extend run while ids are close enough to be read in one block
+            j = i + 1
+            while j < len(ids) and ids[j] - ids[j-1] <= 8:
+                j += 1
+            first = ids[i]
+            nb = ids[j-1] - first + 1
+            m = self._m.check(8*first, 8*nb)
+            if m is not None:
+                v = struct.unpack_from(">%dI" % (2*nb), m, 8*first)
+                for NodeId in ids[i:j]:
+                    k = 2*(NodeId - first)
+                    res[NodeId] = (v[k], v[k+1])
+            else:
+                # end of file is reached
+                for NodeId in ids[i:j]:
+                    c = self.Get(NodeId)
+                    if c:
+                        res[NodeId] = c
+            i = j
+        return res
+
+    def Put(self, NodeId, txt):
+        # txt can hold coordinates of several consecutive nodes
+        self._f.seek(8*NodeId)
+        self._f.write(txt)
+
+    def BeginBatch(self):
+        self._w = _WritableMap(self._f)
+
+    def PutRun(self, NodeId, txt):
+        # coordinates of consecutive nodes, between BeginBatch and EndBatch
+        self._w.write(8*NodeId, txt)
+
+    def EndBatch(self):
+        self._w.close()
+        del self._w
+
+class _NodeStorePaged:
+    """
+    Coordinates stored by pages of 2**bits nodes, only pages containing
+    nodes are allocated in node.pag. node.dir contains the number of bits
+    on its first byte, then the offset of each page on 5 bytes, 0 for pages
+    not allocated.
+    """
+
+    _files = (("_fDir", "node.dir"), ("_fPag", "node.pag"))
+    _alloc = ("_pages", "_pag_size")
+
+    def __init__(self, folder, mode = "r"):
+        self._fDir = open(os.path.join(folder, "node.dir"), {"w":"rb+", "r":"rb"}[mode])
+        self._fPag = open(os.path.join(folder, "node.pag"), {"w":"rb+", "r":"rb"}[mode])
+        self._bits = ord(self._fDir.read(1))
+        self._mask = 2**self._bits - 1
+        self._page_size = 8 * 2**self._bits
+        if mode == "w":
+            self._mDir = None
+            self._mPag = None
+            self._pages = {}
+            self._pag_size = os.fstat(self._fPag.fileno()).st_size
+        else:
+            self._mDir = _MappedFile(self._fDir)
+            self._mPag = _MappedFile(self._fPag)
+
+    def Close(self):
+        if self._mDir is not None:
+            self._mDir.close()
+            self._mPag.close()
+        self._fDir.close()
+        self._fPag.close()
+
+    def _Page(self, page):
+        # offset of page in node.pag, 0 if not allocated
+        if self._mDir is not None:
+            v = self._mDir.unpack(_StructIdx, 5*(page+1))
+            if not v:
+                return 0
+            return 4294967296*v[0] + v[1]
+        Adr = self._pages.get(page)
+        if Adr is None:
+            self._fDir.seek(5*(page+1))
+            Adr = self._pages[page] = _Str5ToInt(self._fDir.read(5)) or 0
+        return Adr
+
+    def _Allocate(self, page):
+        Adr = self._Page(page)
+        if not Adr:
+            Adr = self._pag_size
+            self._pag_size += self._page_size
+            if not hasattr(self, "_w"):
+                self._fPag.seek(Adr)
+                self._fPag.write("\0" * self._page_size)
+            self._fDir.seek(5*(page+1))
+            self._fDir.write(_IntToStr5(Adr))
+            self._pages[page] = Adr
+        return Adr
+
+    def Get(self, NodeId):
+        Adr = self._Page(NodeId >> self._bits)
+        if not Adr:
+            return None
+        Adr += 8*(NodeId & self._mask)
+        if self._mPag is not None:
+            return self._mPag.unpack(_StructCoord, Adr)
+        self._fPag.seek(Adr)
+        read = self._fPag.read(8)
+        if len(read) != 8:
+            return None
+        return _StructCoord.unpack(read)
+
+    def GetMany(self, ids):
+        # return a dict id -> (lat, lon) for a sorted list of ids, ids from
+        # the same page are decoded with a single unpack call
+        res = {}
+        if self._mPag is None:
+            for NodeId in ids:
+                c = self.Get(NodeId)
+                if c:
+                    res[NodeId] = c
+            return res
+        i = 0
+        while i < len(ids):
+            page = ids[i] >> self._bits
+            j = i + 1
+            while j < len(ids) and ids[j] >> self._bits == page:
+                j += 1
+            Adr = self._Page(page)
+            if Adr:
+                first = ids[i] & self._mask
+                nb = (ids[j-1] & self._mask) - first + 1
+                m = self._mPag.check(Adr + 8*first, 8*nb)
+                if m is not None:
+                    v = struct.unpack_from(">%dI" % (2*nb), m, Adr + 8*first)
+                    for NodeId in ids[i:j]:
+                        k = 2*((NodeId & self._mask) - first)
+                        res[NodeId] = (v[k], v[k+1])
+            i = j
+        return res
+
+    def Put(self, NodeId, txt):
+        # txt can hold coordinates of several consecutive nodes
+        while txt:
+            nb = min(len(txt) / 8, self._mask + 1 - (NodeId & self._mask))
+            Adr = self._Allocate(NodeId >> self._bits)
+            self._fPag.seek(Adr + 8*(NodeId & self._mask))
+            self._fPag.write(txt[:8*nb])
+            NodeId += nb
+            txt = txt[8*nb:]
+
+    def BeginBatch(self):
+        self._w = _WritableMap(self._fPag)
+
+    def PutRun(self, NodeId, txt):
+        # coordinates of consecutive nodes, between BeginBatch and EndBatch
+        while txt:
+            nb = min(len(txt) / 8, self._mask + 1 - (NodeId & self._mask))
+            Adr = self._Allocate(NodeId >> self._bits)
+            self._w.write(Adr + 8*(NodeId & self._mask), txt[:8*nb])
+            NodeId += nb
+            txt = txt[8*nb:]
+
+    def EndBatch(self):
+        # keep whole pages allocated at end of file
+        self._w.close(self._pag_size)
+        del self._w
+
+###########################################################################
+## Tile index
+
+class _TileIndex:
+    """
+    Ids of nodes and ways by tile of the OSM tiling scheme at zoom level
+    12, stored as varint delta lists in tile.data. A way is listed in tiles
+    of its nodes. Changes are kept in memory and merged by Flush.
+    """
+
+    zoom = 12
+
+    def __init__(self, folder, mode = "r"):
+        self._store   = _RecordStore(folder, "tile", mode)
+        self._changes = {}
+        self._nb      = 0
+
+    def Close(self):
+        if self._store._mode == "w":
+            self.Flush()
+        self._store.Close()
+
+    def Tile(self, lat, lon):
+        n = 2**self.zoom
+        lat = max(min(lat, 85.0511), -85.0511)
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.log(math.tan(math.radians(lat)) + 1.0 / math.cos(math.radians(lat))) / math.pi) / 2.0 * n)
+        return min(max(y, 0), n - 1) * n + min(max(x, 0), n - 1)
+
+    def Tiles(self, coords):
+        # tiles of a list of (lat, lon), None are ignored
+        return set([self.Tile(c[0], c[1]) for c in coords if c])
+
+    def GetBBox(self, minlat, minlon, maxlat, maxlon):
+        # return (tile, (node ids, way ids)) of tiles in bounding box
+        n = 2**self.zoom
+        t1 = self.Tile(maxlat, minlon)
+        t2 = self.Tile(minlat, maxlon)
+        (x1, y1, x2, y2) = (t1 % n, t1 / n, t2 % n, t2 / n)
+        if (x2 - x1 + 1) * (y2 - y1 + 1) > 2**16:
+            # large area, read the whole index sequentially
+            for (tile, txt) in self._store.Scan():
+                if x1 <= tile % n <= x2 and y1 <= tile / n <= y2:
+                    yield (tile, self._Decode(txt))
+            return
+        for y in xrange(y1, y2 + 1):
+            for x in xrange(x1, x2 + 1):
+                yield (y*n + x, self.Get(y*n + x))
+
+    def Change(self, kind, tiles, Id, present):
+        # kind is 0 for nodes, 1 for ways. Last change of an id wins.
+        for tile in tiles:
+            self._changes.setdefault(tile, ({}, {}))[kind][Id] = present
+        self._nb += len(tiles)
+        if self._nb > 2**20:
+            self.Flush()
+
+    def Get(self, tile):
+        # return (node ids, way ids) of a tile
+        return self._Decode(self._store.Get(tile))
+
+    def _Decode(self, txt):
+        if not txt:
+            return ([], [])
+        (l, pos) = _VarintToInt(txt, 0)
+        return (_DeltaToIntList(txt, pos), _DeltaToIntList(txt, pos + l))
+
+    def Flush(self):
+        for tile in sorted(self._changes):
+            lists = self.Get(tile)
+            res = []
+            for kind in (0, 1):
+                ids = set(lists[kind])
+                for (Id, present) in self._changes[tile][kind].iteritems():
+                    if present:
+                        ids.add(Id)
+                    else:
+                        ids.discard(Id)
+                res.append(_IntListToDelta(sorted(ids)))
+            if res == [_IntListToDelta([])] * 2:
+                self._store.Delete(tile)
+            else:
+                self._store.Put(tile, _IntToVarint(len(res[0])) + res[0] + res[1])
+        self._changes = {}
+        self._nb = 0
+
+###########################################################################
+## Update journal
+
+_Journal = "update.journal"
+
+def _WriteJournal(folder, writes):
+    # writes are (file name, offset, data), offset None to replace the
+    # whole file. The journal is complete once renamed.
+    path = os.path.join(folder, _Journal)
+    f = open(path + ".tmp", "wb")
+    for (name, offset, data) in writes:
+        if offset is None:
+            offset = -1
+        f.write(struct.pack(">HqQ", len(name), offset, len(data)) + name + data)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(path + ".tmp", path)
+
+def _ApplyJournal(folder, writes):
+    files = {}
+    for (name, offset, data) in writes:
+        if offset is None:
+            f = open(os.path.join(folder, name), "wb")
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            continue
+        if name not in files:
+            files[name] = open(os.path.join(folder, name), "rb+")
+        files[name].seek(offset)
+        files[name].write(data)
+    for f in files.values():
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+    os.remove(os.path.join(folder, _Journal))
+
+def _RollForward(folder):
+    # apply an update interrupted after its journal was written
+    path = os.path.join(folder, _Journal)
+    if os.path.exists(path + ".tmp"):
+        os.remove(path + ".tmp")
+    if not os.path.exists(path):
+        return
+    print("Rolling forward interrupted update")
+    txt = open(path, "rb").read()
+    writes = []
+    pos = 0
+    header = struct.Struct(">HqQ")
+    while pos < len(txt):
+        (l, offset, size) = header.unpack_from(txt, pos)
+        pos += header.size
+        name = txt[pos:pos+l]
+        data = txt[pos+l:pos+l+size]
+        pos += l + size
+        writes.append((name, None if offset < 0 else offset, data))
+    _ApplyJournal(folder, writes)
+
 ###########################################################################
 ## InitFolder
 
-def InitFolder(folder):
+# first bytes of way.data, nothing is stored at location 0
+_WayDataLegacy = "--"
+_WayDataDelta  = "-d"
+
+def InitFolder(folder, paged = False, page_bits = 10, way_delta = True, tiles = False):
 
     nb_node_max = 2**4
     nb_way_max  = 2**4
@@ -141,15 +1037,22 @@ def InitFolder(folder):
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-    # create node.crd
-    print("Creating node.crd")
-    groupe = 2**10
-    k = _IntToStr4(0) * 2 * groupe
-    f = open(os.path.join(folder, "node.crd"), "wb")
-    for i in range(nb_node_max/groupe):
-        f.write(k)
-    f.close()
-    del k
+    if paged:
+        # create node.dir and node.pag, first page is never used
+        print("Creating node.dir and node.pag")
+        open(os.path.join(folder, "node.dir"), "wb").write(_IntToStr1(page_bits) + "\0"*4)
+        open(os.path.join(folder, "node.pag"), "wb").write("\0" * 8 * 2**page_bits)
+
+    else:
+        # create node.crd
+        print("Creating node.crd")
+        groupe = 2**10
+        k = _IntToStr4(0) * 2 * groupe
+        f = open(os.path.join(folder, "node.crd"), "wb")
+        for i in range(nb_node_max/groupe):
+            f.write(k)
+        f.close()
+        del k
 
     # create way.idx
     print("Creating way.idx")
@@ -163,38 +1066,101 @@ def InitFolder(folder):
         
     # reset way.data
     print("Creating way.data")
-    open(os.path.join(folder, "way.data"), "wb").write("--") # for no data at location 0
+    open(os.path.join(folder, "way.data"), "wb").write(way_delta and _WayDataDelta or _WayDataLegacy)
     
     # reset way.free
     print("Creating way.free")
     open(os.path.join(folder, "way.free"), "wb")
 
+    # reset relation.idx, relation.data, relation.free and relation.str
+    print("Creating relation.data")
+    _InitRecordStore(folder, "relation")
+    open(os.path.join(folder, "relation.str"), "wb")
+
+    if tiles:
+        # reset tile.idx, tile.data and tile.free
+        print("Creating tile.data")
+        _InitRecordStore(folder, "tile")
+
+def ConvertRelationFolder(folder):
+    # move relations from the relation/XXX/YYY/ZZZ files used by previous
+    # versions to relation.data
+    reldir = os.path.join(folder, "relation")
+    if not os.path.exists(os.path.join(folder, "relation.data")):
+        _InitRecordStore(folder, "relation")
+        open(os.path.join(folder, "relation.str"), "wb")
+    o = OsmBin(folder, "w")
+    for (path, dirs, files) in os.walk(reldir):
+        dirs.sort()
+        for f in sorted(files):
+            o.RelationCreate(eval(open(os.path.join(path, f)).read()))
+    del o
+    print("Relations converted, %s can be removed" % reldir)
+
 ###########################################################################
 ## OsmBinWriter
 
 class OsmBin:
 
+    _alloc = ("_free", "_fWay_data_size")
+
     def __init__(self, folder, mode = "r"):
         self._mode           = mode
         self._folder         = folder
-        self._reldir         = os.path.join(folder, "relation")
-        self._fNode_crd      = open(os.path.join(folder, "node.crd"), {"w":"rb+", "r":"r"}[mode])
-        self._fWay_idx       = open(os.path.join(folder, "way.idx") , {"w":"rb+", "r":"r"}[mode])
-        self._fWay_data      = open(os.path.join(folder, "way.data"), {"w":"rb+", "r":"r"}[mode])
-        self._fWay_data_size = os.stat(os.path.join(folder, "way.data")).st_size
         if self._mode=="w":
             lock_file = os.path.join(folder, "lock")
             self._lock = lockfile.FileLock(lock_file)
             self._lock.acquire(timeout=0)
+            _RollForward(folder)
+        if os.path.exists(os.path.join(folder, "node.dir")):
+            self._Node       = _NodeStorePaged(folder, mode)
+        else:
+            self._Node       = _NodeStoreFlat(folder, mode)
+        self._fWay_idx       = open(os.path.join(folder, "way.idx") , {"w":"rb+", "r":"rb"}[mode])
+        self._fWay_data      = open(os.path.join(folder, "way.data"), {"w":"rb+", "r":"rb"}[mode])
+        self._fWay_data_size = os.stat(os.path.join(folder, "way.data")).st_size
+        # node lists are stored either as 5 bytes integers (legacy), or as
+        # varint deltas
+        self._way_delta      = self._fWay_data.read(2) == _WayDataDelta
+        if self._mode=="w":
             self._ReadFree()
+            self._mWay_idx  = None
+        else:
+            # read only mode: lookups are served from page cache through mmap
+            self._mWay_idx  = _MappedFile(self._fWay_idx)
+            self._mWay_data = _MappedFile(self._fWay_data)
+        self._Relation     = _RecordStore(folder, "relation", mode)
+        self._RelationStr  = _StringTable(folder, "relation", mode)
+        if os.path.exists(os.path.join(folder, "tile.idx")):
+            self._Tiles    = _TileIndex(folder, mode)
+        else:
+            self._Tiles    = None
+        # tile of moved nodes before their first move, their ways are moved
+        # by _MovedWayTiles
+        self._moved        = {}
 
         self.node_id_size = 5
         
     def __del__(self):
         try:
-            self._fNode_crd.close()
+            if self._Tiles:
+                if self._mode == "w":
+                    self._MovedWayTiles()
+                self._Tiles.Close()
+        except AttributeError:
+            pass
+        try:
+            if self._mWay_idx is not None:
+                self._mWay_idx.close()
+                self._mWay_data.close()
+        except AttributeError:
+            pass
+        try:
+            self._Node.Close()
             self._fWay_idx.close()
             self._fWay_data.close()
+            self._Relation.Close()
+            self._RelationStr.Close()
         except AttributeError:
             pass
         if self._mode=="w":
@@ -202,27 +1168,29 @@ class OsmBin:
             self._lock.release()
         
     def _ReadFree(self):
+        # free slots by number of nodes (legacy) or by capacity (delta)
         self._free = {}
-        for nbn in range(2001):
-            self._free[nbn] = []            
         f = open(os.path.join(self._folder, "way.free"))
         while True:
             line = f.readline()
             if not line:
                 break
             line = line.strip().split(';')
-            self._free[int(line[1])].append(int(line[0]))
+            self._free.setdefault(int(line[1]), []).append(int(line[0]))
+
+    def _FreeToStr(self):
+        txt = []
+        for nbn in self._free:
+            for ptr in self._free[nbn]:
+                txt.append("%d;%d\n"%(ptr, nbn))
+        return "".join(txt)
 
     def _WriteFree(self):
         try:
             self._free
         except AttributeError:
             return
-        f = open(os.path.join(self._folder, "way.free"), 'w')
-        for nbn in self._free:
-            for ptr in self._free[nbn]:
-                f.write("%d;%d\n"%(ptr, nbn))
-        f.close()
+        open(os.path.join(self._folder, "way.free"), 'w').write(self._FreeToStr())
         
     def begin(self):
         pass
@@ -234,144 +1202,589 @@ class OsmBin:
     ## node functions
         
     def NodeGet(self, NodeId):
-        data = {}
-        data["id"] = NodeId
-        self._fNode_crd.seek(8*data[u"id"])
-        read = self._fNode_crd.read(8)
-        if len(read) != 8:
+        c = self._Node.Get(NodeId)
+        if not c:
             return None
-        data["lat"] = _Str4ToCoord(read[:4])
-        data["lon"] = _Str4ToCoord(read[4:])
-        data["tag"] = {}
-        return data
-        
+        return {"id": NodeId, "lat": _IntToCoord(c[0]), "lon": _IntToCoord(c[1]), "tag": {}}
+
+    def _NodeCoordMany(self, NodeIds):
+        # return a dict id -> (lat, lon)
+        coords = self._Node.GetMany(sorted(set(NodeIds)))
+        for (NodeId, c) in coords.items():
+            coords[NodeId] = (_IntToCoord(c[0]), _IntToCoord(c[1]))
+        return coords
+
+    def NodeGetMany(self, NodeIds):
+        """
+        Get a list of nodes at once, in same order as NodeIds.
+        Missing nodes are returned as None.
+        """
+        coords = self._NodeCoordMany(NodeIds)
+        res = []
+        for NodeId in NodeIds:
+            c = coords.get(NodeId)
+            if c:
+                res.append({"id": NodeId, "lat": c[0], "lon": c[1], "tag": {}})
+            else:
+                res.append(None)
+        return res
+
     def NodeCreate(self, data):
+        if self._Tiles:
+            self._NodeTiles(data[u"id"], (data[u"lat"], data[u"lon"]))
         LatStr4 = _CoordToStr4(data[u"lat"])
         LonStr4 = _CoordToStr4(data[u"lon"])
-        self._fNode_crd.seek(8*data[u"id"])
-        self._fNode_crd.write(LatStr4+LonStr4)
+        self._Node.Put(data[u"id"], LatStr4+LonStr4)
         
     NodeUpdate = NodeCreate
 
+    def NodeCreateMany(self, datas):
+        """
+        Store a list of nodes, coordinates of consecutive ids are written
+        at once.
+        """
+        datas = sorted(datas, key=lambda data: data[u"id"])
+        ids = [data[u"id"] for data in datas]
+        if self._Tiles:
+            for data in datas:
+                self._NodeTiles(data[u"id"], (data[u"lat"], data[u"lon"]))
+        for (start, end) in _Runs(ids):
+            self._Node.Put(ids[start], "".join([_CoordToStr4(data[u"lat"]) + _CoordToStr4(data[u"lon"]) for data in datas[start:end]]))
+
     def NodeDelete(self, data):
+        if self._Tiles:
+            self._NodeTiles(data[u"id"], None)
         LatStr4 = _IntToStr4(0)
         LonStr4 = _IntToStr4(0)
-        self._fNode_crd.seek(8*data[u"id"])
-        self._fNode_crd.write(LatStr4+LonStr4)
+        self._Node.Put(data[u"id"], LatStr4+LonStr4)
+
+    def _NodeTiles(self, NodeId, coord):
+        # move node from tile of its stored coordinates to tile of coord
+        old = self._Node.Get(NodeId)
+        if old and old != (0, 0):
+            old = self._Tiles.Tile(_IntToCoord(old[0]), _IntToCoord(old[1]))
+        else:
+            old = None
+        new = coord and self._Tiles.Tile(coord[0], coord[1])
+        if old != new:
+            if old is not None:
+                self._Tiles.Change(0, [old], NodeId, False)
+                self._moved.setdefault(NodeId, old)
+            if new is not None:
+                self._Tiles.Change(0, [new], NodeId, True)
+
+    def _NodeTileMany(self, NodeIds):
+        # return a dict id -> tile of stored coordinates, without deleted
+        # nodes
+        tiles = {}
+        for (NodeId, c) in self._Node.GetMany(sorted(set(NodeIds))).iteritems():
+            if c != (0, 0):
+                tiles[NodeId] = self._Tiles.Tile(_IntToCoord(c[0]), _IntToCoord(c[1]))
+        return tiles
 
     #######################################################################
     ## way functions
     
     def WayGet(self, WayId):
+        nds = self._WayNodes(WayId)
+        if nds is None:
+            return None
+        return {"id": WayId, "nd": nds, "tag":{}}
+
+    def _WayAddress(self, WayId):
+        if self._mWay_idx is not None:
+            v = self._mWay_idx.unpack(_StructIdx, 5*WayId)
+            if not v:
+                return None
+            return 4294967296*v[0] + v[1]
         self._fWay_idx.seek(5*WayId)
-        AdrWay = _Str5ToInt(self._fWay_idx.read(5))
+        return _Str5ToInt(self._fWay_idx.read(5))
+
+    def _WayData(self, offset, size):
+        # read from way.data, truncated at end of file
+        if self._mWay_idx is not None:
+            return self._mWay_data.read(offset, size)
+        self._fWay_data.seek(offset)
+        return self._fWay_data.read(size)
+
+    def _WaySlot(self, AdrWay):
+        # return (free list key, offset of node list, size of node list)
+        if self._way_delta:
+            (cap, pos) = _VarintToInt(self._WayData(AdrWay, 4), 0)
+            return (cap, AdrWay + pos, cap)
+        nbn = _StructNbn.unpack(self._WayData(AdrWay, 2))[0]
+        return (nbn, AdrWay + 2, self.node_id_size*nbn)
+
+    def _WayNodes(self, WayId):
+        AdrWay = self._WayAddress(WayId)
         if not AdrWay:
             return None
-        self._fWay_data.seek(AdrWay)
-        nbn  = _Str2ToInt(self._fWay_data.read(2))
-        data = self._fWay_data.read(self.node_id_size*nbn)
-        nds = []
-        for i in range(nbn):
-            nds.append(_Str5ToInt(data[self.node_id_size*i:self.node_id_size*(i+1)]))
-        return {"id": WayId, "nd": nds, "tag":{}}
-    
+        (key, offset, size) = self._WaySlot(AdrWay)
+        data = self._WayData(offset, size)
+        if len(data) != size:
+            return None
+        if self._way_delta:
+            return _DeltaToIntList(data)
+        return _Str5ListToInt(data, 0, size / self.node_id_size)
+
+    def _WayToStr(self, nds, cap = None):
+        # return (free list key, slot content)
+        if self._way_delta:
+            txt = _IntListToDelta(nds)
+            if cap is None:
+                # rounded to increase chances of reusing free slots
+                cap = (len(txt) + 3) & ~3
+            return (cap, _IntToVarint(cap) + txt + "\0"*(cap - len(txt)))
+        return (len(nds), _IntToStr2(len(nds)) + _IntListToStr5(nds))
+
+    def WayGetMany(self, WayIds):
+        """
+        Get a list of ways at once, in same order as WayIds.
+        Missing ways are returned as None.
+        """
+        ways = {}
+        for WayId in sorted(set(WayIds)):
+            ways[WayId] = self.WayGet(WayId)
+        return [ways[WayId] for WayId in WayIds]
+
+    def WayCoordinates(self, WayId):
+        """
+        Get the list of (lat, lon) of nodes from a way, None for missing
+        nodes. Return None if way is missing.
+        """
+        way = self.WayGet(WayId)
+        if not way:
+            return None
+        coords = self._NodeCoordMany(way["nd"])
+        return [coords.get(NodeId) for NodeId in way["nd"]]
+
     def WayCreate(self, data):
-        self.WayDelete(data)
+        if self._Tiles:
+            self._WayTiles(data[u"id"], data[u"nd"])
+        (key, txt) = self._WayToStr(data[u"nd"])
+        AdrWay = self._WayAddress(data[u"id"])
+        if AdrWay and self._way_delta:
+            cap = self._WaySlot(AdrWay)[0]
+            if cap >= key:
+                # update in place, keeping slot capacity
+                self._fWay_data.seek(AdrWay)
+                self._fWay_data.write(self._WayToStr(data[u"nd"], cap)[1])
+                return
+        self._WayFree(data)
         # Search space big enough to store node list
-        nbn = len(data["nd"])
-        if self._free[nbn]:
-            AdrWay = self._free[nbn].pop()
+        if self._free.get(key):
+            AdrWay = self._free[key].pop()
         else:
             AdrWay = self._fWay_data_size
-            self._fWay_data_size += 2 + self.node_id_size*nbn
+            self._fWay_data_size += len(txt)
         # File way.idx
         self._fWay_idx.seek(5*data[u"id"])
         self._fWay_idx.write(_IntToStr5(AdrWay))
         # File way.dat
         self._fWay_data.seek(AdrWay)
-        c = _IntToStr2(len(data[u"nd"]))
-        for NodeId in data[u"nd"]:
-            c += _IntToStr5(NodeId)
-        self._fWay_data.write(c)
+        self._fWay_data.write(txt)
 
     WayUpdate = WayCreate
+
+    def WayCreateMany(self, datas):
+        """
+        Store a list of ways. As with WayCreate, node lists are updated in
+        place or go to free slots, others are appended to way.data in one
+        write.
+        """
+        # last version of ways given several times
+        ways = sorted(dict([(data[u"id"], data[u"nd"]) for data in datas]).items())
+        if self._Tiles:
+            for (WayId, nds) in ways:
+                self._WayTiles(WayId, nds)
+        self._WayAppend(ways)
+
+    def _WayAppend(self, ways):
+        # ways is a sorted list of (id, nodes), with distinct ids
+        ids = [w[0] for w in ways]
+        olds = []
+        for (start, end) in _Runs(ids):
+            # addresses of previous version of ways, none on import
+            self._fWay_idx.seek(5*ids[start])
+            old = self._fWay_idx.read(5*(end - start))
+            if old.strip("\0"):
+                old += "\0"*(5*(end - start) - len(old))
+                olds.extend(_Str5ListToInt(old, 0, end - start))
+            else:
+                olds.extend([0]*(end - start))
+        txt = []
+        adrs = []
+        size = self._fWay_data_size
+        for ((WayId, refs), AdrWay) in zip(ways, olds):
+            (key, c) = self._WayToStr(refs)
+            if AdrWay:
+                cap = self._WaySlot(AdrWay)[0]
+                if self._way_delta and cap >= key:
+                    # update in place, keeping slot capacity
+                    self._fWay_data.seek(AdrWay)
+                    self._fWay_data.write(self._WayToStr(refs, cap)[1])
+                    adrs.append(AdrWay)
+                    continue
+                self._free.setdefault(cap, []).append(AdrWay)
+            if self._free.get(key):
+                AdrWay = self._free[key].pop()
+                self._fWay_data.seek(AdrWay)
+                self._fWay_data.write(c)
+            else:
+                AdrWay = size
+                size += len(c)
+                txt.append(c)
+            adrs.append(AdrWay)
+        for (start, end) in _Runs(ids):
+            self._fWay_idx.seek(5*ids[start])
+            self._fWay_idx.write(_IntListToStr5(adrs[start:end]))
+        self._fWay_data.seek(self._fWay_data_size)
+        self._fWay_data.write("".join(txt))
+        self._fWay_data_size = size
     
     def WayDelete(self, data):
+        if self._Tiles:
+            self._WayTiles(data[u"id"], [])
+        self._WayFree(data)
+
+    def _WayTiles(self, WayId, nds):
+        # move way from tiles of its stored nodes to tiles of nds, nodes
+        # moved since the way was indexed also count in their previous tile
+        old = self._WayNodes(WayId) or []
+        tiles = self._NodeTileMany(old + nds)
+        new = set([tiles[n] for n in nds if n in tiles])
+        old = set([tiles[n] for n in old if n in tiles] + [self._moved[n] for n in old if n in self._moved])
+        self._Tiles.Change(1, old - new, WayId, False)
+        self._Tiles.Change(1, new, WayId, True)
+
+    def _MovedWayTiles(self):
+        # ways of moved nodes are still listed in tiles of the nodes before
+        # their move, they are found there and moved to tiles of their
+        # current nodes. Ways listed in these tiles are all read.
+        if not self._moved:
+            return
+        moved = self._moved
+        self._moved = {}
+        nodes = {}
+        for (NodeId, tile) in moved.iteritems():
+            nodes.setdefault(tile, set()).add(NodeId)
+        self._Tiles.Flush()
+        ways = {}
+        for tile in sorted(nodes):
+            for way in self.WayGetMany(self._Tiles.Get(tile)[1]):
+                if way and not nodes[tile].isdisjoint(way["nd"]):
+                    ways[way["id"]] = way["nd"]
+        for (WayId, nds) in sorted(ways.iteritems()):
+            tiles = self._NodeTileMany(nds)
+            new = set(tiles.values())
+            old = set([moved[n] for n in nds if n in moved])
+            self._Tiles.Change(1, old - new, WayId, False)
+            self._Tiles.Change(1, new, WayId, True)
+
+    def _WayFree(self, data):
         # Seek to position in file containing address to node list
-        self._fWay_idx.seek(5*data[u"id"])
-        AdrWay = _Str5ToInt(self._fWay_idx.read(5))
+        AdrWay = self._WayAddress(data[u"id"])
         if not AdrWay:
             return
         # Free space
-        self._fWay_data.seek(AdrWay)
-        nbn = _Str2ToInt(self._fWay_data.read(2))
-        try:
-            self._free[nbn].append(AdrWay)
-        except KeyError:
-            print("Cannot access free[%d] for way id=%d, idx=%d" % (nbn, data[u"id"], AdrWay))
-            raise
+        self._free.setdefault(self._WaySlot(AdrWay)[0], []).append(AdrWay)
         # Save deletion
         self._fWay_idx.seek(5*data[u"id"])
         self._fWay_idx.write(_IntToStr5(0))
-        
+
+    def Compact(self):
+        """
+        Rewrite way.data without free slots, with node lists as varint
+        deltas, and way.idx accordingly. Ways whose slot can not be read
+        are dropped. Readers opened before have to be reopened.
+        """
+        old_size = self._fWay_data_size
+        idx_file  = os.path.join(self._folder, "way.idx")
+        data_file = os.path.join(self._folder, "way.data")
+        self._fWay_idx.flush()
+        self._fWay_data.flush()
+        fIdx = open(idx_file + ".new", "wb")
+        fData = open(data_file + ".new", "wb", 2**20)
+        dropped = []
+        ok = False
+        try:
+            fData.write(_WayDataDelta)
+            AdrWay = len(_WayDataDelta)
+            # sequential read of way.idx
+            fOldIdx = open(idx_file, "rb", 2**20)
+            WayId = 0
+            while True:
+                buf = fOldIdx.read(5*2**16)
+                if not buf:
+                    break
+                if not buf.strip("\0"):
+                    # keep way.idx sparse
+                    fIdx.seek(len(buf), 1)
+                    WayId += len(buf) / 5
+                    continue
+                adrs = _Str5ListToInt(buf, 0, len(buf) / 5)
+                for i in xrange(len(adrs)):
+                    if adrs[i]:
+                        nds = self._WayNodes(WayId + i)
+                        if nds is None:
+                            dropped.append(WayId + i)
+                            adrs[i] = 0
+                            continue
+                        txt = _IntListToDelta(nds)
+                        txt = _IntToVarint(len(txt)) + txt
+                        fData.write(txt)
+                        adrs[i] = AdrWay
+                        AdrWay += len(txt)
+                fIdx.write(_IntListToStr5(adrs))
+                WayId += len(adrs)
+            fOldIdx.close()
+            fIdx.truncate(5*WayId)
+            ok = True
+        finally:
+            fIdx.close()
+            fData.close()
+            if not ok:
+                os.remove(idx_file + ".new")
+                os.remove(data_file + ".new")
+        if dropped:
+            print("%d ways with unreadable slots dropped" % len(dropped))
+        self._fWay_idx.close()
+        self._fWay_data.close()
+        os.rename(idx_file + ".new", idx_file)
+        os.rename(data_file + ".new", data_file)
+        self._fWay_idx  = open(idx_file, "rb+")
+        self._fWay_data = open(data_file, "rb+")
+        self._fWay_data_size = AdrWay
+        self._way_delta = True
+        self._free = {}
+        print("way.data: %d -> %d bytes, %d bytes reclaimed" % (old_size, AdrWay, old_size - AdrWay))
+        return old_size - AdrWay
+
     #######################################################################
     ## relation functions
 
+    _MemberType  = {"node": 0, "way": 1, "relation": 2}
+    _MemberTypes = [u"node", u"way", u"relation"]
+
+    def _RelationToStr(self, data):
+        # attributes are (key, type, value), with type 0 for integers, 1 for
+        # unicode, 2 for str and 3 for floats
+        attrs = []
+        for (k, v) in data.items():
+            if k in ("tag", "member"):
+                continue
+            if isinstance(v, (int, long)) and not isinstance(v, bool):
+                c = "\0" + _IntToVarint(_ZigZag(v))
+            elif isinstance(v, str):
+                c = "\2" + _IntToVarint(len(v)) + v
+            elif isinstance(v, float):
+                v = repr(v)
+                c = "\3" + _IntToVarint(len(v)) + v
+            else:
+                v = unicode(v).encode("utf-8")
+                c = "\1" + _IntToVarint(len(v)) + v
+            attrs.append(_IntToVarint(self._RelationStr.Id(k)) + c)
+        c = [_IntToVarint(len(attrs))] + attrs
+        c.append(_IntToVarint(len(data["member"])))
+        for m in data["member"]:
+            c.append(chr(self._MemberType[m["type"]]) + _IntToVarint(m["ref"]) + _IntToVarint(self._RelationStr.Id(m["role"])))
+        c.append(_IntToVarint(len(data["tag"])))
+        for (k, v) in data["tag"].items():
+            v = v.encode("utf-8")
+            c.append(_IntToVarint(self._RelationStr.Id(k)) + _IntToVarint(len(v)) + v)
+        return "".join(c)
+
+    def _StrToRelation(self, txt):
+        data = {}
+        (nb, pos) = _VarintToInt(txt, 0)
+        for i in xrange(nb):
+            (k, pos) = _VarintToInt(txt, pos)
+            t = txt[pos]
+            if t == "\0":
+                (v, pos) = _VarintToInt(txt, pos + 1)
+                v = _UnZigZag(v)
+            else:
+                (length, pos) = _VarintToInt(txt, pos + 1)
+                v = txt[pos:pos+length]
+                pos += length
+                if t == "\1":
+                    v = v.decode("utf-8")
+                elif t == "\3":
+                    v = float(v)
+            data[self._RelationStr.Get(k)] = v
+        members = []
+        (nb, pos) = _VarintToInt(txt, pos)
+        for i in xrange(nb):
+            t = self._MemberTypes[ord(txt[pos])]
+            (ref, pos) = _VarintToInt(txt, pos + 1)
+            (role, pos) = _VarintToInt(txt, pos)
+            members.append({u"type": t, u"ref": ref, u"role": self._RelationStr.Get(role)})
+        tags = {}
+        (nb, pos) = _VarintToInt(txt, pos)
+        for i in xrange(nb):
+            (k, pos) = _VarintToInt(txt, pos)
+            (length, pos) = _VarintToInt(txt, pos)
+            tags[self._RelationStr.Get(k)] = txt[pos:pos+length].decode("utf-8")
+            pos += length
+        data[u"member"] = members
+        data[u"tag"] = tags
+        return data
+
     def RelationGet(self, RelationId):
-        RelationId = "%09d"%RelationId
-        RelFolder  = self._reldir + "/" + RelationId[0:3] + "/" + RelationId[3:6] + "/"
-        RelFile    = RelationId[6:9]
-        if os.path.exists(RelFolder + RelFile):
-            return eval(open(RelFolder + RelFile).read())
-        else:
+        txt = self._Relation.Get(RelationId)
+        if txt is None:
             return None
-    
+        return self._StrToRelation(txt)
+
+    def RelationGetMany(self, RelationIds):
+        """
+        Get a list of relations at once, in same order as RelationIds.
+        Missing relations are returned as None.
+        """
+        rels = {}
+        for RelationId in sorted(set(RelationIds)):
+            rels[RelationId] = self.RelationGet(RelationId)
+        return [rels[RelationId] for RelationId in RelationIds]
+
     def RelationCreate(self, data):
-        RelationId = "%09d"%data["id"]
-        RelFolder  = self._reldir + "/" + RelationId[0:3] + "/" + RelationId[3:6] + "/"
-        RelFile    = RelationId[6:9]
-        if not os.path.exists(RelFolder):
-            os.makedirs(RelFolder)
-        open(RelFolder + RelFile, "w").write(repr(data))
-    
+        self._Relation.Put(data["id"], self._RelationToStr(data))
+
     RelationUpdate = RelationCreate
-    
-    def RelationDelete(self, data):
-        RelationId = "%09d"%data["id"]
-        RelFolder  = self._reldir + "/" + RelationId[0:3] + "/" + RelationId[3:6] + "/"
-        RelFile    = RelationId[6:9]
-        try:
-            os.remove(RelFolder + RelFile)
-        except:
-            pass
 
-    def RelationFullRecur(self, RelationId, WayNodes = True, RaiseOnLoop = True, RemoveSubarea = False, RecurControl = []):
-        rel = self.RelationGet(RelationId)
-        dta = [{"type": "relation", "data": rel}]
+    def RelationCreateMany(self, datas):
+        for data in sorted(datas, key=lambda data: data["id"]):
+            self.RelationCreate(data)
+
+    def RelationDelete(self, data):
+        self._Relation.Delete(data["id"])
+
+    def _RelationFullItems(self, rel, WayNodes):
+        # members of a relation, with node and way members fetched in bulk.
+        # Sub-relations are left as (ref, role) to be expanded by caller.
+        ways = self.WayGetMany([m["ref"] for m in rel["member"] if m["type"] == "way"])
+        ways = dict(zip([m["ref"] for m in rel["member"] if m["type"] == "way"], ways))
+        nodes = [m["ref"] for m in rel["member"] if m["type"] == "node"]
+        if WayNodes:
+            for way in ways.values():
+                if way:
+                    nodes += way["nd"]
+        nodes = dict(zip(nodes, self.NodeGetMany(nodes)))
+        items = [{"type": "relation", "data": rel}]
         for m in rel["member"]:
             if m["type"] == "node":
-                dta.append({"type": "node", "data": self.NodeGet(m["ref"])})
+                items.append({"type": "node", "data": nodes[m["ref"]]})
             elif m["type"] == "way":
-                way = self.WayGet(m["ref"])
+                way = ways[m["ref"]]
                 if not way:
                     raise MissingDataError("missing way %d"%m["ref"])
-                dta.append({"type": "way", "data": way})
+                items.append({"type": "way", "data": way})
                 if WayNodes:
                     for n in way["nd"]:
-                        dta.append({"type": "node", "data": self.NodeGet(n)})
+                        items.append({"type": "node", "data": nodes[n]})
             elif m["type"] == "relation":
-                if m["ref"] == RelationId:
-                    if not RaiseOnLoop:
-                        continue
-                    raise RelationLoopError('self member '+str(RelationId))
-                if m["ref"] in RecurControl:
-                    if not RaiseOnLoop:
-                        continue
-                    raise RelationLoopError('member loop '+str(RecurControl+[RelationId, m["ref"]]))
-                if RemoveSubarea and m["role"] in [u"subarea", u"region"]:
+                items.append((m["ref"], m["role"]))
+        return items
+
+    def _RelationFullGet(self, RelationId):
+        rel = self.RelationGet(RelationId)
+        if not rel:
+            raise MissingDataError("missing relation %d"%RelationId)
+        return rel
+
+    def RelationFullRecur(self, RelationId, WayNodes = True, RaiseOnLoop = True, RemoveSubarea = False, RecurControl = []):
+        """
+        Get a relation followed by its members, sub-relations members being
+        included recursively. RemoveSubarea only applies to members of
+        RelationId.
+        """
+        # sub-relations expanded without meeting a loop are the same
+        # wherever they are used, and are expanded once
+        memo = {}
+        path = list(RecurControl)
+        in_path = set(path)
+        # stack of [relation id, items, next item, result, without loop]
+        stack = []
+        items = self._RelationFullItems(self._RelationFullGet(RelationId), WayNodes)
+        stack.append([RelationId, items, 0, [], True])
+        path.append(RelationId)
+        in_path.add(RelationId)
+        while True:
+            frame = stack[-1]
+            if frame[2] == len(frame[1]):
+                # relation completed
+                stack.pop()
+                path.pop()
+                in_path.discard(frame[0])
+                if frame[4]:
+                    memo[frame[0]] = frame[3]
+                if not stack:
+                    return frame[3]
+                stack[-1][3].extend(frame[3])
+                continue
+            item = frame[1][frame[2]]
+            frame[2] += 1
+            if isinstance(item, dict):
+                frame[3].append(item)
+                continue
+            (ref, role) = item
+            if ref == frame[0]:
+                if not RaiseOnLoop:
                     continue
-                dta += self.RelationFullRecur(m["ref"], WayNodes = WayNodes, RaiseOnLoop = RaiseOnLoop, RecurControl = RecurControl+[RelationId])
-        return dta
+                raise RelationLoopError('self member '+str(ref))
+            if ref in in_path:
+                if not RaiseOnLoop:
+                    for f in stack:
+                        f[4] = False
+                    continue
+                raise RelationLoopError('member loop '+str(path+[ref]))
+            if RemoveSubarea and len(stack) == 1 and role in [u"subarea", u"region"]:
+                continue
+            if ref in memo:
+                frame[3].extend(memo[ref])
+                continue
+            items = self._RelationFullItems(self._RelationFullGet(ref), WayNodes)
+            stack.append([ref, items, 0, [], True])
+            path.append(ref)
+            in_path.add(ref)
+
+    #######################################################################
+    ## bounding box functions
+
+    def _TilesGet(self, minlat, minlon, maxlat, maxlon, kind):
+        if not self._Tiles:
+            raise MissingDataError("no tile index in %s" % self._folder)
+        if self._mode == "w":
+            self._MovedWayTiles()
+            self._Tiles.Flush()
+        ids = set()
+        for (tile, lists) in self._Tiles.GetBBox(minlat, minlon, maxlat, maxlon):
+            ids.update(lists[kind])
+        return sorted(ids)
+
+    def NodesInBBox(self, minlat, minlon, maxlat, maxlon):
+        """
+        Get the sorted list of ids of nodes inside the bounding box.
+        """
+        ids = self._TilesGet(minlat, minlon, maxlat, maxlon, 0)
+        coords = self._NodeCoordMany(ids)
+        return [NodeId for NodeId in ids if NodeId in coords and
+                minlat <= coords[NodeId][0] <= maxlat and minlon <= coords[NodeId][1] <= maxlon]
+
+    def WaysInBBox(self, minlat, minlon, maxlat, maxlon):
+        """
+        Get the sorted list of ids of ways with at least one node inside the
+        bounding box. Ways follow their nodes moved by updates.
+        """
+        res = []
+        for way in self.WayGetMany(self._TilesGet(minlat, minlon, maxlat, maxlon, 1)):
+            if not way:
+                continue
+            coords = self._NodeCoordMany(way["nd"])
+            for c in coords.values():
+                if minlat <= c[0] <= maxlat and minlon <= c[1] <= maxlon:
+                    res.append(way["id"])
+                    break
+        return res
 
     #######################################################################
     ## user functions
@@ -382,18 +1795,22 @@ class OsmBin:
     #######################################################################
 
     def CopyWayTo(self, output):
+        import OsmSax
+        output = OsmSax.BatchOutput(output)
         self._fWay_idx.seek(0,2)
         way_idx_size = self._fWay_idx.tell()
         for i in xrange(way_idx_size / 5):
             way = self.WayGet(i)
             if way:
-                output.WayCreate(way)
+                output.Create("Way", way)
+        output.Flush()
     
     def CopyRelationTo(self, output):
-        for i in os.listdir(self._reldir):
-            for j in os.listdir(self._reldir+"/"+i):
-                for k in os.listdir(self._reldir+"/"+i+"/"+j):
-                    output.RelationCreate(eval(open(self._reldir+"/"+i+"/"+j+"/"+k).read()))
+        import OsmSax
+        output = OsmSax.BatchOutput(output)
+        for (RelationId, txt) in self._Relation.Scan():
+            output.Create("Relation", self._StrToRelation(txt))
+        output.Flush()
 
     def Import(self, f):
         if f == "-":
@@ -401,35 +1818,308 @@ class OsmBin:
             i = OsmSax.OsmSaxReader(sys.stdin)
         elif f.endswith(".pbf"):
             import OsmPbf
-            i = OsmPbf.OsmPbfReader(f)
+            i = OsmPbf.OsmPbfReader(f, metadata=False)
         else:
             import OsmSax
             i = OsmSax.OsmSaxReader(f)
         i.CopyTo(self)
+        if self._Tiles:
+            self._MovedWayTiles()
+            self._Tiles.Flush()
+
+    def ImportParallel(self, f, concurrency = None):
+        """
+        Import a .pbf file. Blocks are decoded by a pool of processes, and
+        written in sorted batches: node coordinates go to a memory map of
+        node.crd, way nodes lists are appended to way.data in one write.
+        """
+        import multiprocessing
+        from imposm.parser.simple import OSMParser
+        if not concurrency:
+            concurrency = multiprocessing.cpu_count()
+        self._progress = _Progress()
+        self._Node.BeginBatch()
+        try:
+            parser = OSMParser(concurrency=concurrency,
+                               coords_callback=self._ImportCoords,
+                               ways_callback=self._ImportWays,
+                               relations_callback=self._ImportRelations)
+            parser.parse(f)
+        finally:
+            self._Node.EndBatch()
+        if self._Tiles:
+            self._Tiles.Flush()
+        self._progress.report()
+        del self._progress
+
+    def _ImportCoords(self, coords):
+        coords.sort()
+        ids = [c[0] for c in coords]
+        for (start, end) in _Runs(ids):
+            txt = []
+            for (NodeId, lon, lat) in coords[start:end]:
+                txt.append(_StructCoord.pack(int(lat*10000000+1800000000), int(lon*10000000+1800000000)))
+            self._Node.PutRun(ids[start], "".join(txt))
+        if self._Tiles:
+            for (NodeId, lon, lat) in coords:
+                self._Tiles.Change(0, [self._Tiles.Tile(lat, lon)], NodeId, True)
+        self._progress.add("nodes", len(coords))
+
+    def _ImportWays(self, ways):
+        ways.sort()
+        if self._Tiles:
+            coords = self._NodeCoordMany([n for w in ways for n in w[2]])
+            for (WayId, tags, refs) in ways:
+                self._Tiles.Change(1, self._Tiles.Tiles([coords.get(n) for n in refs]), WayId, True)
+        self._WayAppend([(WayId, refs) for (WayId, tags, refs) in ways])
+        self._progress.add("ways", len(ways))
+
+    def _ImportRelations(self, relations):
+        for (RelationId, tags, members) in relations:
+            self.RelationCreate({"id": RelationId, "tag": tags,
+                                 "member": [{"ref": ref, "type": t, "role": role} for (ref, t, role) in members]})
+        self._progress.add("relations", len(relations))
 
     def Update(self, f):
+        """
+        Apply a change file. Writes are kept in memory until the whole file
+        is read, then journaled and applied sorted by offset.
+        """
         import OsmSax
         if f == "-":
             i = OsmSax.OscSaxReader(sys.stdin)
         else:
             i = OsmSax.OscSaxReader(f)
-        i.CopyTo(self)
+        self._BeginBuffered()
+        try:
+            i.CopyTo(self)
+            if self._Tiles:
+                self._MovedWayTiles()
+                self._Tiles.Flush()
+        except:
+            if self._Tiles:
+                self._Tiles._changes = {}
+                self._Tiles._nb = 0
+                self._moved = {}
+            self._EndBuffered(False)
+            raise
+        self._EndBuffered(True)
+
+    def _StoreFiles(self):
+        # (object, attribute, file name) of files written by updates
+        files = [(self._Node, attr, name) for (attr, name) in self._Node._files]
+        files.append((self, "_fWay_idx", "way.idx"))
+        files.append((self, "_fWay_data", "way.data"))
+        files.append((self._Relation, "_fIdx", "relation.idx"))
+        files.append((self._Relation, "_fData", "relation.data"))
+        if self._Tiles:
+            files.append((self._Tiles._store, "_fIdx", "tile.idx"))
+            files.append((self._Tiles._store, "_fData", "tile.data"))
+        return files
+
+    def _StoreAlloc(self):
+        # (object, attribute) of space allocation kept in memory
+        stores = [self, self._Node, self._Relation]
+        if self._Tiles:
+            stores.append(self._Tiles._store)
+        return [(o, attr) for o in stores for attr in o._alloc]
+
+    def _BeginBuffered(self):
+        for (o, attr, name) in self._StoreFiles():
+            setattr(o, attr, _BufferedFile(getattr(o, attr)))
+        self._alloc_saved = [(o, attr, copy.deepcopy(getattr(o, attr))) for (o, attr) in self._StoreAlloc()]
+
+    def _EndBuffered(self, commit):
+        # with commit False, pending writes are dropped and space allocated
+        # or freed since _BeginBuffered is restored
+        writes = []
+        for (o, attr, name) in self._StoreFiles():
+            b = getattr(o, attr)
+            setattr(o, attr, b._f)
+            for (offset, data) in b.Pending():
+                writes.append((name, offset, data))
+        saved = self._alloc_saved
+        del self._alloc_saved
+        if not commit:
+            for (o, attr, value) in saved:
+                setattr(o, attr, value)
+            return
+        writes.append(("way.free", None, self._FreeToStr()))
+        writes.append(("relation.free", None, self._Relation._FreeToStr()))
+        if self._Tiles:
+            writes.append(("tile.free", None, self._Tiles._store._FreeToStr()))
+        _WriteJournal(self._folder, writes)
+        for (o, attr, name) in self._StoreFiles():
+            getattr(o, attr).flush()
+        _ApplyJournal(self._folder, writes)
+
 
+###########################################################################
+## Local server
+
+_StructLength = struct.Struct(">I")
+
+def _SendMessage(sock, data):
+    txt = marshal.dumps(data)
+    sock.sendall(_StructLength.pack(len(txt)) + txt)
+
+def _RecvMessage(sock):
+    # return None when connection is closed
+    txt = _RecvAll(sock, _StructLength.size)
+    if not txt:
+        return None
+    txt = _RecvAll(sock, _StructLength.unpack(txt)[0])
+    return marshal.loads(txt)
+
+def _RecvAll(sock, size):
+    txt = []
+    while size:
+        buf = sock.recv(min(size, 2**20))
+        if not buf:
+            return None
+        txt.append(buf)
+        size -= len(buf)
+    return "".join(txt)
+
+class OsmBinServer(SocketServer.ForkingMixIn, SocketServer.UnixStreamServer):
+    """
+    Serve lookups on a store opened read only, through a unix socket. The
+    store is opened once, all connections share the same memory maps.
+    """
+
+    # methods that can be called by clients
+    methods = ("NodeGet", "WayGet", "RelationGet", "UserGet",
+               "NodeGetMany", "WayGetMany", "RelationGetMany",
+               "WayCoordinates", "RelationFullRecur",
+               "NodesInBBox", "WaysInBBox")
+
+    def __init__(self, folder, path):
+        self.bin = OsmBin(folder, "r")
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, _OsmBinHandler)
+
+class _OsmBinHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        # each message is a list of (method, args), answered by a list of
+        # results, or by an error
+        while True:
+            calls = _RecvMessage(self.request)
+            if calls is None:
+                return
+            try:
+                res = []
+                for (method, args) in calls:
+                    if method not in self.server.methods:
+                        raise ValueError("unknown method %s" % method)
+                    res.append(getattr(self.server.bin, method)(*args))
+                _SendMessage(self.request, (True, res))
+            except (MissingDataError, RelationLoopError) as e:
+                _SendMessage(self.request, (False, (e.__class__.__name__, e.value)))
+            except Exception as e:
+                _SendMessage(self.request, (False, ("Exception", repr(e))))
+
+class OsmBinClient:
+    """
+    Reader using an OsmBinServer, with the same lookup methods as OsmBin.
+    """
+
+    _errors = {"MissingDataError": MissingDataError, "RelationLoopError": RelationLoopError}
+
+    def __init__(self, path):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+
+    def __del__(self):
+        self.Close()
+
+    def Close(self):
+        try:
+            self._sock.close()
+        except AttributeError:
+            pass
+
+    def Batch(self, calls):
+        """
+        Call several methods in one round trip, calls is a list of
+        (method, args).
+        """
+        _SendMessage(self._sock, calls)
+        (ok, res) = _RecvMessage(self._sock)
+        if not ok:
+            raise self._errors.get(res[0], Exception)(res[1])
+        return res
+
+    def _Call(self, method, *args):
+        return self.Batch([(method, args)])[0]
+
+    def NodeGet(self, NodeId):
+        return self._Call("NodeGet", NodeId)
+
+    def WayGet(self, WayId):
+        return self._Call("WayGet", WayId)
+
+    def RelationGet(self, RelationId):
+        return self._Call("RelationGet", RelationId)
+
+    def UserGet(self, UserId):
+        return self._Call("UserGet", UserId)
+
+    def NodeGetMany(self, NodeIds):
+        return self._Call("NodeGetMany", list(NodeIds))
+
+    def WayGetMany(self, WayIds):
+        return self._Call("WayGetMany", list(WayIds))
+
+    def RelationGetMany(self, RelationIds):
+        return self._Call("RelationGetMany", list(RelationIds))
+
+    def WayCoordinates(self, WayId):
+        return self._Call("WayCoordinates", WayId)
+
+    def NodesInBBox(self, minlat, minlon, maxlat, maxlon):
+        return self._Call("NodesInBBox", minlat, minlon, maxlat, maxlon)
+
+    def WaysInBBox(self, minlat, minlon, maxlat, maxlon):
+        return self._Call("WaysInBBox", minlat, minlon, maxlat, maxlon)
+
+    def RelationFullRecur(self, RelationId, WayNodes = True, RaiseOnLoop = True, RemoveSubarea = False, RecurControl = []):
+        return self._Call("RelationFullRecur", RelationId, WayNodes, RaiseOnLoop, RemoveSubarea, list(RecurControl))
 
 ###########################################################################
 
 if __name__=="__main__":
     if sys.argv[1]=="--init":
-        InitFolder(sys.argv[2])
+        InitFolder(sys.argv[2], paged="--paged" in sys.argv[3:], tiles="--tiles" in sys.argv[3:])
+
+    if sys.argv[1]=="--convert-relations":
+        ConvertRelationFolder(sys.argv[2])
 
     if sys.argv[1]=="--import":
         o = OsmBin(sys.argv[2], "w")
         o.Import(sys.argv[3])
 
+    if sys.argv[1]=="--import-parallel":
+        o = OsmBin(sys.argv[2], "w")
+        o.ImportParallel(sys.argv[3], len(sys.argv) > 4 and int(sys.argv[4]) or None)
+
     if sys.argv[1]=="--update":
         o = OsmBin(sys.argv[2], "w")
         o.Update(sys.argv[3])
+
+    if sys.argv[1]=="--compact":
+        o = OsmBin(sys.argv[2], "w")
+        o.Compact()
         
+    if sys.argv[1]=="--bbox":
+        i = OsmBin(sys.argv[2])
+        bbox = map(float, sys.argv[4:8])
+        if sys.argv[3]=="node":
+            print(i.NodesInBBox(*bbox))
+        if sys.argv[3]=="way":
+            print(i.WaysInBBox(*bbox))
+
     if sys.argv[1]=="--read":
         i = OsmBin(sys.argv[2])
         if sys.argv[3]=="node":
@@ -442,18 +2132,8 @@ if __name__=="__main__":
             import pprint
             pprint.pprint(i.RelationFullRecur(int(sys.argv[4])))
             
-    if sys.argv[1]=="--pyro":
-        import Pyro.core
-        import Pyro.naming
-        class OsmBin2(Pyro.core.ObjBase, OsmBin):
-            def __init__(self, folder):
-                Pyro.core.ObjBase.__init__(self)
-                OsmBin.__init__(self, folder)
-        daemon=Pyro.core.Daemon()
-        #ns=Pyro.naming.NameServerLocator().getNS()
-        #daemon.useNameServer(ns)
-        uri=daemon.connect(OsmBin2("/data/work/osmbin/data/"), "OsmBin")
-        daemon.requestLoop()
+    if sys.argv[1]=="--serve":
+        OsmBinServer(sys.argv[2], sys.argv[3]).serve_forever()
 
 ###########################################################################
 import unittest
@@ -480,6 +2160,7 @@ class Test(unittest.TestCase):
         InitFolder("tmp-osmbin/")
         self.a = OsmBin("tmp-osmbin/", "w")
         self.a.Import("tests/saint_barthelemy.osm.bz2")
+        self.ways = []
 
     def tearDown(self):
         import shutil
@@ -545,6 +2226,30 @@ class Test(unittest.TestCase):
         self.check_node(self.a.NodeGet, 266053076, False)
         self.check_node(self.a.NodeGet, 2619283353, False)
 
+    def test_node_paged(self):
+        import shutil
+        shutil.rmtree("tmp-osmbin-paged/", True)
+        InitFolder("tmp-osmbin-paged/", paged=True, page_bits=4)
+        b = OsmBin("tmp-osmbin-paged/", "w")
+        b.Import("tests/saint_barthelemy.osm.bz2")
+        ids = [266053077, 2619283351, 2619283352, 266053077]
+        self.assertEquals(b.NodeGetMany(ids), self.a.NodeGetMany(ids))
+        self.assertEquals(b.NodeGetMany([1, 2**40]), [None, None])
+        del b
+        b = OsmBin("tmp-osmbin-paged/", "r")
+        self.check_node(b.NodeGet, 266053077)
+        self.check_node(b.NodeGet, 2619283351)
+        self.check_node(b.NodeGet, 1, False)
+        self.check_node(b.NodeGet, 2619283353, False)
+        self.assertEquals(b.NodeGet(1), None)
+        self.assertEquals(b.NodeGetMany(ids), self.a.NodeGetMany(ids))
+        self.assertEquals(b.NodeGetMany([1, 2**40]), [None, None])
+        self.assertEquals(b.WayCoordinates(24473155), self.a.WayCoordinates(24473155))
+        # only pages with nodes are allocated
+        self.assertTrue(os.path.getsize("tmp-osmbin-paged/node.pag") < os.path.getsize("tmp-osmbin/node.crd") / 100)
+        del b
+        shutil.rmtree("tmp-osmbin-paged/")
+
     def test_way(self):
         self.check_way(self.a.WayGet, 24473155)
         self.check_way(self.a.WayGet, 255316725)
@@ -552,6 +2257,333 @@ class Test(unittest.TestCase):
         self.check_way(self.a.WayGet, 24473154, False)
         self.check_way(self.a.WayGet, 255316726, False)
 
+    def test_node_many(self):
+        ids = [266053077, 1, 2619283351, 266053077, 2619283353]
+        res_w = self.a.NodeGetMany(ids)
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        res_r = self.a.NodeGetMany(ids)
+        self.assertEquals(res_w, res_r)
+        self.assertEquals(res_r, [self.a.NodeGet(i) for i in ids])
+        self.assertEquals(res_r[0]["id"], 266053077)
+        self.assertEquals(res_r[4], None)
+
+    def test_way_many(self):
+        ids = [24473155, 1, 255316725, 255316726]
+        res_w = self.a.WayGetMany(ids)
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        res_r = self.a.WayGetMany(ids)
+        self.assertEquals(res_w, res_r)
+        self.assertEquals(res_r, [self.a.WayGet(i) for i in ids])
+        self.assertEquals(res_r[1], None)
+        self.assertEquals(res_r[3], None)
+
+    def test_relation_many(self):
+        ids = [529891, 1, 47796, 529891]
+        res = self.a.RelationGetMany(ids)
+        self.assertEquals(res, [self.a.RelationGet(i) for i in ids])
+        self.assertEquals([r and r["id"] for r in res], [529891, None, 47796, 529891])
+
+    def test_way_coordinates(self):
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        way = self.a.WayGet(24473155)
+        coords = self.a.WayCoordinates(24473155)
+        self.assertEquals(len(coords), len(way["nd"]))
+        for (n, c) in zip(way["nd"], coords):
+            node = self.a.NodeGet(n)
+            self.assertEquals((node["lat"], node["lon"]), c)
+        self.assertEquals(self.a.WayCoordinates(1), None)
+
+    def test_buffered_file(self):
+        f = open("tmp-osmbin/buffered", "wb+")
+        f.write("0123456789" * 100)
+        b = _BufferedFile(f, 16)
+        b.seek(14)
+        b.write("abcd")
+        b.seek(40)
+        b.write("efgh")
+        b.seek(998)
+        b.write("ijkl")
+        b.seek(12)
+        self.assertEquals(b.read(10), "23abcd8901")
+        b.seek(0, 2)
+        self.assertEquals(b.tell(), 1002)
+        b.seek(996)
+        self.assertEquals(b.read(), "67ijkl")
+        # consecutive blocks are merged
+        self.assertEquals(b.Pending(), [(0, "01234567890123abcd8901234567890123456789efgh4567"), (992, "234567ijkl")])
+        f.seek(0)
+        self.assertEquals(f.read(20), "01234567890123456789")
+        f.close()
+
+    def test_mapped_file(self):
+        f = open("tmp-osmbin/mapped", "wb+")
+        m = _MappedFile(f)
+        self.assertEquals(m.unpack(_StructCoord, 0), None)
+        self.assertEquals(m.read(0, 4), "")
+        f.write(_StructCoord.pack(1, 2) + "abcd")
+        f.flush()
+        # file grown since mapping
+        self.assertEquals(m.unpack(_StructCoord, 0), (1, 2))
+        self.assertEquals(m.unpack(_StructCoord, 4), (2, 0x61626364))
+        self.assertEquals(m.unpack(_StructCoord, 8), None)
+        self.assertEquals(m.read(8, 10), "abcd")
+        self.assertEquals(m.read(12, 1), "")
+        m.close()
+        f.close()
+
+    def test_update_after_import(self):
+        # writes of the import not flushed yet are seen by the update
+        self.a._BeginBuffered()
+        self.assertEquals(self.a._fWay_data.tell(), 0)
+        self.a._fWay_data.seek(0, 2)
+        self.assertEquals(self.a._fWay_data.tell(), self.a._fWay_data_size)
+        self.a._EndBuffered(False)
+
+    def test_update_journal(self):
+        # interrupted after journal is written, before files are updated
+        self.a._BeginBuffered()
+        import OsmSax
+        OsmSax.OscSaxReader("tests/saint_barthelemy.osc.gz").CopyTo(self.a)
+        self.a._EndBuffered(False)
+        self.check_way(self.a.WayGet, 24552609)
+        _WriteJournal("tmp-osmbin/", [("way.idx", 5*24552609, _IntToStr5(0)), ("way.free", None, "")])
+        del self.a
+        self.assertTrue(os.path.exists("tmp-osmbin/" + _Journal))
+        self.a = OsmBin("tmp-osmbin/", "w")
+        self.assertFalse(os.path.exists("tmp-osmbin/" + _Journal))
+        self.check_way(self.a.WayGet, 24552609, False)
+        self.assertEquals(self.a._free, {})
+        # complete update
+        self.a.Update("tests/saint_barthelemy.osc.gz")
+        self.check_way(self.a.WayGet, 24552626, False)
+        self.check_way(self.a.WayGet, 780)
+        self.assertFalse(os.path.exists("tmp-osmbin/" + _Journal))
+
+    def test_update_failed(self):
+        # space freed by a failed update is not reused by the next one
+        way = self.a.WayGet(24473155)
+        rel = self.a.RelationGet(529891)
+        free = (dict(self.a._free), dict(self.a._Relation._free))
+        size = (self.a._fWay_data_size, self.a._Relation._data_size)
+        open("tmp-osmbin/failed.osc", "w").write("""<osmChange version="0.6">
+<delete>
+<way id="24473155" version="1"/>
+<relation id="529891" version="1"/>
+</delete>
+<modify>
+<way id="255316726" version="1"><nd ref="1"/><nd ref="2"/>""")
+        with self.assertRaises(Exception):
+            self.a.Update("tmp-osmbin/failed.osc")
+        self.assertEquals(self.a.WayGet(24473155), way)
+        self.assertEquals(self.a.WayGet(255316726), None)
+        self.assertEquals((self.a._free, self.a._Relation._free), free)
+        self.assertEquals((self.a._fWay_data_size, self.a._Relation._data_size), size)
+        # node list with the capacity of the slot of way 24473155
+        nds = [n + 1 for n in way["nd"]]
+        open("tmp-osmbin/good.osc", "w").write("""<osmChange version="0.6">
+<modify>
+<way id="255316725" version="2">%s</way>
+</modify>
+</osmChange>""" % "".join(['<nd ref="%d"/>' % n for n in nds]))
+        self.a.Update("tmp-osmbin/good.osc")
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        self.assertEquals(self.a.WayGet(24473155), way)
+        self.assertEquals(self.a.WayGet(255316725)["nd"], nds)
+        self.assertEquals(self.a.RelationGet(529891), rel)
+
+    def test_way_delta(self):
+        self.assertEquals(_DeltaToIntList(_IntListToDelta([])), [])
+        nds = [2619283351, 1, 2**39, 2**39 - 1, 266053077]
+        self.assertEquals(_DeltaToIntList(_IntListToDelta(nds)), nds)
+        nds = self.a.WayGet(24473155)["nd"]
+        size = self.a._fWay_data_size
+        # shorter and longer node lists
+        self.a.WayCreate({"id": 24473155, "nd": nds[:-1], "tag": {}})
+        self.assertEquals(self.a.WayGet(24473155)["nd"], nds[:-1])
+        self.assertEquals(self.a._fWay_data_size, size)
+        self.a.WayCreate({"id": 24473155, "nd": nds + nds, "tag": {}})
+        self.assertEquals(self.a.WayGet(24473155)["nd"], nds + nds)
+        self.assertTrue(self.a._fWay_data_size > size)
+        self.a.WayDelete({"id": 24473155})
+        self.check_way(self.a.WayGet, 24473155, False)
+
+    def test_way_compact(self):
+        import shutil
+        shutil.rmtree("tmp-osmbin-legacy/", True)
+        InitFolder("tmp-osmbin-legacy/", way_delta = False)
+        b = OsmBin("tmp-osmbin-legacy/", "w")
+        b.Import("tests/saint_barthelemy.osm.bz2")
+        self.assertFalse(b._way_delta)
+        import OsmSax
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(self)
+        ways, self.ways = self.ways, []
+        self.assertEquals(len(ways), 625)
+        for w in ways:
+            self.assertEquals(w, self.a.WayGet(w["id"]))
+        # leave free slots in way.data
+        b.WayDelete(ways[0])
+        b.WayCreate({"id": ways[1]["id"], "nd": ways[1]["nd"] + ways[2]["nd"], "tag": {}})
+        size = b._fWay_data_size
+        self.assertTrue(b.Compact() > size / 2)
+        del b
+        b = OsmBin("tmp-osmbin-legacy/", "r")
+        self.assertTrue(b._way_delta)
+        self.check_way(b.WayGet, ways[0]["id"], False)
+        self.assertEquals(b.WayGet(ways[1]["id"])["nd"], ways[1]["nd"] + ways[2]["nd"])
+        for w in ways[2:]:
+            self.assertEquals(w, b.WayGet(w["id"]))
+        del b
+        shutil.rmtree("tmp-osmbin-legacy/")
+
+    def test_way_compact_delta(self):
+        # deleted, rewritten and unreadable ways
+        import OsmSax
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(self)
+        ways = dict((w["id"], w) for w in self.ways)
+        nds = ways.pop(24473155)["nd"]
+        nds2 = ways.pop(255316725)["nd"]
+        self.a.WayDelete({"id": 24473155})
+        self.a.WayCreate({"id": 255316725, "nd": nds2 + nds, "tag": {}})
+        self.a.WayCreate({"id": 10, "nd": nds, "tag": {}})
+        # slot cut by the end of way.data
+        adr = self.a._fWay_data_size
+        self.a._fWay_data.seek(adr)
+        self.a._fWay_data.write(_IntToVarint(100) + "\1\2")
+        self.a._fWay_data_size += 3
+        self.a._fWay_idx.seek(5*11)
+        self.a._fWay_idx.write(_IntToStr5(adr))
+        self.assertEquals(self.a._WayNodes(11), None)
+        self.assertTrue(self.a.Compact() > 0)
+        self.assertFalse(os.path.exists("tmp-osmbin/way.idx.new"))
+        self.assertFalse(os.path.exists("tmp-osmbin/way.data.new"))
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        self.check_way(self.a.WayGet, 24473155, False)
+        self.check_way(self.a.WayGet, 11, False)
+        self.assertEquals(self.a.WayGet(255316725)["nd"], nds2 + nds)
+        self.assertEquals(self.a.WayGet(10)["nd"], nds)
+        for w in ways.values():
+            self.assertEquals(w, self.a.WayGet(w["id"]))
+
+    def test_way_compact_failed(self):
+        # new files are removed, the store is kept
+        nds = self.a.WayGet(24473155)["nd"]
+        def fail(WayId):
+            raise IOError()
+        self.a._WayNodes = fail
+        self.assertRaises(IOError, self.a.Compact)
+        self.assertFalse(os.path.exists("tmp-osmbin/way.idx.new"))
+        self.assertFalse(os.path.exists("tmp-osmbin/way.data.new"))
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        self.assertEquals(self.a.WayGet(24473155)["nd"], nds)
+
+    def NodeCreate(self, data):
+        pass
+
+    def WayCreate(self, data):
+        self.ways.append({"id": data["id"], "nd": data["nd"], "tag": {}})
+
+    def RelationCreate(self, data):
+        pass
+
+    def test_import_batches(self):
+        self.check_import_batches(False)
+
+    def test_import_batches_paged(self):
+        self.check_import_batches(True)
+
+    def check_import_batches(self, paged):
+        # feed batches as done by ImportParallel, without the pbf parser
+        import OsmSax, shutil
+        class Collect:
+            def __init__(self):
+                self.nodes = []
+                self.ways = []
+                self.rels = []
+            def NodeCreate(self, data):
+                self.nodes.append((data["id"], data["lon"], data["lat"]))
+            def WayCreate(self, data):
+                self.ways.append((data["id"], data["tag"], data["nd"]))
+            def RelationCreate(self, data):
+                self.rels.append((data["id"], data["tag"], [(m["ref"], m["type"], m["role"]) for m in data["member"]]))
+        o = Collect()
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(o)
+        shutil.rmtree("tmp-osmbin-batch/", True)
+        InitFolder("tmp-osmbin-batch/", paged=paged, page_bits=6)
+        b = OsmBin("tmp-osmbin-batch/", "w")
+        b._progress = _Progress()
+        b._Node.BeginBatch()
+        for i in range(0, len(o.nodes), 1000):
+            b._ImportCoords(o.nodes[i:i+1000][::-1])
+        b._Node.EndBatch()
+        for i in range(0, len(o.ways), 100):
+            b._ImportWays(o.ways[i:i+100])
+        b._ImportWays(o.ways[:10])
+        b._ImportRelations(o.rels)
+        del b
+        b = OsmBin("tmp-osmbin-batch/", "r")
+        for n in o.nodes:
+            self.assertEquals(b.NodeGet(n[0]), self.a.NodeGet(n[0]))
+        for w in o.ways:
+            self.assertEquals(b.WayGet(w[0]), self.a.WayGet(w[0]))
+        for r in o.rels:
+            self.assertEquals(b.RelationGet(r[0])["member"], self.a.RelationGet(r[0])["member"])
+        self.check_node(b.NodeGet, o.nodes[-1][0] + 1, False)
+        del b
+        shutil.rmtree("tmp-osmbin-batch/")
+
+    def test_create_many(self):
+        # same store with objects sent one by one, and updated by batches
+        import OsmSax, shutil
+        class Single:
+            def __init__(self, output):
+                self.NodeCreate = output.NodeCreate
+                self.WayCreate = output.WayCreate
+                self.RelationCreate = output.RelationCreate
+        shutil.rmtree("tmp-osmbin-single/", True)
+        InitFolder("tmp-osmbin-single/", paged=True, page_bits=6)
+        b = OsmBin("tmp-osmbin-single/", "w")
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(Single(b))
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(self)
+        self.a.WayCreateMany([{"id": w["id"], "nd": w["nd"][::-1], "tag": {}} for w in self.ways[:50]])
+        b.WayCreateMany([{"id": w["id"], "nd": w["nd"][::-1], "tag": {}} for w in self.ways[:50]])
+        del b
+        b = OsmBin("tmp-osmbin-single/", "r")
+        for w in self.ways:
+            self.assertEquals(b.WayGet(w["id"]), self.a.WayGet(w["id"]))
+        for w in self.ways[:50]:
+            self.assertEquals(b.WayGet(w["id"])["nd"], w["nd"][::-1])
+            for n in w["nd"]:
+                self.assertEquals(b.NodeGet(n), self.a.NodeGet(n))
+        del b
+        shutil.rmtree("tmp-osmbin-single/")
+
+    def test_create_many_free(self):
+        # free slots and slots of previous versions are used before
+        # appending to way.data
+        nds = self.a.WayGet(24473155)["nd"]
+        nds2 = self.a.WayGet(255316725)["nd"]
+        adr = self.a._WayAddress(255316725)
+        self.a.WayDelete({"id": 24473155})
+        size = self.a._fWay_data_size
+        self.a.WayCreateMany([{"id": 10, "nd": [n + 1 for n in nds]}, {"id": 255316725, "nd": nds2[:-1]}])
+        self.assertEquals(self.a._fWay_data_size, size)
+        self.assertEquals(self.a._WayAddress(255316725), adr)
+        self.assertEquals(self.a._free.get(self.a._WaySlot(self.a._WayAddress(10))[0]), [])
+        self.a.WayCreateMany([{"id": 255316725, "nd": nds2 * 2}])
+        self.assertTrue(self.a._fWay_data_size > size)
+        self.assertEquals(self.a._free.get(self.a._WaySlot(adr)[0]), [adr])
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        self.assertEquals(self.a.WayGet(10)["nd"], [n + 1 for n in nds])
+        self.assertEquals(self.a.WayGet(255316725)["nd"], nds2 * 2)
+        self.check_way(self.a.WayGet, 24473155, False)
+
     def test_relation(self):
         del self.a
         self.a = OsmBin("tmp-osmbin/", "r")
@@ -561,6 +2593,39 @@ class Test(unittest.TestCase):
         self.check_relation(self.a.RelationGet, 47795, False)
         self.check_relation(self.a.RelationGet, 2707694, False)
 
+    def test_relation_encoding(self):
+        import OsmSax
+        class Collect:
+            def __init__(self):
+                self.rels = []
+            def NodeCreate(self, data):
+                pass
+            def WayCreate(self, data):
+                pass
+            def RelationCreate(self, data):
+                self.rels.append(data)
+        o = Collect()
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(o)
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        for rel in o.rels:
+            self.assertEquals(self.a.RelationGet(rel["id"]), rel)
+
+    def test_relation_free(self):
+        rel = self.a.RelationGet(47796)
+        adr = self.a._Relation._Address(47796)
+        rel["member"] = rel["member"] * 10
+        self.a.RelationUpdate(rel)
+        self.assertEquals(self.a.RelationGet(47796), rel)
+        self.assertNotEquals(self.a._Relation._Address(47796), adr)
+        self.a.RelationCreate({"id": 1, "tag": {}, "member": [], "version": 1})
+        self.assertEquals(self.a.RelationGet(1), {"id": 1, "tag": {}, "member": [], "version": 1})
+        self.a.RelationDelete({"id": 1})
+        self.assertEquals(self.a.RelationGet(1), None)
+        o1 = TestCountObjects()
+        self.a.CopyRelationTo(o1)
+        self.assertEquals(o1.num_rels, 16)
+
     def test_relation_full(self):
         res = self.a.RelationFullRecur(529891)
         assert res
@@ -592,6 +2657,143 @@ class Test(unittest.TestCase):
             self.a.RelationFullRecur(47796)
         self.assertEquals(str(cm.exception), "MissingDataError(missing way 82217912)")
 
+    def test_relation_full_memo(self):
+        self.a.Update("tests/saint_barthelemy.osc.gz")
+        # shared sub-relation, expanded twice in the result
+        self.a.RelationCreate({"id": 7900, "tag": {"type": "route"}, "member": [{"type": "relation", "ref": 7800, "role": ""}, {"type": "node", "ref": 78, "role": ""}, {"type": "relation", "ref": 7800, "role": "subarea"}]})
+        res = self.a.RelationFullRecur(7900)
+        self.assertEquals([(x["type"], x["data"]["id"]) for x in res], [("relation", 7900)] + [("relation", 7800), ("node", 78), ("node", 79), ("way", 780), ("node", 78), ("node", 79)] + [("node", 78)] + [("relation", 7800), ("node", 78), ("node", 79), ("way", 780), ("node", 78), ("node", 79)])
+        res = self.a.RelationFullRecur(7900, WayNodes = False, RemoveSubarea = True)
+        self.assertEquals([(x["type"], x["data"]["id"]) for x in res], [("relation", 7900), ("relation", 7800), ("node", 78), ("node", 79), ("way", 780), ("node", 78)])
+        # loops are skipped
+        res = self.a.RelationFullRecur(7801, RaiseOnLoop = False)
+        self.assertEquals([x["data"]["id"] for x in res if x["type"] == "relation"], [7801, 7802])
+        # deep relations
+        for i in range(2000):
+            self.a.RelationCreate({"id": 8000 + i, "tag": {}, "member": [{"type": "relation", "ref": 8001 + i, "role": ""}]})
+        self.a.RelationCreate({"id": 10000, "tag": {}, "member": [{"type": "node", "ref": 78, "role": ""}]})
+        res = self.a.RelationFullRecur(8000)
+        self.assertEquals(len(res), 2002)
+        with self.assertRaises(MissingDataError) as cm:
+            self.a.RelationFullRecur(7)
+        self.assertEquals(str(cm.exception), "MissingDataError(missing relation 7)")
+
+    def test_server(self):
+        import multiprocessing
+        del self.a
+        self.a = OsmBin("tmp-osmbin/", "r")
+        # server in its own process, forked connection handlers must not
+        # inherit the client socket
+        server = OsmBinServer("tmp-osmbin/", "tmp-osmbin/sock")
+        p = multiprocessing.Process(target=server.serve_forever)
+        p.start()
+        server.server_close()
+        try:
+            c = OsmBinClient("tmp-osmbin/sock")
+            self.assertEquals(c.NodeGet(266053077), self.a.NodeGet(266053077))
+            self.assertEquals(c.WayGet(24473155), self.a.WayGet(24473155))
+            self.assertEquals(c.WayGet(1), None)
+            self.assertEquals(c.RelationGet(529891), self.a.RelationGet(529891))
+            self.assertEquals(c.UserGet(1), None)
+            self.assertEquals(c.NodeGetMany([266053077, 2619283351]), self.a.NodeGetMany([266053077, 2619283351]))
+            self.assertEquals(c.RelationFullRecur(529891), self.a.RelationFullRecur(529891))
+            self.assertEquals(c.Batch([("WayGetMany", [[24473155, 255316725]]), ("RelationGetMany", [[529891]])]),
+                              [self.a.WayGetMany([24473155, 255316725]), self.a.RelationGetMany([529891])])
+            with self.assertRaises(MissingDataError) as cm:
+                c.RelationFullRecur(47796)
+            self.assertEquals(str(cm.exception), "MissingDataError(missing way 82217912)")
+            with self.assertRaises(Exception):
+                c.Batch([("WayCreate", [{}])])
+            c.Close()
+        finally:
+            p.terminate()
+            p.join()
+
+    def test_tiles(self):
+        import OsmSax, shutil
+        class Collect:
+            def __init__(self):
+                self.nodes = {}
+                self.ways = {}
+            def NodeCreate(self, data):
+                self.nodes[data["id"]] = (data["lat"], data["lon"])
+            def WayCreate(self, data):
+                self.ways[data["id"]] = data["nd"]
+            def RelationCreate(self, data):
+                pass
+        o = Collect()
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(o)
+        shutil.rmtree("tmp-osmbin-tiles/", True)
+        InitFolder("tmp-osmbin-tiles/", tiles=True)
+        b = OsmBin("tmp-osmbin-tiles/", "w")
+        b.Import("tests/saint_barthelemy.osm.bz2")
+        del b
+        b = OsmBin("tmp-osmbin-tiles/", "r")
+        for bbox in [(17.89, -62.85, 17.91, -62.82), (17.0, -63.0, 18.0, -62.0), (0, 0, 1, 1)]:
+            inside = lambda c: bbox[0] <= c[0] <= bbox[2] and bbox[1] <= c[1] <= bbox[3]
+            nodes = sorted([n for (n, c) in o.nodes.items() if inside(c)])
+            ways = sorted([w for (w, nds) in o.ways.items() if [n for n in nds if n in o.nodes and inside(o.nodes[n])]])
+            self.assertEquals(b.NodesInBBox(*bbox), nodes)
+            self.assertEquals(b.WaysInBBox(*bbox), ways)
+        self.assertEquals(len(b.NodesInBBox(-90, -180, 90, 180)), len(o.nodes))
+        del b
+        # kept current by updates
+        b = OsmBin("tmp-osmbin-tiles/", "w")
+        self.assertTrue(24552609 in b.WaysInBBox(-90, -180, 90, 180))
+        b.Update("tests/saint_barthelemy.osc.gz")
+        nodes = b.NodesInBBox(-90, -180, 90, 180)
+        self.assertTrue(78 in nodes)
+        self.assertEquals(len(nodes), len(o.nodes) + 2)
+        ways = b.WaysInBBox(-90, -180, 90, 180)
+        self.assertFalse(24552609 in ways)
+        self.assertTrue(780 in ways)
+        b.NodeCreate({"id": 78, "lat": 0.5, "lon": 0.5})
+        self.assertEquals(b.NodesInBBox(0, 0, 1, 1), [78])
+        b.NodeDelete({"id": 78})
+        self.assertEquals(b.NodesInBBox(0, 0, 1, 1), [])
+        del b
+        shutil.rmtree("tmp-osmbin-tiles/")
+        with self.assertRaises(MissingDataError):
+            self.a.NodesInBBox(0, 0, 1, 1)
+
+    def test_tiles_moved_nodes(self):
+        # ways follow their nodes moved by updates
+        import OsmSax, shutil
+        class Collect:
+            def __init__(self):
+                self.nodes = {}
+                self.ways = {}
+            def NodeCreate(self, data):
+                self.nodes[data["id"]] = (data["lat"], data["lon"])
+            def WayCreate(self, data):
+                self.ways[data["id"]] = data["nd"]
+            def RelationCreate(self, data):
+                pass
+        o = Collect()
+        OsmSax.OsmSaxReader("tests/saint_barthelemy.osm.bz2").CopyTo(o)
+        shutil.rmtree("tmp-osmbin-tiles/", True)
+        InitFolder("tmp-osmbin-tiles/", tiles=True)
+        b = OsmBin("tmp-osmbin-tiles/", "w")
+        b.Import("tests/saint_barthelemy.osm.bz2")
+        # all nodes of a way, and one node of another one
+        moved = [n for n in o.ways[24473155] if n in o.nodes] + [o.ways[255316725][0]]
+        nodes = "".join(['<node id="%d" version="2" lat="0.5" lon="0.5"/>' % n for n in moved])
+        open("tmp-osmbin-tiles/moved.osc", "w").write('<osmChange version="0.6"><modify>%s</modify></osmChange>' % nodes)
+        old_tiles = b._Tiles.Tiles([o.nodes[n] for n in moved[:-1]])
+        b.Update("tmp-osmbin-tiles/moved.osc")
+        for n in moved:
+            o.nodes[n] = (0.5, 0.5)
+        for tile in old_tiles:
+            self.assertFalse(24473155 in b._Tiles.Get(tile)[1])
+        for bbox in [(0, 0, 1, 1), (17.0, -63.0, 18.0, -62.0), (17.89, -62.85, 17.91, -62.82)]:
+            inside = lambda c: bbox[0] <= c[0] <= bbox[2] and bbox[1] <= c[1] <= bbox[3]
+            ways = sorted([w for (w, nds) in o.ways.items() if [n for n in nds if n in o.nodes and inside(o.nodes[n])]])
+            self.assertEquals(b.WaysInBBox(*bbox), ways)
+        self.assertTrue(24473155 in b.WaysInBBox(0, 0, 1, 1))
+        self.assertTrue(255316725 in b.WaysInBBox(0, 0, 1, 1))
+        del b
+        shutil.rmtree("tmp-osmbin-tiles/")
+
     def test_relation_full_loop(self):
         self.a.Update("tests/saint_barthelemy.osc.gz")
         with self.assertRaises(RelationLoopError) as cm:
@@ -0,0 +1,148 @@
+#-*- coding: utf-8 -*-
+
+###########################################################################
+##                                                                       ##
+## This program is free software: you can redistribute it and/or modify  ##
+## it under the terms of the GNU General Public License as published by  ##
+## the Free Software Foundation, either version 3 of the License, or     ##
+## (at your option) any later version.                                   ##
+##                                                                       ##
+## This program is distributed in the hope that it will be useful,       ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of        ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         ##
+## GNU General Public License for more details.                          ##
+##                                                                       ##
+## You should have received a copy of the GNU General Public License     ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>. ##
+##                                                                       ##
+###########################################################################
+
+# Node coordinates and first node of ways, kept while reading a file, to
+# locate ways and relations without an external store.
+
+import array, bisect
+
+class _SortedIds:
+    """
+    Ids with integer values, in arrays of the given type codes. Ids are
+    expected in increasing order, as in sorted files: others are sorted on
+    first lookup, a later id replaces the values of the same one.
+    """
+
+    def __init__(self, typecodes):
+        # "l" is 8 bytes on 64 bits systems, "i" 4 bytes
+        self._ids = array.array("l")
+        self._values = [array.array(t) for t in typecodes]
+        self._sorted = True
+
+    def __len__(self):
+        return len(self._ids)
+
+    def Add(self, Id, *values):
+        ids = self._ids
+        if ids and Id <= ids[-1]:
+            if Id == ids[-1]:
+                for (a, v) in zip(self._values, values):
+                    a[-1] = v
+                return
+            self._sorted = False
+        ids.append(Id)
+        for (a, v) in zip(self._values, values):
+            a.append(v)
+
+    def _Sort(self):
+        # stable sort, keeping the last values of repeated ids
+        ids = self._ids
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        order = [i for (n, i) in enumerate(order) if n + 1 == len(order) or ids[order[n + 1]] != ids[i]]
+        self._ids = array.array("l", [ids[i] for i in order])
+        self._values = [array.array(a.typecode, [a[i] for i in order]) for a in self._values]
+        self._sorted = True
+
+    def Get(self, Id):
+        if not self._sorted:
+            self._Sort()
+        ids = self._ids
+        i = bisect.bisect_left(ids, Id)
+        if i < len(ids) and ids[i] == Id:
+            return [a[i] for a in self._values]
+
+
+class OsmCoordinates:
+    """
+    Coordinates of nodes as lat and lon in 1e-7 degrees, as stored by OSM,
+    and first node of ways: 16 bytes by node and by way.
+    """
+
+    def __init__(self):
+        self._nodes = _SortedIds("ii")
+        self._ways = _SortedIds("l")
+
+    def NodeAdd(self, NodeId, lat, lon):
+        self._nodes.Add(NodeId, int(round(lat * 10000000)), int(round(lon * 10000000)))
+
+    def WayAdd(self, WayId, nds):
+        if nds:
+            self._ways.Add(WayId, nds[0])
+
+    def NodeGet(self, NodeId):
+        """
+        (lat, lon) of a node, None if unknown.
+        """
+        c = self._nodes.Get(NodeId)
+        if c:
+            return (float(c[0]) / 10000000, float(c[1]) / 10000000)
+
+    def WayFirstNode(self, WayId):
+        """
+        Id of the first node of a way, None if unknown.
+        """
+        n = self._ways.Get(WayId)
+        if n:
+            return n[0]
+
+    def NodeCount(self):
+        return len(self._nodes)
+
+    def WayCount(self):
+        return len(self._ways)
+
+###########################################################################
+import unittest
+
+class Test(unittest.TestCase):
+    def test_nodes(self):
+        c = OsmCoordinates()
+        c.NodeAdd(1, 17.9031745, -62.8363074)
+        c.NodeAdd(3, -90, 180)
+        c.NodeAdd(5, 0.0000001, -0.0000001)
+        self.assertEquals(c.NodeGet(1), (17.9031745, -62.8363074))
+        self.assertEquals(c.NodeGet(3), (-90, 180))
+        self.assertEquals(c.NodeGet(5), (0.0000001, -0.0000001))
+        self.assertEquals(c.NodeGet(2), None)
+        self.assertEquals(c.NodeGet(6), None)
+        self.assertEquals(c.NodeCount(), 3)
+
+    def test_unsorted(self):
+        c = OsmCoordinates()
+        c.NodeAdd(5, 1, 1)
+        c.NodeAdd(2, 2, 2)
+        c.NodeAdd(5, 3, 3)
+        c.NodeAdd(2**40, 4, 4)
+        c.NodeAdd(2, 5, 5)
+        self.assertEquals(c.NodeGet(2), (5, 5))
+        self.assertEquals(c.NodeGet(5), (3, 3))
+        self.assertEquals(c.NodeGet(2**40), (4, 4))
+        self.assertEquals(c.NodeCount(), 3)
+        c.NodeAdd(1, 6, 6)
+        self.assertEquals(c.NodeGet(1), (6, 6))
+
+    def test_ways(self):
+        c = OsmCoordinates()
+        c.WayAdd(10, [3, 4])
+        c.WayAdd(11, [])
+        c.WayAdd(7, [2**40, 1])
+        self.assertEquals(c.WayFirstNode(10), 3)
+        self.assertEquals(c.WayFirstNode(7), 2**40)
+        self.assertEquals(c.WayFirstNode(11), None)
+        self.assertEquals(c.WayCount(), 2)
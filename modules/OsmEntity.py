@@ -0,0 +1,300 @@
+#-*- coding: utf-8 -*-
+
+###########################################################################
+##                                                                       ##
+## This program is free software: you can redistribute it and/or modify  ##
+## it under the terms of the GNU General Public License as published by  ##
+## the Free Software Foundation, either version 3 of the License, or     ##
+## (at your option) any later version.                                   ##
+##                                                                       ##
+## This program is distributed in the hope that it will be useful,       ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of        ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         ##
+## GNU General Public License for more details.                          ##
+##                                                                       ##
+## You should have received a copy of the GNU General Public License     ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>. ##
+##                                                                       ##
+###########################################################################
+
+# Compact objects given by readers built with compact=True, instead of a
+# dict for each object and each relation member. They can be used as the
+# dicts they replace: data["id"], "user" in data, data.get("version")...
+
+class _Entity(object):
+    """
+    Attributes stored in slots, with a dict interface. Attributes not set
+    are not in the dict. Keys without a slot go to an extra dict, created
+    on first use.
+    """
+
+    __slots__ = ("_extra", "_order")
+    _fields = ()
+    # keys set by readers after the attributes
+    _added = ()
+    __hash__ = None
+
+    def __init__(self, attrs = None):
+        if attrs:
+            fields = self._fields
+            for (k, v) in attrs.iteritems():
+                if k in fields:
+                    setattr(self, k, v)
+                else:
+                    self[k] = v
+            self._order = self._Order(attrs)
+
+    def _Order(self, attrs):
+        """
+        Order of the keys of attrs in a copy of the dict replaced, once
+        readers have set the added keys, as written by OsmSaxWriter. It
+        depends on the order keys were set in attrs: it is found on attrs
+        itself, and kept for dicts with keys in the same order.
+        """
+        key = (self._added, tuple(attrs))
+        try:
+            return _orders[key]
+        except KeyError:
+            pass
+        for k in self._added:
+            attrs[k] = None
+        copy = dict(attrs)
+        for k in self._added:
+            del attrs[k]
+            del copy[k]
+        order = _orders[key] = tuple(copy)
+        return order
+
+    def __getitem__(self, key):
+        if key in self._fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        try:
+            return self._extra[key]
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self._fields:
+            setattr(self, key, value)
+            return
+        try:
+            self._extra[key] = value
+        except AttributeError:
+            self._extra = {key: value}
+
+    def __delitem__(self, key):
+        if key in self._fields:
+            try:
+                delattr(self, key)
+                return
+            except AttributeError:
+                raise KeyError(key)
+        try:
+            del self._extra[key]
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self._fields:
+            return hasattr(self, key)
+        return key in getattr(self, "_extra", ())
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def keys(self):
+        keys = [k for k in self._fields if hasattr(self, k)]
+        keys.extend(getattr(self, "_extra", ()))
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if not hasattr(other, "items"):
+            return False
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.copy())
+
+_Attributes = ("id", "version", "timestamp", "uid", "user", "changeset", "visible", "tag")
+
+# orders of keys by added keys and order of attributes
+_orders = {}
+
+class Node(_Entity):
+    __slots__ = _Attributes + ("lat", "lon")
+    _fields = frozenset(__slots__)
+    _added = ("tag",)
+
+class Way(_Entity):
+    __slots__ = _Attributes + ("nd",)
+    _fields = frozenset(__slots__)
+    _added = ("tag", "nd")
+
+class Relation(_Entity):
+    __slots__ = _Attributes + ("member",)
+    _fields = frozenset(__slots__)
+    _added = ("tag", "member")
+
+
+class Member(tuple):
+    """
+    Relation member as a (type, ref, role) tuple, also readable as a dict
+    with keys "type", "ref" and "role".
+    """
+
+    __slots__ = ()
+    _index = {"type": 0, "ref": 1, "role": 2}
+    _keys = [u"type", u"ref", u"role"]
+
+    def __new__(cls, type, ref, role):
+        return tuple.__new__(cls, (type, ref, role))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self._index.get(key, key))
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default = None):
+        if key in self._index:
+            return tuple.__getitem__(self, self._index[key])
+        return default
+
+    def keys(self):
+        return list(self._keys)
+
+    def items(self):
+        return zip(self._keys, self)
+
+    def copy(self):
+        return dict(self.items())
+
+    type = property(lambda self: tuple.__getitem__(self, 0))
+    ref = property(lambda self: tuple.__getitem__(self, 1))
+    role = property(lambda self: tuple.__getitem__(self, 2))
+
+
+class StringTable:
+    """
+    One object for equal strings read by readers. Tag keys, member types
+    and roles are few and always kept. Values are kept up to max_values
+    different strings, then the table of values is cleared.
+    """
+
+    def __init__(self, max_values = 2**16):
+        self._keys = {}
+        self._values = {}
+        self._max_values = max_values
+
+    def Key(self, s):
+        return self._keys.setdefault(s, s)
+
+    def Value(self, s):
+        v = self._values.get(s)
+        if v is None:
+            if len(self._values) >= self._max_values:
+                self._values.clear()
+            v = self._values[s] = s
+        return v
+
+    def Tags(self, tags):
+        key = self.Key
+        value = self.Value
+        return dict([(key(k), value(v)) for (k, v) in tags.iteritems()])
+
+###########################################################################
+import unittest
+
+class Test(unittest.TestCase):
+    def test_entity(self):
+        n = Node({u"id": 1, u"lat": 2.0, u"lon": 3.0, u"tag": {}, u"action": u"modify"})
+        self.assertEquals(n["id"], 1)
+        self.assertEquals(n.lat, 2.0)
+        self.assertTrue("lon" in n)
+        self.assertFalse("user" in n)
+        self.assertEquals(n.get("user"), None)
+        self.assertRaises(KeyError, lambda: n["user"])
+        n["user"] = u"someone"
+        self.assertEquals(n.user, u"someone")
+        self.assertEquals(n["action"], u"modify")
+        self.assertEquals(n, {"id": 1, "lat": 2.0, "lon": 3.0, "tag": {}, "action": u"modify", "user": u"someone"})
+        self.assertEquals(dict(n), n.copy())
+        self.assertEquals(n.pop("action"), u"modify")
+        self.assertEquals(n.pop("action", None), None)
+        del n["user"]
+        self.assertEquals(sorted(n.keys()), ["id", "lat", "lon", "tag"])
+        self.assertFalse(hasattr(n, "__dict__"))
+
+    def test_member(self):
+        m = Member(u"way", 12, u"outer")
+        self.assertEquals(m, (u"way", 12, u"outer"))
+        self.assertEquals((m["type"], m["ref"], m["role"]), (u"way", 12, u"outer"))
+        self.assertEquals((m.type, m.ref, m.role), (u"way", 12, u"outer"))
+        self.assertEquals(m[1], 12)
+        self.assertTrue("role" in m)
+        self.assertEquals(m.copy(), {"type": u"way", "ref": 12, "role": u"outer"})
+        (t, ref, role) = m
+        self.assertEquals(ref, 12)
+
+    def test_pickle(self):
+        import pickle
+        n = Node({u"id": 1, u"lat": 2.0, u"lon": 3.0, u"tag": {u"name": u"a"}, u"action": u"modify"})
+        r = Relation({u"id": 1, u"tag": {}, u"member": [Member(u"way", 12, u"outer")]})
+        for o in (n, r):
+            o2 = pickle.loads(pickle.dumps(o, 2))
+            self.assertEquals(type(o2), type(o))
+            self.assertEquals(o2, o)
+        self.assertEquals(type(pickle.loads(pickle.dumps(r, 2))["member"][0]), Member)
+
+    def test_string_table(self):
+        t = StringTable(2)
+        k = u"".join([u"high", u"way"])
+        self.assertTrue(t.Key(k) is k)
+        self.assertTrue(t.Key(u"".join([u"high", u"way"])) is k)
+        tags = t.Tags({u"highway": u"".join([u"resi", u"dential"])})
+        self.assertTrue(tags.keys()[0] is k)
+        v = tags[u"highway"]
+        self.assertTrue(t.Value(u"".join([u"resi", u"dential"])) is v)
+        t.Value(u"a")
+        t.Value(u"b")
+        self.assertFalse(t.Value(u"".join([u"resi", u"dential"])) is v)
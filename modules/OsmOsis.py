@@ -112,6 +112,98 @@ class OsmOsis:
             
         return data
 
+    def _IdList(self, ids):
+        return ",".join(["%d" % i for i in set(ids)])
+
+    def _Tags(self, keys, values):
+        return dict(zip(keys or [], values or []))
+
+    def NodeGetMany(self, NodeIds):
+        """
+        Get a list of nodes in one query, in same order as NodeIds.
+        Missing nodes are returned as None.
+        """
+        if not NodeIds: return []
+        nodes = {}
+        self._PgCurs.execute("SELECT nodes.id, st_y(nodes.geom), st_x(nodes.geom), nodes.version, users.name, akeys(nodes.tags), avals(nodes.tags) FROM nodes LEFT JOIN users ON nodes.user_id = users.id WHERE nodes.id IN (%s);" % self._IdList(NodeIds))
+        for r1 in self._PgCurs.fetchall():
+            data = {}
+            data[u"id"]      = r1[0]
+            data[u"lat"]     = float(r1[1])
+            data[u"lon"]     = float(r1[2])
+            data[u"version"] = r1[3]
+            data[u"user"]    = r1[4] or ""
+            data[u"tag"]     = self._Tags(r1[5], r1[6])
+            nodes[r1[0]] = data
+        return [nodes.get(NodeId) for NodeId in NodeIds]
+
+    def WayGetMany(self, WayIds):
+        """
+        Get a list of ways in two queries, in same order as WayIds.
+        Missing ways are returned as None.
+        """
+        if not WayIds: return []
+        ways = {}
+        ids = self._IdList(WayIds)
+        self._PgCurs.execute("SELECT ways.id, ways.version, users.name, akeys(ways.tags), avals(ways.tags) FROM ways LEFT JOIN users ON ways.user_id = users.id WHERE ways.id IN (%s);" % ids)
+        for r1 in self._PgCurs.fetchall():
+            data = {}
+            data[u"id"]      = r1[0]
+            data[u"version"] = r1[1]
+            data[u"user"]    = r1[2] or ""
+            data[u"tag"]     = self._Tags(r1[3], r1[4])
+            data[u"nd"]      = []
+            ways[r1[0]] = data
+
+        if self.dump_sub_elements and ways:
+            self._PgCurs.execute("SELECT way_id, node_id FROM way_nodes WHERE way_id IN (%s) ORDER BY way_id, sequence_id;" % ids)
+            for r1 in self._PgCurs.fetchall():
+                ways[r1[0]][u"nd"].append(r1[1])
+
+        return [ways.get(WayId) for WayId in WayIds]
+
+    def RelationGetMany(self, RelationIds):
+        """
+        Get a list of relations in two queries, in same order as
+        RelationIds. Missing relations are returned as None.
+        """
+        if not RelationIds: return []
+        rels = {}
+        ids = self._IdList(RelationIds)
+        self._PgCurs.execute("SELECT relations.id, relations.version, users.name, akeys(relations.tags), avals(relations.tags) FROM relations LEFT JOIN users ON relations.user_id = users.id WHERE relations.id IN (%s);" % ids)
+        for r1 in self._PgCurs.fetchall():
+            data = {}
+            data[u"id"]      = r1[0]
+            data[u"version"] = r1[1]
+            data[u"user"]    = r1[2] or ""
+            data[u"tag"]     = self._Tags(r1[3], r1[4])
+            data[u"member"]  = []
+            rels[r1[0]] = data
+
+        if self.dump_sub_elements and rels:
+            self._PgCurs.execute("SELECT relation_id, member_id, member_type, member_role FROM relation_members WHERE relation_id IN (%s) ORDER BY relation_id, sequence_id;" % ids)
+            for r1 in self._PgCurs.fetchall():
+                rels[r1[0]][u"member"].append({u"ref":r1[1], u"type":{"N":"node","W":"way","R":"relation"}[r1[2]], u"role":r1[3]})
+
+        return [rels.get(RelationId) for RelationId in RelationIds]
+
+    def WaysOfNodes(self, NodeIds):
+        """
+        Ids of ways with any of the nodes.
+        """
+        if not NodeIds: return []
+        self._PgCurs.execute("SELECT DISTINCT way_id FROM way_nodes WHERE node_id IN (%s);" % self._IdList(NodeIds))
+        return [r1[0] for r1 in self._PgCurs.fetchall()]
+
+    def RelationsOfMembers(self, MemberType, MemberIds):
+        """
+        Ids of relations with any of the members of type "node", "way" or
+        "relation".
+        """
+        if not MemberIds: return []
+        self._PgCurs.execute("SELECT DISTINCT relation_id FROM relation_members WHERE member_type = '%s' AND member_id IN (%s);" % ({"node":"N","way":"W","relation":"R"}[MemberType], self._IdList(MemberIds)))
+        return [r1[0] for r1 in self._PgCurs.fetchall()]
+
     def UserGet(self, UserId):
 
         self._PgCurs.execute("SELECT name FROM users WHERE id = %d;" % UserId)
@@ -21,7 +21,9 @@
 
 import time
 import traceback
+import multiprocessing
 from imposm.parser.simple import OSMParser
+import OsmEntity
 
 ###########################################################################
 
@@ -36,110 +38,154 @@ class OsmPbfReader:
     def log(self, txt):
         self._logger.log(txt)
     
-    def __init__(self, pbf_file, logger = dummylog()):
+    def __init__(self, pbf_file, logger = dummylog(), concurrency = None, metadata = True, compact = False, coords = False):
+        """
+        Blocks are decoded by concurrency processes, all cores by default.
+        With metadata False, version, timestamp and uid are not returned.
+        With compact, objects are OsmEntity objects instead of dicts.
+        Only nodes with tags are given to NodeCreate: with coords, the
+        coordinates of all nodes are also given to NodeCoordinatesMany of
+        the output, as lists of (id, lon, lat).
+        """
         self._pbf_file = pbf_file
         self._logger   = logger
         self._got_error = False
+        self._concurrency = concurrency or multiprocessing.cpu_count()
+        self._metadata = metadata
+        if compact:
+            (self._Node, self._Way, self._Relation) = (OsmEntity.Node, OsmEntity.Way, OsmEntity.Relation)
+        else:
+            self._Node = self._Way = self._Relation = dict
+        self._compact = compact
+        self._coords = coords
+        self._strings = OsmEntity.StringTable()
 
-
-    def CopyTo(self, output):
+    def _Copy(self, output, nodes, ways, relations):
         self._output = output
-        self.parser = OSMParser(concurrency=2,
-                                nodes_callback=self.NodeParse,
-                                ways_callback=self.WayParse,
-                                relations_callback=self.RelationParse)
+        # outputs with *CreateMany methods get whole blocks at once
+        self._NodeCreate = getattr(output, "NodeCreateMany", None)
+        self._WayCreate = getattr(output, "WayCreateMany", None)
+        self._RelationCreate = getattr(output, "RelationCreateMany", None)
+        # objects with none of the tag keys from output.CreateKeys are
+        # dropped before building their dict
+        keys = getattr(output, "CreateKeys", None)
+        self._keys = {}
+        self._skipped = {}
+        for kind in ("Node", "Way", "Relation"):
+            self._keys[kind] = keys and keys(kind)
+            self._skipped[kind] = 0
+        self.parser = OSMParser(concurrency=self._concurrency,
+                                coords_callback=nodes and self._coords and self.CoordsParse,
+                                nodes_callback=nodes and self.NodeParse,
+                                ways_callback=ways and self.WayParse,
+                                relations_callback=relations and self.RelationParse)
         self.parser.parse(self._pbf_file)
         del self.parser
+        if sum(self._skipped.values()):
+            self.log("skipped %(Node)d nodes, %(Way)d ways, %(Relation)d relations without tag keys of interest" % self._skipped)
         if self._got_error:
             raise Exception()
 
+    def _Filter(self, kind, objs):
+        keys = self._keys[kind]
+        if keys is None:
+            return objs
+        res = [obj for obj in objs if not keys.isdisjoint(obj[1])]
+        self._skipped[kind] += len(objs) - len(res)
+        return res
+
+    def CopyTo(self, output):
+        self._Copy(output, True, True, True)
+
     def CopyWayTo(self, output):
-        self._output = output
-        self.parser = OSMParser(concurrency=2,
-                                nodes_callback=None,
-                                ways_callback=self.WayParse,
-                                relations_callback=None)
-        self.parser.parse(self._pbf_file)
-        del self.parser
-        if self._got_error:
-            raise Exception()
+        self._Copy(output, False, True, False)
 
     def CopyRelationTo(self, output):
-        self._output = output
-        self.parser = OSMParser(concurrency=2,
-                                nodes_callback=None,
-                                ways_callback=None,
-                                relations_callback=self.RelationParse)
-        self.parser.parse(self._pbf_file)
-        del self.parser
+        self._Copy(output, False, False, True)
+
+    def _Metadata(self, data, obj):
+        if self._metadata and len(obj) > 3:
+            data["version"] = obj[3]
+            data["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime(obj[4]))
+            data["uid"] = obj[5]
+
+    def _Send(self, create_many, create, objs, datas):
+        if not datas:
+            return
+        if create_many:
+            try:
+                create_many(datas)
+            except:
+                print(traceback.format_exc())
+                self._got_error = True
+            return
+        for (obj, data) in zip(objs, datas):
+            try:
+                create(data)
+            except:
+                print(obj, data)
+                print(traceback.format_exc())
+                self._got_error = True
+
+    def CoordsParse(self, coords):
         if self._got_error:
-            raise Exception()
+            return
+        self._Send(self._output.NodeCoordinatesMany, None, coords, coords)
 
     def NodeParse(self, nodes):
         if self._got_error:
             return
+        nodes = self._Filter("Node", nodes)
+        datas = []
         for node in nodes:
-            data = {}
+            data = self._Node()
             data["id"] = node[0]
-            data["tag"] = node[1]
+            data["tag"] = self._strings.Tags(node[1])
             data["lon"] = node[2][0]
             data["lat"] = node[2][1]
-            if len(node) > 3:
-                data["version"] = node[3]
-                data["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime(node[4]))
-                data["uid"] = node[5]
-            try:
-                self._output.NodeCreate(data)
-            except:
-                print(node, data)
-                print(traceback.format_exc())
-                self._got_error = True
+            self._Metadata(data, node)
+            datas.append(data)
+        self._Send(self._NodeCreate, self._output.NodeCreate, nodes, datas)
 
     def WayParse(self, ways):
         if self._got_error:
             return
+        ways = self._Filter("Way", ways)
+        datas = []
         for way in ways:
-            data = {}
+            data = self._Way()
             data["id"] = way[0]
-            data["tag"] = way[1]
+            data["tag"] = self._strings.Tags(way[1])
             data["nd"] = way[2]
-            if len(way) > 3:
-                data["version"] = way[3]
-                data["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime(way[4]))
-                data["uid"] = way[5]
-            try:
-                self._output.WayCreate(data)
-            except:
-                print(way, data)
-                print(traceback.format_exc())
-                self._got_error = True
+            self._Metadata(data, way)
+            datas.append(data)
+        self._Send(self._WayCreate, self._output.WayCreate, ways, datas)
 
     def RelationParse(self, relations):
         if self._got_error:
             return
+        relations = self._Filter("Relation", relations)
+        datas = []
         for relation in relations:
-            data = {}
+            data = self._Relation()
             data["id"] = relation[0]
-            data["tag"] = relation[1]
-            if len(relation) > 3:
-                data["version"] = relation[3]
-                data["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime(relation[4]))
-                data["uid"] = relation[5]
+            data["tag"] = self._strings.Tags(relation[1])
+            self._Metadata(data, relation)
             data["member"] = []
             for (ref, type, role) in relation[2]:
-                attrs = { "ref": int(ref),
-                          "role": role,
-                          "type": type,
-                        }
+                type = self._strings.Key(type)
+                role = self._strings.Key(role)
+                if self._compact:
+                    attrs = OsmEntity.Member(type, int(ref), role)
+                else:
+                    attrs = { "ref": int(ref),
+                              "role": role,
+                              "type": type,
+                            }
 
                 data["member"].append(attrs)
-
-            try:
-                self._output.RelationCreate(data)
-            except:
-                print(data)
-                print(traceback.format_exc())
-                self._got_error = True
+            datas.append(data)
+        self._Send(self._RelationCreate, self._output.RelationCreate, relations, datas)
 
 
 ###########################################################################
@@ -184,3 +230,36 @@ class Test(unittest.TestCase):
         self.assertEquals(o1.num_nodes, 0)
         self.assertEquals(o1.num_ways, 0)
         self.assertEquals(o1.num_rels, 16)
+
+    def test_coords(self):
+        class CountCoords(TestCountObjects):
+            def __init__(self):
+                TestCountObjects.__init__(self)
+                self.coords = {}
+            def NodeCoordinatesMany(self, coords):
+                for (id, lon, lat) in coords:
+                    self.coords[id] = (lon, lat)
+        i1 = OsmPbfReader("tests/saint_barthelemy.osm.pbf", coords=True)
+        o1 = CountCoords()
+        i1.CopyTo(o1)
+        self.assertEquals(o1.num_nodes, 83)
+        self.assertEquals(len(o1.coords), 8076)
+        self.assertEquals(o1.coords[266053077], (-62.8363074, 17.9031745))
+
+    def test_batch(self):
+        class CountBatches(TestCountObjects):
+            def __init__(self):
+                TestCountObjects.__init__(self)
+                self.batches = 0
+            def WayCreateMany(self, datas):
+                self.batches += 1
+                for data in datas:
+                    self.WayCreate(data)
+                    assert "version" not in data
+        i1 = OsmPbfReader("tests/saint_barthelemy.osm.pbf", concurrency=1, metadata=False)
+        o1 = CountBatches()
+        i1.CopyTo(o1)
+        self.assertEquals(o1.num_nodes, 83)
+        self.assertEquals(o1.num_ways, 625)
+        self.assertEquals(o1.num_rels, 16)
+        assert 0 < o1.batches < 625
@@ -19,9 +19,12 @@
 ##                                                                       ##
 ###########################################################################
 
-import bz2, gzip, cStringIO
+import bz2, gzip, cStringIO, subprocess, collections
+from distutils.spawn import find_executable
 from xml.sax import make_parser, handler
+from xml.parsers import expat
 from xml.sax.saxutils import XMLGenerator, quoteattr
+import OsmEntity
 
 ###########################################################################
 
@@ -48,17 +51,146 @@ class dummyout:
 
 ###########################################################################
 
+# external decompressors, the parallel ones first
+_Decompressors = {".bz2": ["lbzip2", "pbzip2", "bzip2"], ".gz": ["pigz", "gzip"]}
+
+class _PipeFile:
+    """
+    Output of a decompression process. Decompression runs on its own core
+    while the file is parsed.
+    """
+
+    def __init__(self, cmd, filename):
+        self._cmd = cmd
+        self._filename = filename
+        self._proc = subprocess.Popen([cmd, "-dc", filename], stdout=subprocess.PIPE, bufsize=2**20)
+        self._f = self._proc.stdout
+        self._eof = False
+
+    def read(self, size = -1):
+        txt = self._f.read(size)
+        if size < 0 or (not txt and size != 0):
+            self._eof = True
+        return txt
+
+    def readline(self, size = -1):
+        txt = self._f.readline(size)
+        if not txt and size != 0:
+            self._eof = True
+        return txt
+
+    def close(self):
+        # a truncated or corrupted file looks like a normal end of file,
+        # it is reported by the exit status of the decompression process
+        if self._proc:
+            self._f.close()
+            stopped = not self._eof and self._proc.poll() is None
+            if stopped:
+                # parsing was stopped before end of file
+                self._proc.terminate()
+            status = self._proc.wait()
+            self._proc = None
+            if status and not stopped:
+                raise IOError("%s exited with status %d on %s" % (self._cmd, status, self._filename))
+
+    def __del__(self):
+        self.close()
+
+def _OpenFile(filename, pipe = False):
+    # open compressed files according to extension, with pipe through an
+    # external decompression process if available
+    for (ext, opener) in ((".bz2", bz2.BZ2File), (".gz", gzip.open)):
+        if filename.endswith(ext):
+            if pipe:
+                for cmd in _Decompressors.get(ext, []):
+                    if find_executable(cmd):
+                        return _PipeFile(cmd, filename)
+            return opener(filename)
+    return open(filename)
+
+###########################################################################
+
 class OsmSaxNotXMLFile(Exception):
     pass
 
+def _Parse(reader, f):
+    # "sax" goes through xml.sax, "expat" calls reader handlers directly
+    # from the expat parser, without building sax attributes objects
+    if reader._engine == "expat":
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.buffer_size = 2**16
+        parser.StartElementHandler = reader._start
+        parser.EndElementHandler = reader.endElement
+        parser.ParseFile(f)
+    else:
+        parser = make_parser()
+        parser.setContentHandler(reader)
+        parser.parse(f)
+
+class BatchOutput:
+    """
+    Send created objects to output by lists of size objects, through
+    NodeCreateMany, WayCreateMany and RelationCreateMany when output has
+    them, one by one through NodeCreate, WayCreate and RelationCreate
+    otherwise. Objects are kept in order: pending objects are sent before
+    objects of another kind, and on Flush.
+    When output has CreateKeys, objects with none of the tag keys it
+    returns for their kind are skipped.
+    """
+
+    def __init__(self, output, size = 1000):
+        self._size = size
+        self._pending = []
+        self._kind = None
+        self._create = {}
+        self._keys = {}
+        self.skipped = {}
+        keys = getattr(output, "CreateKeys", None)
+        for kind in ("Node", "Way", "Relation"):
+            self._create[kind] = (getattr(output, kind + "CreateMany", None),
+                                  getattr(output, kind + "Create", None))
+            self._keys[kind] = keys and keys(kind)
+            self.skipped[kind] = 0
+
+    def Create(self, kind, data):
+        keys = self._keys[kind]
+        if keys is not None and keys.isdisjoint(data[u"tag"]):
+            self.skipped[kind] += 1
+            return
+        if kind != self._kind:
+            self.Flush()
+            self._kind = kind
+        (many, one) = self._create[kind]
+        if not many:
+            one(data)
+            return
+        self._pending.append(data)
+        if len(self._pending) >= self._size:
+            self.Flush()
+
+    def Flush(self):
+        if self._pending:
+            pending = self._pending
+            self._pending = []
+            self._create[self._kind][0](pending)
+
+    def LogSkipped(self, log):
+        if sum(self.skipped.values()):
+            log("skipped %(Node)d nodes, %(Way)d ways, %(Relation)d relations without tag keys of interest" % self.skipped)
+
 class OsmSaxReader(handler.ContentHandler):
 
     def log(self, txt):
         self._logger.log(txt)
     
-    def __init__(self, filename, logger = dummylog()):
+    def __init__(self, filename, logger = dummylog(), engine = "sax", compact = False):
         self._filename = filename
         self._logger   = logger
+        self._engine   = engine
+        # with compact, objects are OsmEntity objects instead of dicts
+        self._compact  = compact
+        self._strings  = OsmEntity.StringTable()
 
         # check if file begins with an xml tag
         f = self._GetFile()
@@ -66,14 +198,9 @@ class OsmSaxReader(handler.ContentHandler):
         if not line.startswith("<?xml"):
             raise OsmSaxNotXMLFile("File %s is not XML" % filename)
         
-    def _GetFile(self):
+    def _GetFile(self, pipe = False):
         if isinstance(self._filename, basestring):
-            if self._filename.endswith(".bz2"):
-                return bz2.BZ2File(self._filename)
-            elif self._filename.endswith(".gz"):
-                return gzip.open(self._filename)
-            else:
-                return open(self._filename)
+            return _OpenFile(self._filename, pipe)
         else:
             return self._filename
         
@@ -81,14 +208,26 @@ class OsmSaxReader(handler.ContentHandler):
         self._debug_in_way      = False
         self._debug_in_relation = False
         self.log("starting nodes")
-        self._output = output
-        parser = make_parser()
-        parser.setContentHandler(self)
-        parser.parse(self._GetFile())
+        self._output = BatchOutput(output)
+        f = self._GetFile(True)
+        try:
+            _Parse(self, f)
+            self._output.Flush()
+            self._output.LogSkipped(self.log)
+        finally:
+            if isinstance(f, _PipeFile):
+                f.close()
 
     def startElement(self, name, attrs):
-        attrs = attrs._attrs
-        if name == u"changeset":
+        self._start(name, attrs._attrs)
+
+    def _start(self, name, attrs):
+        # most frequent elements first
+        if name == u"nd":
+            self._nodes.append(int(attrs["ref"]))
+        elif name == u"tag":
+            self._tags[self._strings.Key(attrs["k"])] = self._strings.Value(attrs["v"])
+        elif name == u"changeset":
             self._tags = {}
         elif name == u"node":
             attrs[u"id"] = int(attrs[u"id"])
@@ -97,8 +236,8 @@ class OsmSaxReader(handler.ContentHandler):
             if u"version" in attrs:
                 attrs[u"version"] = int(attrs[u"version"])
             if u"user" in attrs:
-                attrs[u"user"] = unicode(attrs[u"user"])
-            self._data = attrs
+                attrs[u"user"] = self._strings.Value(unicode(attrs[u"user"]))
+            self._data = OsmEntity.Node(attrs) if self._compact else attrs
             self._tags = {}
         elif name == u"way":
             if not self._debug_in_way:
@@ -108,8 +247,8 @@ class OsmSaxReader(handler.ContentHandler):
             if u"version" in attrs:
                 attrs[u"version"] = int(attrs[u"version"])
             if u"user" in attrs:
-                attrs[u"user"] = unicode(attrs[u"user"])
-            self._data = attrs
+                attrs[u"user"] = self._strings.Value(unicode(attrs[u"user"]))
+            self._data = OsmEntity.Way(attrs) if self._compact else attrs
             self._tags = {}
             self._nodes = []
         elif name == u"relation":
@@ -120,25 +259,23 @@ class OsmSaxReader(handler.ContentHandler):
             if u"version" in attrs:
                 attrs[u"version"] = int(attrs[u"version"])
             if u"user" in attrs:
-                attrs[u"user"] = unicode(attrs[u"user"])
-            self._data = attrs
+                attrs[u"user"] = self._strings.Value(unicode(attrs[u"user"]))
+            self._data = OsmEntity.Relation(attrs) if self._compact else attrs
             self._members = []
             self._tags = {}
-        elif name == u"nd":
-            self._nodes.append(int(attrs["ref"]))
-        elif name == u"tag":
-            self._tags[attrs["k"]] = attrs["v"]
         elif name == u"member":
-            attrs["type"] = attrs["type"]
             attrs["ref"] = int(attrs["ref"])
-            attrs["role"] = attrs["role"]
+            attrs[u"type"] = self._strings.Key(attrs[u"type"])
+            attrs[u"role"] = self._strings.Key(attrs[u"role"])
+            if self._compact:
+                attrs = OsmEntity.Member(attrs[u"type"], attrs[u"ref"], attrs[u"role"])
             self._members.append(attrs)
 
     def endElement(self, name):
         if name == u"node":
             self._data[u"tag"] = self._tags
             try:
-                self._output.NodeCreate(self._data)
+                self._output.Create("Node", self._data)
             except:
                 print(self._data)
                 raise
@@ -146,7 +283,7 @@ class OsmSaxReader(handler.ContentHandler):
             self._data[u"tag"] = self._tags
             self._data[u"nd"]  = self._nodes
             try:
-                self._output.WayCreate(self._data)
+                self._output.Create("Way", self._data)
             except:
                 print(self._data)
                 raise
@@ -154,7 +291,7 @@ class OsmSaxReader(handler.ContentHandler):
             self._data[u"tag"]    = self._tags
             self._data[u"member"] = self._members
             try:
-                self._output.RelationCreate(self._data)
+                self._output.Create("Relation", self._data)
             except:
                 print(self._data)
                 raise
@@ -166,29 +303,43 @@ class OscSaxReader(handler.ContentHandler):
     def log(self, txt):
         self._logger.log(txt)
 
-    def __init__(self, filename, logger = dummylog()):
+    def __init__(self, filename, logger = dummylog(), engine = "sax", compact = False):
         self._filename = filename
         self._logger   = logger
+        self._engine   = engine
+        # with compact, objects are OsmEntity objects instead of dicts
+        self._compact  = compact
+        self._strings  = OsmEntity.StringTable()
  
-    def _GetFile(self):
+    def _GetFile(self, pipe = False):
         if type(self._filename) == file:
             return self._filename
-        elif self._filename.endswith(".bz2"):
-            return bz2.BZ2File(self._filename)
-        elif self._filename.endswith(".gz"):
-            return gzip.open(self._filename)
         else:
-            return open(self._filename)
+            return _OpenFile(self._filename, pipe)
         
     def CopyTo(self, output):
+        # only created objects are sent by batches, updates and deletes
+        # are sent one by one after pending objects
         self._output = output
-        parser = make_parser()
-        parser.setContentHandler(self)
-        parser.parse(self._GetFile())
+        self._batch = BatchOutput(output)
+        f = self._GetFile(True)
+        try:
+            _Parse(self, f)
+            self._batch.Flush()
+        finally:
+            if isinstance(f, _PipeFile):
+                f.close()
         
     def startElement(self, name, attrs):
-        attrs = attrs._attrs
-        if name == u"create":
+        self._start(name, attrs._attrs)
+
+    def _start(self, name, attrs):
+        # most frequent elements first
+        if name == u"nd":
+            self._nodes.append(int(attrs["ref"]))
+        elif name == u"tag":
+            self._tags[self._strings.Key(attrs["k"])] = self._strings.Value(attrs["v"])
+        elif name == u"create":
             self._action = name
         elif name == u"modify":
             self._action = name
@@ -199,34 +350,36 @@ class OscSaxReader(handler.ContentHandler):
             attrs[u"lat"] = float(attrs[u"lat"])
             attrs[u"lon"] = float(attrs[u"lon"])
             attrs[u"version"] = int(attrs[u"version"])
-            self._data = attrs
+            self._data = OsmEntity.Node(attrs) if self._compact else attrs
             self._tags = {}
         elif name == u"way":
             attrs["id"] = int(attrs["id"])
             attrs[u"version"] = int(attrs[u"version"])
-            self._data = attrs
+            self._data = OsmEntity.Way(attrs) if self._compact else attrs
             self._tags = {}
             self._nodes = []
         elif name == u"relation":
             attrs["id"] = int(attrs["id"])
             attrs[u"version"] = int(attrs[u"version"])
-            self._data = attrs
+            self._data = OsmEntity.Relation(attrs) if self._compact else attrs
             self._members = []
             self._tags = {}
-        elif name == u"nd":
-            self._nodes.append(int(attrs["ref"]))
-        elif name == u"tag":
-            self._tags[attrs["k"]] = attrs["v"]
         elif name == u"member":
             attrs["ref"] = int(attrs["ref"])
+            attrs[u"type"] = self._strings.Key(attrs[u"type"])
+            attrs[u"role"] = self._strings.Key(attrs[u"role"])
+            if self._compact:
+                attrs = OsmEntity.Member(attrs[u"type"], attrs[u"ref"], attrs[u"role"])
             self._members.append(attrs)
 
     def endElement(self, name):
         if name == u"node":
             self._data[u"tag"] = self._tags
             if self._action == u"create":
-                self._output.NodeCreate(self._data)
-            elif self._action == u"modify":
+                self._batch.Create("Node", self._data)
+                return
+            self._batch.Flush()
+            if self._action == u"modify":
                 self._output.NodeUpdate(self._data)
             elif self._action == u"delete":
                 self._output.NodeDelete(self._data)             
@@ -234,8 +387,10 @@ class OscSaxReader(handler.ContentHandler):
             self._data[u"tag"] = self._tags
             self._data[u"nd"]  = self._nodes
             if self._action == u"create":
-                self._output.WayCreate(self._data)
-            elif self._action == u"modify":
+                self._batch.Create("Way", self._data)
+                return
+            self._batch.Flush()
+            if self._action == u"modify":
                 self._output.WayUpdate(self._data)
             elif self._action == u"delete":
                 self._output.WayDelete(self._data)  
@@ -243,8 +398,10 @@ class OscSaxReader(handler.ContentHandler):
             self._data[u"tag"]    = self._tags
             self._data[u"member"] = self._members
             if self._action == u"create":
-                self._output.RelationCreate(self._data)
-            elif self._action == u"modify":
+                self._batch.Create("Relation", self._data)
+                return
+            self._batch.Flush()
+            if self._action == u"modify":
                 self._output.RelationUpdate(self._data)
             elif self._action == u"delete":
                 self._output.RelationDelete(self._data)  
@@ -253,7 +410,13 @@ class OscSaxReader(handler.ContentHandler):
 ###########################################################################
 
 def _formatData(data):
-    data = dict(data)
+    order = getattr(data, "_order", None)
+    if order is not None:
+        # compact entities keep the order of attributes of dicts
+        keys = [k for k in order if k in data] + [k for k in data if k not in order]
+        data = collections.OrderedDict([(k, data[k]) for k in keys])
+    else:
+        data = dict(data)
     if u"tag" in data:
         data.pop(u"tag")
     if u"nd" in data:
@@ -327,8 +490,7 @@ class OsmSaxWriter(XMLGenerator):
         for (k, v) in data[u"tag"].items():
             self.Element("tag", {"k":k, "v":v})
         for m in data[u"member"]:
-            m[u"ref"] = str(m[u"ref"])
-            self.Element("member", m)
+            self.Element("member", {"type": m[u"type"], "ref": str(m[u"ref"]), "role": m[u"role"]})
         self.endElement("relation")
       
 def NodeToXml(data, full = False):
@@ -369,7 +531,7 @@ def RelationToXml(data, full = False):
 
 
 ###########################################################################
-import unittest
+import os, unittest
 
 class TestCountObjects:
     def __init__(self):
@@ -434,3 +596,181 @@ class Test(unittest.TestCase):
         self.assertEquals(o1.num_ways, 625)
         self.assertEquals(o1.num_rels, 16)
         io.close()
+
+    def test_expat(self):
+        class Collect:
+            def __init__(self):
+                self.data = []
+            def NodeCreate(self, data):
+                self.data.append(("node", data))
+            def WayCreate(self, data):
+                self.data.append(("way", data))
+            def RelationCreate(self, data):
+                self.data.append(("relation", data))
+            def NodeUpdate(self, data):
+                self.data.append(("node update", data))
+            def WayUpdate(self, data):
+                self.data.append(("way update", data))
+            def RelationUpdate(self, data):
+                self.data.append(("relation update", data))
+            def NodeDelete(self, data):
+                self.data.append(("node delete", data))
+            def WayDelete(self, data):
+                self.data.append(("way delete", data))
+            def RelationDelete(self, data):
+                self.data.append(("relation delete", data))
+        for reader in (OsmSaxReader("tests/saint_barthelemy.osm.bz2"), OscSaxReader("tests/saint_barthelemy.osc.gz")):
+            o1 = Collect()
+            reader.CopyTo(o1)
+            reader._engine = "expat"
+            o2 = Collect()
+            reader.CopyTo(o2)
+            self.assertEquals(len(o1.data), len(o2.data))
+            self.assertEquals(o1.data, o2.data)
+            for (d1, d2) in zip(o1.data, o2.data):
+                self.assertEquals(map(type, d1[1].keys()), map(type, d2[1].keys()))
+                self.assertEquals(map(type, d1[1].values()), map(type, d2[1].values()))
+
+    def test_batch(self):
+        class Single:
+            def __init__(self):
+                self.data = []
+            def NodeCreate(self, data):
+                self.data.append(("node", data["id"]))
+            def WayCreate(self, data):
+                self.data.append(("way", data["id"]))
+            def RelationCreate(self, data):
+                self.data.append(("relation", data["id"]))
+            def NodeUpdate(self, data):
+                self.data.append(("node update", data["id"]))
+            def WayUpdate(self, data):
+                self.data.append(("way update", data["id"]))
+            def RelationUpdate(self, data):
+                self.data.append(("relation update", data["id"]))
+            def NodeDelete(self, data):
+                self.data.append(("node delete", data["id"]))
+            def WayDelete(self, data):
+                self.data.append(("way delete", data["id"]))
+            def RelationDelete(self, data):
+                self.data.append(("relation delete", data["id"]))
+        class Many(Single):
+            def __init__(self):
+                Single.__init__(self)
+                self.batches = []
+            def NodeCreateMany(self, datas):
+                self.batches.append(len(datas))
+                for data in datas:
+                    self.NodeCreate(data)
+            def WayCreateMany(self, datas):
+                self.batches.append(len(datas))
+                for data in datas:
+                    self.WayCreate(data)
+        for reader in (OsmSaxReader("tests/saint_barthelemy.osm.bz2"), OscSaxReader("tests/saint_barthelemy.osc.gz")):
+            o1 = Single()
+            reader.CopyTo(o1)
+            o2 = Many()
+            reader.CopyTo(o2)
+            self.assertEquals(o1.data, o2.data)
+            self.assertTrue(o2.batches)
+            self.assertTrue(max(o2.batches) <= 1000)
+            if isinstance(reader, OsmSaxReader):
+                self.assertEquals(o2.batches[:2], [1000, 1000])
+
+    def test_create_keys(self):
+        class Filtered(TestCountObjects):
+            def CreateKeys(self, kind):
+                return {"Node": set(["name"]), "Way": None, "Relation": set()}[kind]
+        i1 = OsmSaxReader("tests/saint_barthelemy.osm.bz2")
+        o1 = Filtered()
+        i1.CopyTo(o1)
+        self.assertEquals(o1.num_nodes, 68)
+        self.assertEquals(o1.num_ways, 625)
+        self.assertEquals(o1.num_rels, 0)
+        self.assertEquals(i1._output.skipped, {"Node": 8076 - 68, "Way": 0, "Relation": 16})
+
+    def test_compact(self):
+        class Collect:
+            def __init__(self):
+                self.data = []
+            def NodeCreate(self, data):
+                self.data.append(data)
+            WayCreate = RelationCreate = NodeUpdate = WayUpdate = RelationUpdate = NodeCreate
+            NodeDelete = WayDelete = RelationDelete = NodeCreate
+        def plain(data):
+            data = dict(data.items())
+            if "member" in data:
+                data["member"] = [dict(m.items()) for m in data["member"]]
+            return data
+        for (reader, engine) in ((OsmSaxReader, "sax"), (OsmSaxReader, "expat"), (OscSaxReader, "expat")):
+            src = {OsmSaxReader: "tests/saint_barthelemy.osm.bz2", OscSaxReader: "tests/saint_barthelemy.osc.gz"}[reader]
+            o1 = Collect()
+            reader(src, engine = engine).CopyTo(o1)
+            o2 = Collect()
+            reader(src, engine = engine, compact = True).CopyTo(o2)
+            self.assertEquals(len(o1.data), len(o2.data))
+            for (d1, d2) in zip(o1.data, o2.data):
+                assert isinstance(d2, OsmEntity._Entity)
+                self.assertEquals(d1, plain(d2))
+            rels = [d for d in o2.data if "member" in d and d["member"]]
+            assert isinstance(rels[0]["member"][0], OsmEntity.Member)
+            self.assertEquals(RelationToXml(rels[0]), RelationToXml(plain(rels[0])))
+
+    def test_compact_writer(self):
+        # same xml from dicts and from compact entities
+        def write(engine, compact):
+            o = cStringIO.StringIO()
+            w = OsmSaxWriter(o, "UTF-8")
+            w.startDocument()
+            w.startElement("osm", {})
+            OsmSaxReader("tests/saint_barthelemy.osm.gz", engine = engine, compact = compact).CopyTo(w)
+            w.endElement("osm")
+            return o.getvalue()
+        for engine in ("sax", "expat"):
+            self.assertEquals(write(engine, True), write(engine, False))
+
+    def test_strings(self):
+        class Collect:
+            def __init__(self):
+                self.keys = {}
+                self.values = {}
+            def NodeCreate(self, data):
+                for (k, v) in data["tag"].items():
+                    self.keys.setdefault(k, set()).add(id(k))
+                    self.values.setdefault(v, set()).add(id(v))
+            WayCreate = RelationCreate = NodeCreate
+        o = Collect()
+        OsmSaxReader("tests/saint_barthelemy.osm.bz2", engine = "expat").CopyTo(o)
+        self.assertEquals(len(o.keys["highway"]), 1)
+        self.assertEquals(len(o.values["residential"]), 1)
+
+    def test_pipe(self):
+        for src in ("tests/saint_barthelemy.osm.bz2", "tests/saint_barthelemy.osm.gz"):
+            f = _OpenFile(src, True)
+            self.assertTrue(isinstance(f, _PipeFile))
+            self.assertEquals(f.read(), _OpenFile(src).read())
+            f.close()
+            # stopped before end of file
+            f = _OpenFile(src, True)
+            f.readline()
+            f.close()
+        # truncated file
+        open("tmp-truncated.osm.gz", "wb").write(open("tests/saint_barthelemy.osm.gz", "rb").read(20000))
+        try:
+            f = _OpenFile("tmp-truncated.osm.gz", True)
+            f.read()
+            self.assertRaises(IOError, f.close)
+            for engine in ("sax", "expat"):
+                self.assertRaises(IOError, OsmSaxReader("tmp-truncated.osm.gz", engine = engine).CopyTo, TestCountObjects())
+        finally:
+            os.remove("tmp-truncated.osm.gz")
+        global _Decompressors
+        save = _Decompressors
+        try:
+            _Decompressors = {".bz2": ["no-such-bzip2"], ".gz": []}
+            self.assertTrue(isinstance(_OpenFile("tests/saint_barthelemy.osm.bz2", True), bz2.BZ2File))
+            i1 = OsmSaxReader("tests/saint_barthelemy.osm.bz2")
+            o1 = TestCountObjects()
+            i1.CopyTo(o1)
+            self.assertEquals(o1.num_nodes, 8076)
+        finally:
+            _Decompressors = save
@@ -20,7 +20,7 @@
 ###########################################################################
 
 import OsmSax
-import re, os
+import re, os, mmap, struct
 
 ###########################################################################
 ## find functions
@@ -243,14 +243,118 @@ def get_relation_id_start(fd, relationid):
 def get_file_last_line(fd):
     return max(0, os.fstat(fd.fileno()).st_size)
 
+###########################################################################
+## offset index
+
+class _OffsetIndex:
+    """
+    Offsets of nodes, ways and relations of an osm file, stored in
+    filename.idx: a header with mtime and size of the osm file and the
+    number of objects of each type, then sorted (id, offset) on 8+8 bytes,
+    nodes first. The index is built by scanning the file when it is missing
+    or when the osm file changed, and kept in memory if it can't be written.
+    """
+
+    _header = struct.Struct(">8sQQQQQ")
+    _entry = struct.Struct(">QQ")
+    _id = struct.Struct(">Q")
+    _magic = "osmidx1\n"
+    _types = ("node", "way", "relation")
+
+    def __init__(self, filename, open_file):
+        stat = os.stat(filename)
+        self._stamp = (int(stat.st_mtime), stat.st_size)
+        path = filename + ".idx"
+        self._buf = self._Load(path)
+        if self._buf is None:
+            f = open_file()
+            buf = self._Build(f)
+            f.close()
+            try:
+                f = open(path + ".tmp", "wb")
+                f.write(buf)
+                f.close()
+                os.rename(path + ".tmp", path)
+                self._buf = self._Load(path)
+            except (IOError, OSError):
+                self._buf = buf
+        nb = self._header.unpack_from(self._buf, 0)[3:]
+        self._sections = {}
+        base = self._header.size
+        for (t, n) in zip(self._types, nb):
+            self._sections[t] = (base, n)
+            base += n * self._entry.size
+
+    def _Load(self, path):
+        try:
+            f = open(path, "rb")
+        except IOError:
+            return None
+        header = f.read(self._header.size)
+        if len(header) != self._header.size or self._header.unpack(header)[:3] != (self._magic,) + self._stamp:
+            f.close()
+            return None
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        return m
+
+    def _Build(self, f):
+        ids = dict((t, []) for t in self._types)
+        pos = 0
+        while True:
+            line = f.readline()
+            if not line:
+                break
+            s = line.lstrip()
+            if s.startswith("<node ") or s.startswith("<way ") or s.startswith("<relation "):
+                t = s[1:s.index(" ")]
+                ids[t].append((int(ReGetId.findall(s)[0]), pos))
+            pos += len(line)
+        txt = [self._header.pack(self._magic, self._stamp[0], self._stamp[1], *[len(ids[k]) for k in self._types])]
+        for t in self._types:
+            ids[t].sort()
+            txt.extend(self._entry.pack(Id, offset) for (Id, offset) in ids[t])
+        return "".join(txt)
+
+    def Get(self, kind, Id):
+        # offset of object, None if not in file
+        (base, nb) = self._sections[kind]
+        lo = 0
+        hi = nb
+        while lo < hi:
+            mid = (lo + hi) / 2
+            if self._id.unpack_from(self._buf, base + self._entry.size * mid)[0] < Id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < nb:
+            (i, offset) = self._entry.unpack_from(self._buf, base + self._entry.size * lo)
+            if i == Id:
+                return offset
+        return None
+
 ###########################################################################
 
 class OsmSaxReader(OsmSax.OsmSaxReader):
 
+    _index = None
+
+    def _Start(self, kind, Id, get_id_start):
+        # lookup in offset index, by bisection on the file when the reader
+        # is built on a file object
+        if self._index is None:
+            if isinstance(self._filename, basestring):
+                self._index = _OffsetIndex(self._filename, self._GetFile)
+            else:
+                self._index = False
+        if self._index:
+            return self._index.Get(kind, Id)
+        return get_id_start(self._GetFile(), Id)
+
     def _Copy(self, output, get_start, get_end):
         self._debug_in_way      = True
         self._debug_in_relation = True
-        self._output = output
+        self._output = OsmSax.BatchOutput(output)
         parser = OsmSax.make_parser()
         parser.setContentHandler(self)
         f = self._GetFile()
@@ -265,6 +369,7 @@ class OsmSaxReader(OsmSax.OsmSaxReader):
             parser.feed(f.read(bs))
         parser.feed(f.read(count-bs*int(count/bs)))
         parser.feed("</osm>")
+        self._output.Flush()
                                         
     def CopyNodeTo(self, output):
         return self._Copy(output, get_node_start, get_way_start)
@@ -290,27 +395,28 @@ class OsmSaxReader(OsmSax.OsmSaxReader):
                 self.data = data
         self._debug_in_way      = True
         self._debug_in_relation = True
-        self._output = _output()
+        output = _output()
+        self._output = OsmSax.BatchOutput(output)
         parser = OsmSax.make_parser()
         parser.setContentHandler(self)
         parser.feed("<?xml version='1.0' encoding='UTF-8'?>")        
 
         f = self._GetFile()
         f.seek(start)
-        while not self._output.data:
+        while not output.data:
             parser.feed(f.readline())
-        return self._output.data
+        return output.data
         
     def NodeGet(self, NodeId):
-        start = get_node_id_start(self._GetFile(), NodeId)
+        start = self._Start("node", NodeId, get_node_id_start)
         return self._Get(start)
 
     def WayGet(self, WayId):
-        start = get_way_id_start(self._GetFile(), WayId)
+        start = self._Start("way", WayId, get_way_id_start)
         return self._Get(start)
 
     def RelationGet(self, RelationId):
-        start = get_relation_id_start(self._GetFile(), RelationId)
+        start = self._Start("relation", RelationId, get_relation_id_start)
         return self._Get(start)
 
     def UserGet(self, UserId):
@@ -320,6 +426,18 @@ class OsmSaxReader(OsmSax.OsmSaxReader):
 import unittest
 
 class Test(unittest.TestCase):
+    def setUp(self):
+        # the offset index is written next to the osm file
+        import shutil
+        shutil.rmtree("tmp-osmsaxalea/", True)
+        os.mkdir("tmp-osmsaxalea/")
+        self.src = "tmp-osmsaxalea/saint_barthelemy.osm.gz"
+        shutil.copy("tests/saint_barthelemy.osm.gz", self.src)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree("tmp-osmsaxalea/")
+
     def check(self, func, id, exists=True):
         res = func(id)
         if exists:
@@ -334,7 +452,7 @@ class Test(unittest.TestCase):
             assert not res
 
     def test_node(self):
-        i1 = OsmSaxReader("tests/saint_barthelemy.osm.gz")
+        i1 = OsmSaxReader(self.src)
         self.check(i1.NodeGet, 266053077)
         self.check(i1.NodeGet, 2619283351)
         self.check(i1.NodeGet, 2619283352)
@@ -343,7 +461,7 @@ class Test(unittest.TestCase):
         self.check(i1.NodeGet, 2619283353, False)
 
     def test_way(self):
-        i1 = OsmSaxReader("tests/saint_barthelemy.osm.gz")
+        i1 = OsmSaxReader(self.src)
         self.check(i1.WayGet, 24473155)
         self.check(i1.WayGet, 53599877, False)
         self.check(i1.WayGet, 255316725)
@@ -352,9 +470,36 @@ class Test(unittest.TestCase):
         self.check(i1.WayGet, 255316726, False)
 
     def test_relation(self):
-        i1 = OsmSaxReader("tests/saint_barthelemy.osm.gz")
+        i1 = OsmSaxReader(self.src)
         self.check(i1.RelationGet, 47796)
         self.check(i1.RelationGet, 2707693)
         self.check(i1.RelationGet, 1, False)
         self.check(i1.RelationGet, 47795, False)
         self.check(i1.RelationGet, 2707694, False)
+
+    def test_index(self):
+        import gzip
+        i1 = OsmSaxReader(self.src)
+        self.check(i1.WayGet, 24473155)
+        assert isinstance(i1._index._buf, mmap.mmap)
+        f = gzip.open(self.src)
+        for (kind, get_id_start, Id) in (("node", get_node_id_start, 266053077),
+                                         ("node", get_node_id_start, 2619283352),
+                                         ("way", get_way_id_start, 255316725),
+                                         ("relation", get_relation_id_start, 47796),
+                                         ("relation", get_relation_id_start, 47795)):
+            self.assertEquals(i1._index.Get(kind, Id), get_id_start(f, Id))
+        # reused, then rebuilt when the osm file changes
+        os.utime(self.src + ".idx", (0, 0))
+        OsmSaxReader(self.src).WayGet(24473155)
+        self.assertEquals(os.stat(self.src + ".idx").st_mtime, 0)
+        os.utime(self.src, (0, 0))
+        i2 = OsmSaxReader(self.src)
+        self.check(i2.NodeGet, 266053077)
+        self.assertNotEquals(os.stat(self.src + ".idx").st_mtime, 0)
+        # not written
+        os.remove(self.src + ".idx")
+        os.mkdir(self.src + ".idx.tmp")
+        i3 = OsmSaxReader(self.src)
+        self.check(i3.RelationGet, 2707693)
+        assert isinstance(i3._index._buf, str)
@@ -40,6 +40,13 @@ bin_osmosis = dir_osmose + "/osmosis/osmosis-0.44/bin/osmosis"
 # where osmconvert is located
 bin_osmconvert = "./osmconvert/osmconvert"
 
+# OsmBin store used by analysers to get objects not in analysed file
+osmbin_path = "/data/work/osmbin/data"
+
+# socket of "OsmBin.py --serve" sharing the OsmBin store between analysers,
+# None to open the store in each analyser
+osmbin_socket = None
+
 ### no need to modify following variables ###
 
 dir_tmp = os.path.join(dir_work, "tmp")
@@ -65,6 +65,17 @@ class template_config:
     dir_cache      = config.dir_cache
     dir_scripts    = config.dir_osmose
     bin_osmosis    = config.bin_osmosis
+    osmbin_path    = config.osmbin_path
+    osmbin_socket  = config.osmbin_socket
+    xml_engine     = "expat"      # or "sax", parser of .osm and .osc files
+    pbf_concurrency = None        # processes decoding .pbf blocks, None for all cores
+    compact_entities = False      # objects given to plugins as slotted objects instead of dicts
+    sax_processes  = 1            # processes running plugins of analyser_sax
+    profile_plugins = False       # time plugins of analyser_sax, report next to results
+    plugin_time_budget = None     # seconds by plugin call, slower calls are logged
+    plugin_slow_objects = 10      # slowest objects by plugin in the profile report
+    node_coordinates = False      # keep node coordinates while reading, for positions of errors
+    plugin_cache_size = 10000     # tag sets with results of tags_only plugins, 0 for no cache
     osmosis_pre_scripts = [
         dir_scripts + "/osmosis/osmosis-0.44/script/pgsnapshot_schema_0.6.sql",
 #       dir_scripts + "/osmosis/osmosis-0.44/script/pgsnapshot_schema_0.6_bbox.sql",
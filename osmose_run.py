@@ -601,6 +601,18 @@ def run(conf, logger, options):
 
             analyser_conf.polygon_id = conf.polygon_id
 
+            analyser_conf.osmbin_path = conf.osmbin_path
+            analyser_conf.osmbin_socket = conf.osmbin_socket
+            analyser_conf.xml_engine = conf.xml_engine
+            analyser_conf.pbf_concurrency = conf.pbf_concurrency
+            analyser_conf.compact_entities = conf.compact_entities
+            analyser_conf.sax_processes = conf.sax_processes
+            analyser_conf.profile_plugins = conf.profile_plugins or options.profile_plugins
+            analyser_conf.plugin_time_budget = conf.plugin_time_budget
+            analyser_conf.plugin_slow_objects = conf.plugin_slow_objects
+            analyser_conf.node_coordinates = conf.node_coordinates
+            analyser_conf.plugin_cache_size = conf.plugin_cache_size
+
             if options.change and xml_change:
                 analyser_conf.src = xml_change
             elif "dst" in conf.download:
@@ -740,6 +752,9 @@ if __name__ == "__main__":
     parser.add_option("--no-clean", dest="no_clean", action="store_true",
                       help="Don't remove extract and database after analyses")
 
+    parser.add_option("--profile-plugins", dest="profile_plugins", action="store_true",
+                      help="Time plugins of analyser_sax, with a report next to results")
+
     parser.add_option("--cron", dest="cron", action="store_true",
                       help="Record output in a specific log")
 
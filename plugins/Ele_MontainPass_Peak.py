@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class Ele_MontainPass_Peak(Plugin):
 
+    trigger_keys = ["mountain_pass", "natural"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[804] = { "item": 2020, "level": 3, "tag": ["tag", "fix:survey"], "desc": T_(u"Missing altitude") }
@@ -23,6 +23,8 @@ from plugins.Plugin import Plugin
 
 class Highway_Lanes(Plugin):
 
+    trigger_keys = ["highway"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[31601] = { "item": 3160, "level": 2, "tag": ["highway", "fix:chair"], "desc": T_(u"Bad lanes value") }
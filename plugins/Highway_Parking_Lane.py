@@ -23,6 +23,8 @@ from plugins.Plugin import Plugin
 
 class Highway_Parking_Lane(Plugin):
 
+    trigger_keys = ["highway"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.parking_lane = "parking:lane:"
@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class P_Name_Dictionary(Plugin):
 
+    trigger_keys = ["name"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[703] = { "item": 5010, "level": 2, "tag": ["name", "fix:chair"], "desc": T_(u"Word not found in dictionary") }
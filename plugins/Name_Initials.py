@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class Name_Initials(Plugin):
 
+    trigger_keys = ["name"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[902] = { "item": 5010, "level": 3, "tag": ["name", "fix:chair"], "desc": T_(u"Initial stuck to the name") }
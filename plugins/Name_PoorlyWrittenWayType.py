@@ -26,6 +26,8 @@ import re
 
 class P_Name_PoorlyWrittenWayType(Plugin):
 
+    trigger_keys = ["name"]
+
     def generator(self, p):
         (p1, p2) = p.split("|")
         r = u"^(("
@@ -25,6 +25,7 @@ from plugins.Plugin import Plugin
 class Name_Saint_FR(Plugin):
 
     only_for = ["FR", "NC"]
+    trigger_keys = ["name"]
 
     def init(self, logger):
         Plugin.init(self, logger)
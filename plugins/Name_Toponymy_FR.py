@@ -26,6 +26,8 @@ class Name_Toponymy_FR(Plugin):
 
     only_for = ["FR", "NC"]
 
+    trigger_keys = ["name"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[906] = { "item": 5040, "level": 2, "tag": ["name", "fix:chair"], "desc": T_(u"Toponymy") }
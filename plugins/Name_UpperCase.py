@@ -26,6 +26,7 @@ import regex as re
 class Name_UpperCase(Plugin):
 
     not_for = ["CU"]
+    trigger_keys = ["name"]
 
     def init(self, logger):
         Plugin.init(self, logger)
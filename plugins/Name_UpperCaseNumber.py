@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class Name_UpperCaseNumber(Plugin):
 
+    trigger_keys = ["name"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[905] = { "item": 5010, "level": 1, "tag": ["name", "fix:chair"], "desc": T_(u"Uppercase number") }
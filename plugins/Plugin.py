@@ -23,6 +23,21 @@ import hashlib
 
 class Plugin(object):
 
+    # Tag keys the plugin reacts to: objects without any of them may not be
+    # sent to the plugin. None to always get all objects.
+    trigger_keys = None
+
+    # Whether results of node, way and relation depend only on tags, not on
+    # the object, its nodes or its members. Analyser_Sax can then reuse the
+    # results of objects with the same tags.
+    tags_only = False
+
+    # Whether Analyser_Sax can run copies of the plugin in worker processes,
+    # each one getting part of the objects. None to decide from end():
+    # plugins overriding it may gather data across objects, they stay in
+    # the main process and get all objects.
+    parallel = None
+
     def __init__(self, father):
         self.father = father
 
@@ -46,6 +61,14 @@ class Plugin(object):
         if currentClass.relation!=Plugin.relation: capabilities.append("relation")
         return capabilities
 
+    def parallelSafe(self):
+        """
+        Whether the plugin can run in worker processes.
+        """
+        if self.parallel is not None:
+            return self.parallel
+        return self.__class__.end == Plugin.end
+
     def node(self, node, tags):
         """
         Called each time a node is found on data source.
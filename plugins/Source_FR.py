@@ -28,6 +28,8 @@ class Source_FR(Plugin):
 
     only_for = ["FR"]
 
+    trigger_keys = ["source", "boundary"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.IGN = re.compile(".*(\wign)|(ign\w).*")
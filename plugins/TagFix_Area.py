@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class TagFix_Area(Plugin):
 
+    tags_only = True
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[32001] = { "item": 3200, "level": 3, "tag": ["tag", "fix:chair"], "desc": T_(u"Bad usage of area=yes. Object is already an area by nature") }
@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class TagFix_BadKey(Plugin):
 
+    tags_only = True
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[3050] = { "item": 3050, "level": 1, "tag": ["tag", "fix:chair"], "desc": T_(u"Bad tag") }
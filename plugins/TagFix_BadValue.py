@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class TagFix_BadValue(Plugin):
 
+    tags_only = True
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[3040] = { "item": 3040, "level": 1, "tag": ["value", "fix:chair"], "desc": T_(u"Bad value in a tag") }
@@ -25,6 +25,8 @@ from plugins.Plugin import Plugin
 
 class TagFix_DuplicateValue(Plugin):
 
+    tags_only = True
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[3060] = { "item": 3060, "level": 3, "tag": ["value", "fix:chair"], "desc": T_(u"Duplicated similar values") }
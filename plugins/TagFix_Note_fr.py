@@ -27,6 +27,8 @@ class TagFix_Note_fr(Plugin):
 
     only_for = ["fr"]
 
+    trigger_keys = ["note", "comment"]
+
     def normalize(self, s):
         return ''.join((c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')).lower()
 
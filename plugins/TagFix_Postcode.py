@@ -26,6 +26,8 @@ import re
 
 class TagFix_Postcode(Plugin):
 
+    trigger_keys = ["postal_code", "addr:postcode"]
+
     def parse_format(self, reline, format):
         format = format.replace('optionally ', '')
         if format[-1] == ')':
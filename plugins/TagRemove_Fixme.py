@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class TagRemove_Fixme(Plugin):
 
+    trigger_keys = ["fixme", "highway"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[40610] = { "item": 4061, "level": 3, "tag": ["fixme", "fix:chair"], "desc": T_(u"Need fix") }
@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class TagRemove_Layer(Plugin):
 
+    trigger_keys = ["layer"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[41101] = {"item": 4110, "level": 3, "tag": ["landuse", "fix:chair"], "desc": T_(u"Landuse feature not on ground") }
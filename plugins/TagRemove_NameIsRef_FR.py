@@ -27,6 +27,8 @@ class TagRemove_NameIsRef_FR(Plugin):
 
     only_for = ["FR"]
 
+    trigger_keys = ["name"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         self.errors[904] = { "item": 4040, "level": 1, "tag": ["name", "highway", "ref", "fix:chair"], "desc": T_(u"Highway reference in name tag") }
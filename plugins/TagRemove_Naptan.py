@@ -25,6 +25,7 @@ from plugins.Plugin import Plugin
 class TagRemove_Naptan(Plugin):
 
     only_for = ["GB"]
+    trigger_keys = ["naptan:verified"]
 
     def init(self, logger):
         Plugin.init(self, logger)
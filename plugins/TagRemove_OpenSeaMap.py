@@ -24,6 +24,8 @@ from plugins.Plugin import Plugin
 
 class TagRemove_OpenSeaMap(Plugin):
 
+    trigger_keys = ["seamark:fixme"]
+
     def init(self, logger):
         Plugin.init(self, logger)
         if self.father.config.options.get("project") != 'openstreetmap':
@@ -27,6 +27,8 @@ from collections import defaultdict
 
 class TagWatchFrViPofm(Plugin):
 
+    tags_only = True
+
     def quoted(self, string):
         return len(string)>=2 and string[0]==u"`" and string[-1]==u"`"
 
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+###########################################################################
+##                                                                       ##
+## This program is free software: you can redistribute it and/or modify  ##
+## it under the terms of the GNU General Public License as published by  ##
+## the Free Software Foundation, either version 3 of the License, or     ##
+## (at your option) any later version.                                   ##
+##                                                                       ##
+## This program is distributed in the hope that it will be useful,       ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of        ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         ##
+## GNU General Public License for more details.                          ##
+##                                                                       ##
+## You should have received a copy of the GNU General Public License     ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>. ##
+##                                                                       ##
+###########################################################################
+
+# Benchmark OsmBin lookups on the saint_barthelemy fixture, scaled up by
+# importing it several times with shifted ids.
+#
+# Usage: ./benchmark-osmbin.py [scale] [folder]
+#        ./benchmark-osmbin.py import <file.osm.pbf> [folder]
+
+from __future__ import print_function
+
+import sys, time, shutil
+
+sys.path.append("..")
+
+from modules import OsmBin
+from modules import OsmSax
+
+SRC = "../tests/saint_barthelemy.osm.bz2"
+SHIFT = 3000000000
+
+
+class ShiftIds:
+    """
+    Forward objects to output, with all ids shifted by a constant.
+    """
+
+    def __init__(self, output, shift):
+        self.output = output
+        self.shift = shift
+
+    def NodeCreate(self, data):
+        data["id"] += self.shift
+        self.output.NodeCreate(data)
+
+    def WayCreate(self, data):
+        data["id"] += self.shift
+        data["nd"] = [n + self.shift for n in data["nd"]]
+        self.output.WayCreate(data)
+
+    def RelationCreate(self, data):
+        data["id"] += self.shift
+        for m in data["member"]:
+            m["ref"] += self.shift
+        self.output.RelationCreate(data)
+
+
+class CollectIds:
+    def __init__(self):
+        self.nodes = []
+        self.ways = []
+        self.relations = []
+
+    def NodeCreate(self, data):
+        self.nodes.append(data["id"])
+
+    def WayCreate(self, data):
+        self.ways.append(data["id"])
+
+    def RelationCreate(self, data):
+        self.relations.append(data["id"])
+
+
+def bench(name, func, nb):
+    t0 = time.time()
+    func()
+    t = time.time() - t0
+    print("%-40s %8.3fs %10.0f obj/s" % (name, t, nb / t if t else 0))
+
+
+class CountObjects:
+    def __init__(self):
+        self.num = 0
+
+    def RelationCreate(self, data):
+        self.num += 1
+
+
+def bench_seek(o, nodes, ways):
+    bench("NodeGet (seek/read)", lambda: [o.NodeGet(n) for n in nodes], len(nodes))
+    bench("WayGet (seek/read)", lambda: [o.WayGet(w) for w in ways], len(ways))
+    bench("way nodes NodeGet (seek/read)", lambda: [[o.NodeGet(n) for n in o.WayGet(w)["nd"]] for w in ways], len(ways))
+
+
+def bench_relations(o, relations):
+    bench("RelationGet", lambda: [o.RelationGet(r) for r in relations], len(relations))
+    bench("CopyRelationTo", lambda: o.CopyRelationTo(CountObjects()), len(relations))
+
+
+def bench_mmap(o, nodes, ways):
+    bench("NodeGet (mmap)", lambda: [o.NodeGet(n) for n in nodes], len(nodes))
+    bench("NodeGetMany (mmap)", lambda: o.NodeGetMany(nodes), len(nodes))
+    bench("WayGet (mmap)", lambda: [o.WayGet(w) for w in ways], len(ways))
+    bench("WayGetMany (mmap)", lambda: o.WayGetMany(ways), len(ways))
+    bench("way nodes WayCoordinates (mmap)", lambda: [o.WayCoordinates(w) for w in ways], len(ways))
+
+
+def main(scale, folder):
+    shutil.rmtree(folder, True)
+    OsmBin.InitFolder(folder)
+
+    ids = CollectIds()
+    OsmSax.OsmSaxReader(SRC).CopyTo(ids)
+
+    t0 = time.time()
+    o = OsmBin.OsmBin(folder, "w")
+    for i in range(scale):
+        OsmSax.OsmSaxReader(SRC).CopyTo(ShiftIds(o, i * SHIFT / scale))
+    del o
+    print("import x%d: %.3fs" % (scale, time.time() - t0))
+
+    nodes = [n + i * SHIFT / scale for i in range(scale) for n in ids.nodes]
+    ways = [w + i * SHIFT / scale for i in range(scale) for w in ids.ways]
+    relations = [r + i * SHIFT / scale for i in range(scale) for r in ids.relations]
+
+    bench_seek(OsmBin.OsmBin(folder, "w"), nodes, ways)
+    bench_mmap(OsmBin.OsmBin(folder, "r"), nodes, ways)
+    bench_relations(OsmBin.OsmBin(folder, "r"), relations)
+
+    shutil.rmtree(folder, True)
+
+
+def main_import(pbf, folder):
+    # compare --import and --import-parallel
+    for (name, func) in (("Import", lambda o: o.Import(pbf)),
+                         ("ImportParallel", lambda o: o.ImportParallel(pbf))):
+        shutil.rmtree(folder, True)
+        OsmBin.InitFolder(folder)
+        o = OsmBin.OsmBin(folder, "w")
+        t0 = time.time()
+        func(o)
+        del o
+        print("%-40s %8.3fs" % (name, time.time() - t0))
+    shutil.rmtree(folder, True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "import":
+        main_import(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "/tmp/osmbin-benchmark/")
+        sys.exit(0)
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    folder = sys.argv[2] if len(sys.argv) > 2 else "/tmp/osmbin-benchmark/"
+    main(scale, folder)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+
+###########################################################################
+##                                                                       ##
+## This program is free software: you can redistribute it and/or modify  ##
+## it under the terms of the GNU General Public License as published by  ##
+## the Free Software Foundation, either version 3 of the License, or     ##
+## (at your option) any later version.                                   ##
+##                                                                       ##
+## This program is distributed in the hope that it will be useful,       ##
+## but WITHOUT ANY WARRANTY; without even the implied warranty of        ##
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         ##
+## GNU General Public License for more details.                          ##
+##                                                                       ##
+## You should have received a copy of the GNU General Public License     ##
+## along with this program.  If not, see <http://www.gnu.org/licenses/>. ##
+##                                                                       ##
+###########################################################################
+
+# Compare xml engines of OsmSaxReader, with decompression in the parsing
+# process or in an external process, on the saint_barthelemy fixture, and
+# on a synthetic file made of several copies of it with shifted ids.
+# With "memory", compare objects kept as dicts and as compact objects.
+#
+# Usage: ./benchmark-osmsax.py [scale] [file]
+#        ./benchmark-osmsax.py memory
+
+from __future__ import print_function
+
+import sys, time, bz2, multiprocessing, resource
+
+sys.path.append("..")
+
+from modules import OsmSax
+
+SRC = "../tests/saint_barthelemy.osm.bz2"
+SHIFT = 3000000000
+
+
+class CountObjects:
+    def __init__(self):
+        self.num = 0
+
+    def NodeCreate(self, data):
+        self.num += 1
+
+    def WayCreate(self, data):
+        self.num += 1
+
+    def RelationCreate(self, data):
+        self.num += 1
+
+
+class ShiftIds:
+    """
+    Write objects of one type, with all ids shifted by a constant.
+    """
+
+    def __init__(self, output, shift, kind):
+        self.output = output
+        self.shift = shift
+        self.kind = kind
+
+    def NodeCreate(self, data):
+        if self.kind == "node":
+            data["id"] += self.shift
+            self.output.NodeCreate(data)
+
+    def WayCreate(self, data):
+        if self.kind == "way":
+            data["id"] += self.shift
+            data["nd"] = [n + self.shift for n in data["nd"]]
+            self.output.WayCreate(data)
+
+    def RelationCreate(self, data):
+        if self.kind == "relation":
+            data["id"] += self.shift
+            for m in data["member"]:
+                m["ref"] += self.shift
+            self.output.RelationCreate(data)
+
+
+def make_file(scale, dst):
+    # nodes, then ways, then relations, as in real extracts
+    out = OsmSax.OsmSaxWriter(bz2.BZ2File(dst, "w"), "UTF-8")
+    out.startDocument()
+    out.startElement("osm", {"version": "0.6"})
+    for kind in ("node", "way", "relation"):
+        for i in range(scale):
+            OsmSax.OsmSaxReader(SRC).CopyTo(ShiftIds(out, i * SHIFT / scale, kind))
+    out.endElement("osm")
+    out.endDocument()
+
+
+def run(src, engine, pipe, conn):
+    if not pipe:
+        OsmSax._Decompressors = {".bz2": [], ".gz": []}
+    o = CountObjects()
+    t0 = time.time()
+    OsmSax.OsmSaxReader(src, engine=engine).CopyTo(o)
+    t = time.time() - t0
+    conn.send((o.num, t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def bench(src, engine, pipe):
+    # each run in its own process, to get its peak memory
+    (p1, p2) = multiprocessing.Pipe()
+    p = multiprocessing.Process(target=run, args=(src, engine, pipe, p2))
+    p.start()
+    (num, t, rss) = p1.recv()
+    p.join()
+    name = "%s %s" % (engine, pipe and "pipe" or "inline")
+    print("%-45s %-12s %8d obj %8.3fs %10.0f obj/s %8d kB peak RSS" % (src, name, num, t, num / t if t else 0, rss))
+
+
+class KeepObjects:
+    def __init__(self):
+        self.data = []
+
+    def NodeCreate(self, data):
+        self.data.append(data)
+
+    WayCreate = RelationCreate = NodeCreate
+
+
+def size(data):
+    # bytes used by the object and its containers, values are not counted
+    # as they are the same in both representations
+    n = sys.getsizeof(data) + sys.getsizeof(getattr(data, "_extra", None) or ())
+    n += sys.getsizeof(data["tag"])
+    if "nd" in data:
+        n += sys.getsizeof(data["nd"])
+    if "member" in data:
+        n += sys.getsizeof(data["member"]) + sum(sys.getsizeof(m) for m in data["member"])
+    return n
+
+
+def run_memory(src, compact, conn):
+    o = KeepObjects()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.time()
+    OsmSax.OsmSaxReader(src, engine="expat", compact=compact).CopyTo(o)
+    t = time.time() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    conn.send((len(o.data), t, sum(size(d) for d in o.data), rss))
+
+
+def main_memory(src):
+    for compact in (False, True):
+        (p1, p2) = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=run_memory, args=(src, compact, p2))
+        p.start()
+        (num, t, nbytes, rss) = p1.recv()
+        p.join()
+        print("%-45s %-8s %8d obj %8.3fs %8.1f bytes/obj %8d kB RSS growth" % (src, compact and "compact" or "dict", num, t, float(nbytes) / num, rss))
+
+
+def main(scale, dst):
+    make_file(scale, dst)
+    for src in (SRC, dst):
+        for engine in ("sax", "expat"):
+            for pipe in (False, True):
+                bench(src, engine, pipe)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "memory":
+        main_memory(SRC)
+        sys.exit(0)
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    dst = sys.argv[2] if len(sys.argv) > 2 else "/tmp/benchmark-osmsax.osm.bz2"
+    main(scale, dst)